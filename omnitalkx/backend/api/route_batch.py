@@ -0,0 +1,86 @@
+import os
+
+from fastapi import APIRouter, Request
+from fastapi.responses import FileResponse
+
+from backend.config.constant import BATCH_MAX_CONCURRENCY, BATCH_MAX_RETRIES, BATCH_MODEL_CONCURRENCY
+from backend.service.batch_service import BATCH_JOBS, create_job, job_paths, resume_job
+from backend.service.service_openrouter import API_KEY_POOL
+
+router = APIRouter()
+
+
+def read_job_options(request: Request):
+    concurrency = request.query_params.get("concurrency", str(BATCH_MODEL_CONCURRENCY))
+    retries = request.query_params.get("retries", str(BATCH_MAX_RETRIES))
+    if not concurrency.isdigit() or not retries.isdigit():
+        return None
+    return max(1, min(int(concurrency), BATCH_MAX_CONCURRENCY)), min(int(retries), 10)
+
+
+@router.post("/batch/jobs")
+async def create_batch_job(request: Request):
+    """
+    创建批量任务：请求体为 JSONL，每行 {"id"?, "provider", "messages", ...}
+    query 参数 concurrency（每个模型的并发数）、retries（最大重试次数）
+    """
+    api_key = request.headers.get("X-Api-Key", "")
+    if not api_key and not API_KEY_POOL:
+        return {"success": False, "msg": "请在设置中输入 API Key"}
+    options = read_job_options(request)
+    if options is None:
+        return {"success": False, "msg": "concurrency / retries 参数无效"}
+    content = await request.body()
+    if not content.strip():
+        return {"success": False, "msg": "请求体不能为空"}
+    try:
+        job = create_job(content, api_key, *options)
+    except ValueError as exc:
+        return {"success": False, "msg": str(exc)}
+    return {"success": True, "job": job.report()}
+
+
+@router.post("/batch/jobs/{job_id}/resume")
+async def resume_batch_job(job_id: str, request: Request):
+    """从检查点继续执行（服务重启后也可以）"""
+    api_key = request.headers.get("X-Api-Key", "")
+    if not api_key and not API_KEY_POOL:
+        return {"success": False, "msg": "请在设置中输入 API Key"}
+    options = read_job_options(request)
+    if options is None:
+        return {"success": False, "msg": "concurrency / retries 参数无效"}
+    job = resume_job(job_id, api_key, *options)
+    if job is None:
+        return {"success": False, "msg": "任务不存在"}
+    return {"success": True, "job": job.report()}
+
+
+@router.get("/batch/jobs/{job_id}")
+async def get_batch_job(job_id: str):
+    """任务进度与吞吐报告"""
+    job = BATCH_JOBS.get(job_id)
+    if job is None:
+        return {"success": False, "msg": "任务不存在或服务已重启，请调用 resume"}
+    return {"success": True, "job": job.report()}
+
+
+@router.delete("/batch/jobs/{job_id}")
+async def cancel_batch_job(job_id: str):
+    """取消任务，已完成的结果保留在输出文件中"""
+    job = BATCH_JOBS.get(job_id)
+    if job is None:
+        return {"success": False, "msg": "任务不存在"}
+    job.cancel()
+    return {"success": True}
+
+
+@router.get("/batch/jobs/{job_id}/results")
+async def get_batch_results(job_id: str):
+    """下载结果 JSONL（任务进行中也可以下载已完成的部分）"""
+    if not job_id.isalnum():
+        return {"success": False, "msg": "任务不存在"}
+    _, output_path = job_paths(job_id)
+    # FileResponse 发送时才读文件，文件不存在要提前判断，否则会变成 500
+    if not os.path.exists(output_path):
+        return {"success": False, "msg": "暂无结果"}
+    return FileResponse(output_path, media_type="application/x-ndjson", filename=f"{job_id}.jsonl")
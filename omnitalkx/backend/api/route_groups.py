@@ -11,10 +11,11 @@ from backend.service.group_service import (
     clear_group_context,
     get_group_announcement,
     update_group_announcement,
-    generate_default_announcement,
     is_default_group,
-    BOT_NAMES
+    get_groups_view,
 )
+from backend.service.prewarm_service import schedule_prewarm
+from backend.util.http_cache import cached_json_response
 
 router = APIRouter()
 
@@ -34,24 +35,10 @@ class UpdateAnnouncementRequest(BaseModel):
 
 
 @router.get("/groups")
-async def get_groups():
-    """获取群组列表"""
-    groups = load_groups()
-    result = []
-    for g in groups:
-        bot_names = [BOT_NAMES.get(b, b) for b in g.get("bots", [])]
-        announcement = g.get("announcement", "")
-        result.append({
-            "id": g["id"],
-            "name": g["name"],
-            "bots": g.get("bots", []),
-            "bot_names": bot_names,
-            "bot_count": len(g.get("bots", [])),
-            "is_default": g.get("is_default", False),
-            "created_at": g.get("created_at", ""),
-            "announcement": announcement
-        })
-    return {"success": True, "groups": result}
+async def get_groups(request: Request):
+    """获取群组列表（预先渲染，轮询时凭 ETag 返回 304）"""
+    view = get_groups_view()
+    return cached_json_response(request, view["response"])
 
 
 @router.post("/groups")
@@ -100,6 +87,8 @@ async def get_group_context_api(group_id: str):
     if not group:
         return {"success": False, "message": "群组不存在"}
     
+    # 打开群组时预热上游连接和提示词前缀，首条消息不再承担冷启动开销
+    schedule_prewarm(group)
     context = get_group_context(group_id)
     return {"success": True, "group_id": group_id, "context": context}
 
@@ -116,19 +105,14 @@ async def clear_group_context_api(group_id: str):
 
 
 @router.get("/groups/{group_id}/announcement")
-async def get_group_announcement_api(group_id: str):
+async def get_group_announcement_api(group_id: str, request: Request):
     """获取群公告"""
-    group = get_group(group_id)
-    if not group:
+    item = get_groups_view()["by_id"].get(group_id)
+    if not item:
         return {"success": False, "message": "群组不存在"}
     
-    announcement = group.get("announcement", "")
-    is_default = is_default_group(group)
-    
-    if is_default:
-        announcement = generate_default_announcement(group)
-    
-    return {"success": True, "announcement": announcement, "is_default": is_default}
+    schedule_prewarm(item["group"])
+    return cached_json_response(request, item["announcement_response"])
 
 
 @router.put("/groups/{group_id}/announcement")
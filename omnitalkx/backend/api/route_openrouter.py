@@ -10,11 +10,76 @@ from backend.service.service_openrouter import (
     get_random_providers,
     get_context,
     clear_context,
+    get_cache_stats,
+    get_endpoint_status,
+    get_key_pool_stats,
+    coalesce_sse,
+    API_KEY_POOL,
+    PROVIDER_REGISTRY,
     PROVIDERS
 )
+from backend.config.constant import STREAM_BUFFER_MAX_BYTES, STREAM_BUFFER_POLICIES
+from backend.service.usage_service import aggregate_daily
+from backend.service.group_service import BOT_PROVIDERS, get_group, get_group_announcement
+from backend.service.progressive_service import (
+    RoundTranscript,
+    normalize_contexts,
+    normalize_speculative,
+    normalize_system_prompts,
+    progressive_round,
+    select_round_providers,
+)
+from backend.util.request_util import ClientDisconnected, run_until_disconnected, stream_until_disconnected
+from backend.util.stream_buffer import BoundedStreamBuffer, get_buffer_stats
+from backend.util.http_cache import PrecomputedJSON
+from backend.service.stream_replay import (
+    ReplayGap,
+    get_replay_stats,
+    merge_event_frames,
+    parse_last_event_id,
+    resume_stream,
+    start_replay_stream,
+)
 
 router = APIRouter()
 
+# 客户端已断开，返回值不会被读取，只用于结束请求
+DISCONNECTED_RESULT = {"success": False, "msg": "客户端已断开"}
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+    "Connection": "keep-alive",
+}
+
+
+def sse_response(request: Request, stream, stream_id: str, label: str = "") -> StreamingResponse:
+    # 缓冲放在回放订阅与 socket 之间：订阅按客户端实际读取速度推进，慢客户端由缓冲策略处理；
+    # 单个流的内存上限为回放缓冲与连接缓冲之和
+    buffered = BoundedStreamBuffer(
+        stream,
+        max_bytes=STREAM_BUFFER_MAX_BYTES,
+        policy=STREAM_BUFFER_POLICIES["chat"],
+        merge=merge_event_frames(coalesce_sse),
+        label=label or stream_id,
+    )
+    return StreamingResponse(
+        stream_until_disconnected(request, buffered.__aiter__()),
+        media_type="text/event-stream",
+        headers={**SSE_HEADERS, "X-Stream-Id": stream_id},
+    )
+
+
+def resume_response(request: Request, stream_id: str, after_seq: int):
+    """按 Last-Event-ID 续传；流不存在返回 None"""
+    try:
+        resumed = resume_stream(stream_id, after_seq)
+    except ReplayGap:
+        return JSONResponse(status_code=410, content={"success": False, "msg": "续传位置已过期，请重新提问"})
+    if resumed is None:
+        return None
+    return sse_response(request, resumed, stream_id)
+
 
 @router.post("/v1/{provider}/chat/completions")
 async def openrouter_chat(provider: str, request: Request):
@@ -31,15 +96,29 @@ async def openrouter_chat(provider: str, request: Request):
 
     custom_api_key = request.headers.get("X-Api-Key", "")
 
-    return StreamingResponse(
-        chat_completion_stream(provider, body, custom_api_key),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no",
-            "Connection": "keep-alive",
-        },
-    )
+    # 断线重连：带 Last-Event-ID 时直接从回放缓冲续传，不再请求上游
+    stream_id, after_seq = parse_last_event_id(request.headers.get("Last-Event-ID", ""))
+    if stream_id:
+        resumed = resume_response(request, stream_id, after_seq)
+        if resumed is not None:
+            return resumed
+
+    replay = start_replay_stream(chat_completion_stream(provider, body, custom_api_key))
+    return sse_response(request, replay.subscribe(), replay.id, label=provider)
+
+
+@router.get("/v1/streams/{stream_id}")
+async def resume_chat_stream(stream_id: str, request: Request, last_event_id: str = ""):
+    """
+    续传指定的流（EventSource 自动重连或前端手动重连）
+    @param stream_id: 首次响应头 X-Stream-Id 中返回的流 id
+    @param last_event_id: 也可以通过 Last-Event-ID 请求头传入
+    """
+    _, after_seq = parse_last_event_id(request.headers.get("Last-Event-ID", "") or last_event_id)
+    resumed = resume_response(request, stream_id, -1 if after_seq is None else after_seq)
+    if resumed is None:
+        return JSONResponse(status_code=404, content={"success": False, "msg": "流不存在或已过期"})
+    return resumed
 
 
 @router.post("/v1/{provider}/chat/completions/non-stream")
@@ -58,8 +137,10 @@ async def openrouter_chat_non_stream(provider: str, request: Request):
     custom_api_key = request.headers.get("X-Api-Key", "")
 
     from backend.service.service_openrouter import chat_completion
-    result = await chat_completion(provider, body, custom_api_key)
-    return result
+    try:
+        return await run_until_disconnected(request, chat_completion(provider, body, custom_api_key))
+    except ClientDisconnected:
+        return DISCONNECTED_RESULT
 
 
 @router.get("/key")
@@ -70,7 +151,8 @@ async def get_api_key():
         masked = key[:8] + "****" + key[-4:]
     else:
         masked = "****" if key else ""
-    return {"has_key": bool(key), "masked_key": masked}
+    # pool_keys：服务端 Key 池中的 Key 数，大于 0 时前端可以不填 Key
+    return {"has_key": bool(key), "masked_key": masked, "pool_keys": len(API_KEY_POOL)}
 
 
 @router.post("/key")
@@ -103,39 +185,97 @@ async def delete_api_key():
         return {"status": "error", "message": str(e)}
 
 
-@router.get("/providers")
-async def get_providers():
-    """获取所有可用的 AI 提供商列表"""
+def build_providers() -> dict:
     return {
         "providers": [
-            {"id": k, "name": v["name"]} for k, v in PROVIDERS.items()
+            {"id": k, "name": v["name"]} for k, v in PROVIDER_REGISTRY.items()
         ]
     }
 
 
-@router.get("/default-prompts")
-async def get_default_prompts():
-    """获取所有 AI 的默认 System Prompt"""
-    # provider 到 model key 的映射
-    provider_to_model = {
-        "openai": "chatgpt",
-        "anthropic": "claude",
-        "xai": "grok",
-        "google": "gemini",
-        "zhipu": "glm",
-        "moonshot": "kimi",
-        "minimax": "minimax",
-        "qwen": "qwen",
-        "deepseek": "deepseek",
-        "bytedance": "seed",
-    }
+# provider 到 model key 的映射
+PROVIDER_TO_MODEL = {
+    "openai": "chatgpt",
+    "anthropic": "claude",
+    "xai": "grok",
+    "google": "gemini",
+    "zhipu": "glm",
+    "moonshot": "kimi",
+    "minimax": "minimax",
+    "qwen": "qwen",
+    "deepseek": "deepseek",
+    "bytedance": "seed",
+}
+
+
+def build_default_prompts() -> dict:
     prompts = {}
-    for provider, model_key in provider_to_model.items():
-        if provider in PROVIDERS:
-            prompts[model_key] = PROVIDERS[provider].get("default_system", "")
+    for provider, model_key in PROVIDER_TO_MODEL.items():
+        if provider in PROVIDER_REGISTRY:
+            prompts[model_key] = PROVIDER_REGISTRY.get(provider).get("default_system", "")
     return {"prompts": prompts}
 
 
+# 只读接口预先序列化、压缩，模型配置热更新（registry 版本变化）后才重建
+PROVIDERS_RESPONSE = PrecomputedJSON(build_providers)
+DEFAULT_PROMPTS_RESPONSE = PrecomputedJSON(build_default_prompts)
+
+
+def precompute_responses():
+    PROVIDERS_RESPONSE.get(PROVIDER_REGISTRY.version)
+    DEFAULT_PROMPTS_RESPONSE.get(PROVIDER_REGISTRY.version)
+
+
+@router.get("/providers")
+async def get_providers(request: Request):
+    """获取所有可用的 AI 提供商列表"""
+    return PROVIDERS_RESPONSE.response(request, PROVIDER_REGISTRY.version)
+
+
+@router.get("/default-prompts")
+async def get_default_prompts(request: Request):
+    """获取所有 AI 的默认 System Prompt"""
+    return DEFAULT_PROMPTS_RESPONSE.response(request, PROVIDER_REGISTRY.version)
+
+
+@router.get("/usage/cache")
+async def get_cache_usage():
+    """获取各 AI 的提示词缓存命中统计"""
+    return {"success": True, "stats": get_cache_stats()}
+
+
+@router.get("/upstreams")
+async def get_upstreams():
+    """获取各上游（OpenRouter、自定义的本地推理服务）的健康状态与 bot 路由"""
+    return {"success": True, **get_endpoint_status()}
+
+
+@router.get("/usage/keys")
+async def get_key_usage():
+    """获取 Key 池中各 Key 的权重、冷却状态与用量计数"""
+    return {"success": True, "keys": get_key_pool_stats()}
+
+
+@router.get("/usage/daily")
+def get_daily_usage(days: int = 7, group_by: str = "provider"):
+    """
+    按天汇总 token 用量与费用，group_by 可选 provider / group_id / key_id / model。
+    汇总要读取用量日志文件，用普通函数让 FastAPI 放到线程池执行，不阻塞事件循环
+    """
+    if group_by not in {"provider", "group_id", "key_id", "model"}:
+        return {"success": False, "msg": "group_by 参数无效"}
+    days = max(1, min(days, 90))
+    return {"success": True, "rows": aggregate_daily(days=days, group_by=group_by)}
+
+
+@router.get("/streams/stats")
+async def get_stream_stats():
+    """获取活跃流连接的缓冲内存统计，total_buffered_bytes 为连接缓冲与回放缓冲之和"""
+    buffers, replay = get_buffer_stats(), get_replay_stats()
+    total = buffers["buffered_bytes"] + replay["buffered_bytes"]
+    return {"success": True, **buffers, "replay": replay, "total_buffered_bytes": total}
+
+
 @router.post("/api/chat/group")
 async def chat_group(request: Request):
     """群聊 API：@所有人时全部 AI 回复，否则随机 5 个 AI 回复"""
@@ -157,11 +297,61 @@ async def chat_group(request: Request):
     else:
         providers = get_random_providers(5)
     
-    results = await group_chat(providers, message, custom_api_key)
-    
+    try:
+        results = await run_until_disconnected(
+            request, group_chat(providers, message, custom_api_key, data.get("group_id"))
+        )
+    except ClientDisconnected:
+        return DISCONNECTED_RESULT
+
     return {"success": True, "results": results}
 
 
+@router.post("/chat/progressive")
+async def chat_progressive(request: Request):
+    """
+    递进式群聊 API：AI 按随机顺序依次回复，后面的 AI 能看到本轮前面 AI 的回复。
+    整轮在服务端串联，每个 AI 的回复边生成边推送，前一个 AI 结束后立即开始下一个。
+    可选字段：intensity（light/medium/full）、contexts（各 AI 历史）、system_prompts（各 AI 自定义提示词）、
+    speculative（off/strict/loose，提前准备下一个 AI）、temperature / max_tokens / top_p
+    """
+    try:
+        data = await request.json()
+    except Exception:
+        return {"success": False, "msg": "请求体必须是 JSON"}
+
+    custom_api_key = request.headers.get("X-Api-Key", "")
+    message = (data.get("message") or "").strip()
+    group_id = data.get("group_id") or "grp_all"
+
+    if not message:
+        return {"success": False, "msg": "消息不能为空"}
+    # 没有传 Key 时由 Key 池为每个 AI 分配
+    if not custom_api_key and not API_KEY_POOL:
+        return {"success": False, "msg": "请在设置中输入 API Key"}
+    group = get_group(group_id)
+    if group is None:
+        return {"success": False, "msg": "群组不存在"}
+
+    mentioned = data.get("mentioned") or []
+    providers = select_round_providers(group, mentioned, data.get("mention_all", False))
+    if not providers:
+        return {"success": False, "msg": "该群组没有AI成员"}
+
+    transcript = RoundTranscript(
+        message,
+        announcement=get_group_announcement(group_id),
+        intensity=data.get("intensity") or "medium",
+        params=data,
+        contexts=normalize_contexts(data.get("contexts")),
+        system_prompts=normalize_system_prompts(data.get("system_prompts")),
+        mentioned=providers if data.get("mention_all") else [BOT_PROVIDERS.get(m, m) for m in mentioned],
+    )
+    speculative = normalize_speculative(data.get("speculative"))
+    replay = start_replay_stream(progressive_round(providers, transcript, custom_api_key, group_id, speculative))
+    return sse_response(request, replay.subscribe(), replay.id)
+
+
 @router.post("/api/chat/private")
 async def chat_private(request: Request):
     """私聊 API：单个 AI 回复"""
@@ -179,8 +369,12 @@ async def chat_private(request: Request):
     if not message:
         return {"success": False, "msg": "消息不能为空"}
     
-    result = await chat_completion_with_context(provider, message, custom_api_key)
-    return result
+    try:
+        return await run_until_disconnected(
+            request, chat_completion_with_context(provider, message, custom_api_key, data.get("group_id"))
+        )
+    except ClientDisconnected:
+        return DISCONNECTED_RESULT
 
 
 @router.post("/api/chat/mention")
@@ -203,8 +397,13 @@ async def chat_mention(request: Request):
     else:
         providers = mentioned
     
-    results = await group_chat(providers, message, custom_api_key)
-    
+    try:
+        results = await run_until_disconnected(
+            request, group_chat(providers, message, custom_api_key, data.get("group_id"))
+        )
+    except ClientDisconnected:
+        return DISCONNECTED_RESULT
+
     return {"success": True, "results": results}
 
 
@@ -1,12 +1,9 @@
 #!/usr/bin/env python3
 
-import argparse
 import os
 import sys
 from copy import deepcopy
 
-import yaml
-
 from backend.util.log import log
 
 logger = log(__name__)
@@ -55,6 +52,8 @@ class ModelConfig:
 
 
 def init_config() -> BizConfig:
+    import argparse
+
     parser = argparse.ArgumentParser(description="LLM group chat framework")
     parser.add_argument('-f', '--file', type=str, required=True, help='Path to the YAML config file.')
     config_path = parser.parse_args()
@@ -68,6 +67,9 @@ def load_config(config_path) -> BizConfig:
         logger.error(f"invalid path: {config_path}, not exist or not file")
         sys.exit(-1)
 
+    # yaml 只有从配置文件启动时才需要，延迟导入以缩短冷启动
+    import yaml
+
     with open(config_path) as fin:
         m = yaml.safe_load(fin)
         if not m or len(m) == 0:
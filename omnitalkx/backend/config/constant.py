@@ -7,3 +7,54 @@ TIMEOUT_SECONDS = 30
 
 DEFAULT_TIMEOUT_SECONDS = 600
 
+# 流式响应缓冲：单连接缓冲上限，以及各模式下缓冲满时的策略（block / coalesce / drop）
+STREAM_BUFFER_MAX_BYTES = 256 * 1024
+STREAM_BUFFER_POLICIES = {
+    "chat": "coalesce",
+}
+
+# 可续传流：单个流回放缓冲上限、结束后保留时长、断线后等待重连的时长、最多保留的流数量
+REPLAY_MAX_BYTES_PER_STREAM = 512 * 1024
+REPLAY_TTL_SECONDS = 120
+REPLAY_RESUME_GRACE_SECONDS = 30
+REPLAY_MAX_STREAMS = 256
+
+# 打开群组时预热上游连接与提示词前缀：同一群组的最小间隔、全局令牌桶（每秒 / 突发）、单次最多预热的连接数
+PREWARM_ENABLED = True
+PREWARM_GROUP_INTERVAL_SECONDS = 60
+PREWARM_RATE_PER_SECOND = 0.5
+PREWARM_BURST = 3
+PREWARM_MAX_CONNECTIONS = 4
+
+# 批量评测：每个模型的并发数、可重试错误的最大重试次数
+BATCH_MODEL_CONCURRENCY = 4
+BATCH_MAX_RETRIES = 3
+BATCH_MAX_CONCURRENCY = 32
+
+# 递进式互动：互动强度对应的前置发言条数（None 为全部）、前置发言总字数上限、未 @ 时随机参与的 AI 数、
+# 单个 AI 上游无输出的超时（超时跳过该 AI）、finish_reason 之后后台读取 usage 帧的最长时间
+PROGRESSIVE_INTENSITY = {"light": 2, "medium": 4, "full": None}
+PROGRESSIVE_PREVIOUS_MAX_CHARS = 6000
+PROGRESSIVE_RANDOM_BOTS = 5
+PROGRESSIVE_IDLE_TIMEOUT_SECONDS = 60
+PROGRESSIVE_DRAIN_TIMEOUT_SECONDS = 15
+# 递进式互动的预启动（请求里 speculative 开启时生效）：前一个 AI 输出达到该字数后开始准备下一个。
+# strict 提前拼好 payload 并预热连接，finish_reason 时才发请求；loose 直接带着前一个 AI 的部分回复发请求
+PROGRESSIVE_SPECULATIVE_MODES = ("off", "strict", "loose")
+PROGRESSIVE_SPECULATIVE_MIN_CHARS = 40
+
+# 自定义上游（models_override.json 的 endpoints，如本地 vLLM / llama.cpp / LMDeploy）：单个上游的连接池大小、
+# 连续失败多少次后熔断、熔断冷却时长，以及配置变更后旧连接池延迟关闭的时间（让进行中的流读完）
+ENDPOINT_MAX_CONNECTIONS = 32
+ENDPOINT_MAX_KEEPALIVE_CONNECTIONS = 16
+ENDPOINT_FAILURE_THRESHOLD = 3
+ENDPOINT_COOLDOWN_SECONDS = 30
+ENDPOINT_RETIRE_SECONDS = 120
+
+# OpenRouter Key 池（backend/config/api_key_pool.json）：429 没有 Retry-After 时的退避基数与上限、
+# 额度耗尽（402）和 Key 无效（401/403）后的冷却时长，以及检查配置文件变化的最小间隔
+KEY_POOL_BACKOFF_SECONDS = 2
+KEY_POOL_MAX_BACKOFF_SECONDS = 60
+KEY_POOL_EXHAUSTED_COOLDOWN_SECONDS = 600
+KEY_POOL_INVALID_COOLDOWN_SECONDS = 3600
+KEY_POOL_RELOAD_CHECK_SECONDS = 2
@@ -0,0 +1,342 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import deque
+from typing import Optional
+
+from backend.config.constant import BATCH_MAX_RETRIES, BATCH_MODEL_CONCURRENCY
+from backend.service.key_pool import parse_retry_after
+from backend.service.service_openrouter import (
+    API_KEY_POOL,
+    RETRYABLE_STATUS,
+    build_headers,
+    build_payload,
+    extract_delta_text,
+    get_http_client,
+    get_provider_config,
+    missing_key_msg,
+    normalize_error,
+    record_usage,
+    resolve_api_key,
+    send_upstream,
+)
+from backend.util.log import log
+
+logger = log(__name__)
+
+BATCH_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "batch")
+
+# job id -> BatchJob，只保存本进程内的任务；重启后通过 resume 从输出文件恢复
+BATCH_JOBS = {}
+
+
+def item_key(item: dict, line_no: int) -> str:
+    """优先使用条目自带的 id，否则按行号"""
+    return str(item.get("id") or f"line-{line_no}")
+
+
+def read_items(input_path: str) -> list:
+    """读取输入 JSONL：每行 {"id"?, "provider", "messages", 其他请求参数...}"""
+    items = []
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                raise ValueError(f"第 {line_no} 行不是合法的 JSON")
+            if not isinstance(item, dict) or not item.get("provider") or not isinstance(item.get("messages"), list):
+                raise ValueError(f"第 {line_no} 行缺少 provider 或 messages")
+            items.append((item_key(item, line_no), item))
+    return items
+
+
+def drop_partial_line(output_path: str):
+    """
+    上次中断在半行处时截掉这半行（之后会重新请求），避免和新记录粘在一起。
+    按字节处理：半行可能断在中文等多字节字符中间
+    """
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        if end == 0:
+            return
+        f.seek(end - 1)
+        if f.read(1) == b"\n":
+            return
+        pos = end
+        while pos > 0:
+            start = max(0, pos - 65536)
+            f.seek(start)
+            index = f.read(pos - start).rfind(b"\n")
+            if index != -1:
+                f.truncate(start + index + 1)
+                return
+            pos = start
+        f.truncate(0)
+
+
+def read_checkpoint(output_path: str) -> set:
+    """输出文件即检查点：已写入（成功或最终失败）的条目在续跑时跳过"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["id"])
+            except (json.JSONDecodeError, KeyError, TypeError):
+                # 进程中断时最后一行可能只写了一半
+                continue
+    return done
+
+
+def retry_delay(attempt: int, retry_after: Optional[str]) -> float:
+    """优先按 Retry-After（秒数或 HTTP 日期）等待，最多 60 秒；没有时指数退避"""
+    delay = parse_retry_after(retry_after)
+    if delay is not None:
+        return min(delay, 60.0)
+    return min(0.7 * 2 ** (attempt - 1), 30.0)
+
+
+async def complete_once(provider: str, item: dict, api_key: str, max_retries: int) -> dict:
+    """
+    通过该 bot 上游的连接池完成一条请求，网络错误和可重试状态码按退避重试。
+    没有传 Key 时每次尝试都从 Key 池取 Key，池中的 Key 被限流后换 Key 立即重试
+    """
+    cfg = get_provider_config(provider)
+    body = {k: v for k, v in item.items() if k not in ("id", "provider")}
+    payload = build_payload(provider, body)
+    payload["stream"] = False
+    endpoint = cfg["endpoint"]
+    client = get_http_client(endpoint)
+
+    started = time.monotonic()
+    error = ""
+    for attempt in range(1, max_retries + 2):
+        key = resolve_api_key(cfg, api_key)
+        if key is None:
+            error = missing_key_msg()
+            if attempt > max_retries:
+                break
+            await asyncio.sleep(retry_delay(attempt, None))
+            continue
+        headers = build_headers(cfg, key)
+        try:
+            response = await send_upstream(client, endpoint.url, headers, payload)
+        except Exception as exc:
+            error = normalize_error(str(exc))
+            if attempt > max_retries:
+                break
+            await asyncio.sleep(retry_delay(attempt, None))
+            continue
+
+        if response.status_code in RETRYABLE_STATUS and attempt <= max_retries:
+            error = normalize_error(response.text)
+            if response.status_code == 429 and API_KEY_POOL.owns(key):
+                continue
+            await asyncio.sleep(retry_delay(attempt, response.headers.get("retry-after")))
+            continue
+        if response.status_code >= 400:
+            error = normalize_error(response.text)
+            break
+
+        result = response.json()
+        usage = result.get("usage") or {}
+        record_usage(provider, payload["model"], usage, key)
+        return {
+            "success": True,
+            "content": extract_delta_text(result),
+            "model": payload["model"],
+            "usage": usage,
+            "attempts": attempt,
+            "latency_ms": round((time.monotonic() - started) * 1000),
+        }
+
+    return {
+        "success": False,
+        "msg": error or "请求失败",
+        "model": payload["model"],
+        "attempts": attempt,
+        "latency_ms": round((time.monotonic() - started) * 1000),
+    }
+
+
+class BatchJob:
+    """
+    一次批量评测任务。
+    条目按模型分组，每个模型由固定数量的 worker 消费，互不抢占并发额度；
+    结果逐条追加到输出 JSONL 并立即 flush，中断后从输出文件恢复进度。
+    """
+
+    def __init__(
+        self,
+        input_path: str,
+        output_path: str,
+        api_key: str,
+        concurrency: int = BATCH_MODEL_CONCURRENCY,
+        max_retries: int = BATCH_MAX_RETRIES,
+        job_id: str = None,
+    ):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.input_path = input_path
+        self.output_path = output_path
+        self.api_key = api_key
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max(0, max_retries)
+        self.status = "pending"
+        self.error = ""
+        self.total = 0
+        self.skipped = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.tokens = 0
+        self.models = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _write(self, out, key: str, provider: str, result: dict):
+        out.write(json.dumps({"id": key, "provider": provider, **result}, ensure_ascii=False) + "\n")
+        out.flush()
+
+    def _account(self, result: dict):
+        stats = self.models.setdefault(result["model"], {"done": 0, "failed": 0, "tokens": 0, "latency_ms": 0})
+        stats["done"] += 1
+        stats["latency_ms"] += result["latency_ms"]
+        if result["success"]:
+            self.succeeded += 1
+            tokens = result["usage"].get("completion_tokens") or 0
+            self.tokens += tokens
+            stats["tokens"] += tokens
+        else:
+            self.failed += 1
+            stats["failed"] += 1
+
+    async def _worker(self, pending: deque, out):
+        while pending:
+            key, item = pending.popleft()
+            provider = item["provider"]
+            try:
+                result = await complete_once(provider, item, self.api_key, self.max_retries)
+            except Exception as exc:
+                result = {"success": False, "msg": str(exc), "model": provider, "attempts": 0, "latency_ms": 0}
+            self._account(result)
+            self._write(out, key, provider, result)
+
+    async def run(self) -> dict:
+        self.status = "running"
+        self.started_at = time.monotonic()
+        try:
+            items = read_items(self.input_path)
+            drop_partial_line(self.output_path)
+            done = read_checkpoint(self.output_path)
+            self.total = len(items)
+            queues = {}
+            for key, item in items:
+                if key in done:
+                    self.skipped += 1
+                    continue
+                try:
+                    model_id = get_provider_config(item["provider"])["id"]
+                except Exception:
+                    model_id = item["provider"]
+                queues.setdefault(model_id, deque()).append((key, item))
+
+            os.makedirs(os.path.dirname(os.path.abspath(self.output_path)), exist_ok=True)
+            with open(self.output_path, "a", encoding="utf-8") as out:
+                workers = [
+                    self._worker(pending, out)
+                    for pending in queues.values()
+                    for _ in range(min(self.concurrency, len(pending)))
+                ]
+                await asyncio.gather(*workers)
+            self.status = "done"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            raise
+        except Exception as exc:
+            self.status = "failed"
+            self.error = str(exc)
+            logger.error("batch job failed, id=%s error=%r", self.id, exc)
+        finally:
+            self.finished_at = time.monotonic()
+        return self.report()
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    def cancel(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    def report(self) -> dict:
+        """吞吐报告：完成数、失败数、每秒条数、每秒输出 token 数、各模型平均延迟"""
+        end = self.finished_at or time.monotonic()
+        elapsed = (end - self.started_at) if self.started_at else 0.0
+        processed = self.succeeded + self.failed
+        return {
+            "id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "total": self.total,
+            "skipped": self.skipped,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "remaining": max(self.total - self.skipped - processed, 0),
+            "elapsed_seconds": round(elapsed, 3),
+            "items_per_second": round(processed / elapsed, 3) if elapsed else 0.0,
+            "tokens_per_second": round(self.tokens / elapsed, 3) if elapsed else 0.0,
+            "models": {
+                model: {**stats, "avg_latency_ms": round(stats["latency_ms"] / stats["done"]) if stats["done"] else 0}
+                for model, stats in self.models.items()
+            },
+            "output": self.output_path,
+        }
+
+
+def job_paths(job_id: str):
+    job_dir = os.path.join(BATCH_DIR, job_id)
+    return os.path.join(job_dir, "input.jsonl"), os.path.join(job_dir, "output.jsonl")
+
+
+def create_job(content: bytes, api_key: str, concurrency: int, max_retries: int) -> BatchJob:
+    """保存上传的 JSONL 并启动任务；输入先整体校验，格式错误直接拒绝"""
+    job_id = uuid.uuid4().hex[:12]
+    input_path, output_path = job_paths(job_id)
+    os.makedirs(os.path.dirname(input_path), exist_ok=True)
+    with open(input_path, "wb") as f:
+        f.write(content)
+    try:
+        read_items(input_path)
+    except ValueError:
+        os.remove(input_path)
+        os.rmdir(os.path.dirname(input_path))
+        raise
+    job = BatchJob(input_path, output_path, api_key, concurrency, max_retries, job_id=job_id)
+    BATCH_JOBS[job_id] = job
+    job.start()
+    return job
+
+
+def resume_job(job_id: str, api_key: str, concurrency: int, max_retries: int) -> Optional[BatchJob]:
+    """按输出文件中的进度继续（进程重启后也可以）"""
+    if not job_id.isalnum():
+        return None
+    job = BATCH_JOBS.get(job_id)
+    if job is not None and job.status == "running":
+        return job
+    input_path, output_path = job_paths(job_id)
+    if not os.path.exists(input_path):
+        return None
+    job = BatchJob(input_path, output_path, api_key, concurrency, max_retries, job_id=job_id)
+    BATCH_JOBS[job_id] = job
+    job.start()
+    return job
@@ -3,6 +3,11 @@ import os
 from datetime import datetime
 from typing import List, Dict, Optional
 
+from backend.util.http_cache import CachedBody
+from backend.util.log import log
+
+logger = log(__name__)
+
 GROUPS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "groups.json")
 CONTEXTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "contexts")
 
@@ -21,11 +26,25 @@ BOT_NAMES = {
     "seed": "Seed",
 }
 
-ALL_BOTS_SET = set(DEFAULT_BOTS)
+# bot -> OpenRouter 提供商，与前端 model-config 保持一致
+BOT_PROVIDERS = {
+    "chatgpt": "openai",
+    "claude": "anthropic",
+    "grok": "xai",
+    "gemini": "google",
+    "glm": "zhipu",
+    "kimi": "moonshot",
+    "minimax": "minimax",
+    "qwen": "qwen",
+    "deepseek": "deepseek",
+    "seed": "bytedance",
+}
 
-if not os.path.exists(CONTEXTS_DIR):
-    os.makedirs(CONTEXTS_DIR)
+ALL_BOTS_SET = set(DEFAULT_BOTS)
 
+# 群组视图缓存：展示用的名称、公告、人数以及序列化好的响应体，只在群组变更后重建
+_groups_version = 0
+_groups_view = None
 
 def load_groups() -> List[Dict]:
     """加载群组列表"""
@@ -58,19 +77,85 @@ def save_groups(groups: List[Dict]) -> bool:
     try:
         with open(GROUPS_FILE, 'w', encoding='utf-8') as f:
             json.dump(groups, f, ensure_ascii=False, indent=2)
+        invalidate_groups_view()
         return True
     except Exception as e:
-        print(f"保存群组失败: {e}")
+        logger.error("保存群组失败: %r", e)
         return False
 
 
+def invalidate_groups_view() -> None:
+    """群组变更后调用，下次读取时重建视图"""
+    global _groups_version, _groups_view
+    _groups_version += 1
+    _groups_view = None
+
+
+def _groups_file_signature():
+    # 手工修改 groups.json 也能被感知
+    try:
+        stat = os.stat(GROUPS_FILE)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def build_group_item(group: Dict) -> Dict:
+    """单个群组的展示数据：可读名称、人数、最终生效的公告"""
+    bots = group.get("bots", [])
+    default_group = is_default_group(group)
+    announcement = group.get("announcement", "")
+    effective = announcement or generate_default_announcement(group)
+    announcement_response = CachedBody({
+        "success": True,
+        "announcement": generate_default_announcement(group) if default_group else announcement,
+        "is_default": default_group,
+    })
+    return {
+        "group": group,
+        "summary": {
+            "id": group["id"],
+            "name": group["name"],
+            "bots": bots,
+            "bot_names": [BOT_NAMES.get(b, b) for b in bots],
+            "bot_count": len(bots),
+            "is_default": group.get("is_default", False),
+            "created_at": group.get("created_at", ""),
+            "announcement": announcement,
+        },
+        "effective_announcement": effective,
+        "announcement_response": announcement_response,
+    }
+
+
+def get_groups_view() -> Dict:
+    """
+    带版本号的群组视图。groups.json 未变化时直接返回缓存，
+    /groups 和群公告接口据此用 ETag 响应 304。
+    """
+    global _groups_view
+    view = _groups_view
+    if view is not None and view["signature"] == (_groups_version, _groups_file_signature()):
+        return view
+
+    groups = load_groups()
+    items = [build_group_item(g) for g in groups]
+    view = {
+        "signature": (_groups_version, _groups_file_signature()),
+        "version": _groups_version,
+        "by_id": {item["group"]["id"]: item for item in items},
+        "response": CachedBody({"success": True, "groups": [item["summary"] for item in items]}),
+    }
+    _groups_view = view
+    return view
+
+
 def get_group(group_id: str) -> Optional[Dict]:
     """获取指定群组"""
-    groups = load_groups()
-    for g in groups:
-        if g["id"] == group_id:
-            return g
-    return None
+    item = get_groups_view()["by_id"].get(group_id)
+    if item is None:
+        return None
+    return dict(item["group"])
 
 
 def create_group(name: str, bots: List[str]) -> Optional[Dict]:
@@ -157,8 +242,14 @@ def get_group_context(group_id: str) -> Dict[str, List[Dict]]:
         return json.load(f)
 
 
+def ensure_contexts_dir() -> None:
+    """创建上下文目录（启动时调用，不在 import 时产生副作用）"""
+    os.makedirs(CONTEXTS_DIR, exist_ok=True)
+
+
 def init_group_context(group_id: str) -> None:
     """初始化群组上下文文件"""
+    ensure_contexts_dir()
     context_file = os.path.join(CONTEXTS_DIR, f"{group_id}.json")
     if not os.path.exists(context_file):
         with open(context_file, 'w', encoding='utf-8') as f:
@@ -256,15 +347,10 @@ def generate_default_announcement(group: Dict) -> str:
 
 def get_group_announcement(group_id: str) -> str:
     """获取群公告，如果未设置则返回默认模板"""
-    group = get_group(group_id)
-    if not group:
+    item = get_groups_view()["by_id"].get(group_id)
+    if item is None:
         return ""
-    
-    announcement = group.get("announcement", "")
-    if announcement:
-        return announcement
-    
-    return generate_default_announcement(group)
+    return item["effective_announcement"]
 
 
 def update_group_announcement(group_id: str, announcement: str) -> Optional[Dict]:
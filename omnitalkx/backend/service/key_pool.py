@@ -0,0 +1,282 @@
+import json
+import os
+import time
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Mapping, Optional
+
+from backend.config.constant import (
+    KEY_POOL_BACKOFF_SECONDS,
+    KEY_POOL_EXHAUSTED_COOLDOWN_SECONDS,
+    KEY_POOL_INVALID_COOLDOWN_SECONDS,
+    KEY_POOL_MAX_BACKOFF_SECONDS,
+    KEY_POOL_RELOAD_CHECK_SECONDS,
+)
+from backend.service.usage_service import key_fingerprint
+from backend.util.log import log
+
+logger = log(__name__)
+
+AUTH_HEADER = "Authorization"
+
+
+def parse_retry_after(value: str) -> Optional[float]:
+    """Retry-After 可以是秒数，也可以是 HTTP 日期"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_rate_limit_reset(value: str) -> Optional[float]:
+    """X-RateLimit-Reset：OpenRouter 给的是毫秒时间戳，也兼容秒级时间戳和剩余秒数"""
+    try:
+        reset = float(value)
+    except (TypeError, ValueError):
+        return None
+    if reset > 1e12:
+        reset /= 1000
+    if reset > 1e9:
+        reset -= time.time()
+    return max(0.0, reset)
+
+
+class PooledKey:
+    """Key 池中的一个 Key：权重、平滑加权轮询的当前值、冷却状态和用量计数"""
+
+    def __init__(self, name: str, key: str, weight: int):
+        self.name = name
+        self.key = key
+        self.key_id = key_fingerprint(key)
+        self.weight = weight
+        self.current = 0
+        self.cooldown_until = 0.0
+        self.cooldown_reason = ""
+        # 连续 429 次数，没有 Retry-After 时按它指数退避
+        self.strikes = 0
+        self.requests = 0
+        self.successes = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+    def available(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+    def cool_down(self, seconds: float, reason: str):
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + seconds)
+        self.cooldown_reason = reason
+        logger.warning("api key %s cooling down %.0fs, reason=%s", self.name, seconds, reason)
+
+    def stats(self) -> dict:
+        remaining = self.cooldown_until - time.monotonic()
+        return {
+            "name": self.name,
+            "key_id": self.key_id,
+            "weight": self.weight,
+            "available": remaining <= 0,
+            "cooldown_seconds": max(0, round(remaining, 1)),
+            "cooldown_reason": self.cooldown_reason if remaining > 0 else "",
+            "requests": self.requests,
+            "successes": self.successes,
+            "rate_limited": self.rate_limited,
+            "errors": self.errors,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost": round(self.cost, 6),
+        }
+
+
+class ApiKeyPool:
+    """
+    运营方配置的 OpenRouter Key 池（api_key_pool.json），前端没有传 Key 时使用。
+    按权重平滑轮询分配 Key；从 429 / Retry-After / X-RateLimit-* 学习每个 Key 的限流状态，
+    被限流、额度耗尽或无效的 Key 自动冷却，冷却期内不再分配。
+    配置文件变化时热更新，仍在池中的 Key 保留状态与计数。
+    """
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._keys = []
+        self._by_key: Mapping[str, PooledKey] = {}
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self.version = 0
+
+    def __len__(self) -> int:
+        self.reload_if_changed()
+        return len(self._keys)
+
+    def _read(self) -> list:
+        if not self._path.exists():
+            return []
+        data = json.loads(self._path.read_text(encoding="utf-8"))
+        items = data.get("keys") if isinstance(data, dict) else None
+        if not isinstance(items, list):
+            raise ValueError("api_key_pool.json 必须是 {\"keys\": [...]}")
+
+        entries = []
+        seen = set()
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                raise ValueError(f"keys[{index}] 必须是对象")
+            key = item.get("key") or os.environ.get(item.get("key_env") or "", "")
+            if not isinstance(key, str) or not key.strip():
+                # 引用的环境变量没有设置时跳过这个 Key，不影响其他 Key
+                logger.warning("api key pool entry %s has no key, skipped", item.get("name") or index)
+                continue
+            weight = item.get("weight", 1)
+            if not isinstance(weight, int) or isinstance(weight, bool) or weight <= 0:
+                raise ValueError(f"keys[{index}].weight 必须是正整数")
+            key = key.strip()
+            if key in seen:
+                continue
+            seen.add(key)
+            entries.append((str(item.get("name") or f"key-{index + 1}"), key, weight))
+        return entries
+
+    def reload(self) -> bool:
+        """重新读取 Key 池；文件无效时记录错误并保留当前的 Key"""
+        try:
+            mtime = self._path.stat().st_mtime if self._path.exists() else None
+            entries = self._read()
+        except Exception as exc:
+            logger.error("加载 %s 失败，继续使用当前 Key 池: %r", self._path, exc)
+            # 记下出错文件的 mtime，文件再次修改前不重复读取
+            try:
+                self._mtime = self._path.stat().st_mtime
+            except OSError:
+                self._mtime = None
+            self.version = self.version or 1
+            return False
+
+        keys = []
+        for name, key, weight in entries:
+            pooled = self._by_key.get(key)
+            if pooled is None:
+                pooled = PooledKey(name, key, weight)
+            pooled.name, pooled.weight = name, weight
+            keys.append(pooled)
+        self._keys = keys
+        self._by_key = {pooled.key: pooled for pooled in keys}
+        self._mtime = mtime
+        self.version += 1
+        if keys or self.version > 1:
+            logger.info("api key pool loaded, keys=%s", len(keys))
+        return True
+
+    def reload_if_changed(self):
+        """按最小间隔检查配置文件的 mtime，变化时重新加载"""
+        now = time.monotonic()
+        if self.version and now - self._checked_at < KEY_POOL_RELOAD_CHECK_SECONDS:
+            return
+        self._checked_at = now
+        try:
+            mtime = self._path.stat().st_mtime if self._path.exists() else None
+        except OSError:
+            return
+        if not self.version or mtime != self._mtime:
+            self.reload()
+
+    def acquire(self, exclude: str = None) -> str:
+        """
+        平滑加权轮询（与 nginx 相同）：每次给可用 Key 加上各自权重，取当前值最大的，再减去总权重。
+        没有可用 Key 时返回空字符串
+        """
+        self.reload_if_changed()
+        now = time.monotonic()
+        best = None
+        total = 0
+        for pooled in self._keys:
+            if pooled.key == exclude or not pooled.available(now):
+                continue
+            pooled.current += pooled.weight
+            total += pooled.weight
+            if best is None or pooled.current > best.current:
+                best = pooled
+        if best is None:
+            return ""
+        best.current -= total
+        best.requests += 1
+        return best.key
+
+    def owns(self, api_key: str) -> bool:
+        return bool(api_key) and api_key in self._by_key
+
+    def key_in(self, headers: Mapping[str, str]) -> str:
+        """请求头里用的是池中的 Key 时返回它，否则返回空字符串"""
+        value = headers.get(AUTH_HEADER) or ""
+        key = value.split(" ", 1)[-1]
+        return key if self.owns(key) else ""
+
+    def retry_after(self) -> float:
+        """距离最早一个 Key 冷却结束的秒数"""
+        if not self._keys:
+            return 0.0
+        return max(0.0, min(pooled.cooldown_until for pooled in self._keys) - time.monotonic())
+
+    def observe(self, headers: Mapping[str, str], status_code: int, response_headers: Mapping[str, str]):
+        """根据上游响应更新请求所用 Key 的限流状态；不是池中的 Key 时忽略"""
+        pooled = self._by_key.get(self.key_in(headers))
+        if pooled is None:
+            return
+        if status_code == 429:
+            pooled.rate_limited += 1
+            pooled.strikes += 1
+            delay = parse_retry_after(response_headers.get("retry-after"))
+            if delay is None:
+                delay = parse_rate_limit_reset(response_headers.get("x-ratelimit-reset"))
+            if delay is None:
+                delay = min(KEY_POOL_BACKOFF_SECONDS * 2 ** (pooled.strikes - 1), KEY_POOL_MAX_BACKOFF_SECONDS)
+            pooled.cool_down(delay, "rate_limited")
+            return
+        if status_code == 402:
+            pooled.errors += 1
+            pooled.cool_down(KEY_POOL_EXHAUSTED_COOLDOWN_SECONDS, "insufficient_credits")
+            return
+        if status_code in (401, 403):
+            pooled.errors += 1
+            pooled.cool_down(KEY_POOL_INVALID_COOLDOWN_SECONDS, "invalid_key")
+            return
+        if status_code >= 400:
+            pooled.errors += 1
+            return
+
+        pooled.successes += 1
+        pooled.strikes = 0
+        # 成功响应也会带限流余量，额度用完时提前冷却到重置时间
+        if response_headers.get("x-ratelimit-remaining") == "0":
+            delay = parse_rate_limit_reset(response_headers.get("x-ratelimit-reset"))
+            if delay:
+                pooled.cool_down(delay, "rate_limit_reached")
+
+    def rotate(self, headers: dict) -> bool:
+        """被限流后重试前换一个池中的 Key（原地修改请求头）；不是池中的 Key 或没有其他可用 Key 时返回 False"""
+        current = self.key_in(headers)
+        if not current:
+            return False
+        key = self.acquire(exclude=current)
+        if not key:
+            return False
+        headers[AUTH_HEADER] = f"Bearer {key}"
+        return True
+
+    def record_usage(self, api_key: str, usage: dict):
+        pooled = self._by_key.get(api_key) if api_key else None
+        if pooled is None or not isinstance(usage, dict):
+            return
+        pooled.prompt_tokens += usage.get("prompt_tokens") or 0
+        pooled.completion_tokens += usage.get("completion_tokens") or 0
+        pooled.cost += float(usage.get("cost") or 0)
+
+    def stats(self) -> list:
+        self.reload_if_changed()
+        return [pooled.stats() for pooled in self._keys]
@@ -0,0 +1,141 @@
+import asyncio
+import time
+
+from backend.config.constant import (
+    PREWARM_BURST,
+    PREWARM_ENABLED,
+    PREWARM_GROUP_INTERVAL_SECONDS,
+    PREWARM_MAX_CONNECTIONS,
+    PREWARM_RATE_PER_SECOND,
+)
+from backend.service.group_service import BOT_PROVIDERS, get_group_announcement
+from backend.service.service_openrouter import (
+    OPENROUTER_URL,
+    PROVIDER_REGISTRY,
+    build_prompt_prefix,
+    get_http_client,
+    uses_cache_control,
+)
+from backend.service.upstream_endpoint import UpstreamEndpoint
+from backend.util.log import log
+
+logger = log(__name__)
+
+# 只为建立连接，HEAD 请求不产生计费
+WARM_URL = OPENROUTER_URL.rsplit("/chat/", 1)[0] + "/models"
+
+# group id -> 上次预热时间
+LAST_PREWARM = {}
+PREWARM_STATS = {"scheduled": 0, "skipped": 0, "connections": 0, "prefixes": 0, "errors": 0}
+_pending_tasks = set()
+
+
+class TokenBucket:
+    """全局令牌桶，防止频繁切换群组时预热本身造成请求尖峰"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def acquire(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+PREWARM_BUCKET = TokenBucket(PREWARM_RATE_PER_SECOND, PREWARM_BURST)
+
+
+async def warm_connections(count: int, endpoint: UpstreamEndpoint = None) -> int:
+    """并发发起 count 个 HEAD 请求，让上游的连接池里留下对应数量的 keep-alive 连接（默认 OpenRouter）"""
+    client = get_http_client(endpoint)
+    url = endpoint.models_url if endpoint is not None else WARM_URL
+    results = await asyncio.gather(
+        *(client.head(url) for _ in range(count)),
+        return_exceptions=True,
+    )
+    failed = [r for r in results if isinstance(r, Exception)]
+    if failed:
+        logger.warning("prewarm connection failed, count=%s error=%r", len(failed), failed[0])
+    return count - len(failed)
+
+
+def warm_prefixes(group_id: str, bots: list) -> int:
+    """
+    为每个成员构建系统提示词 + 群公告前缀，写入前缀缓存。
+    只有带 cache_control 标记的提供方会缓存前缀，其他提供方构建出来也不会被复用，直接跳过
+    """
+    announcement = get_group_announcement(group_id)
+    built = 0
+    for bot in bots:
+        provider = BOT_PROVIDERS.get(bot)
+        if not provider or provider not in PROVIDER_REGISTRY or not uses_cache_control(provider):
+            continue
+        try:
+            build_prompt_prefix(provider, announcement)
+            built += 1
+        except Exception as exc:
+            logger.warning("prewarm prefix failed, bot=%s error=%r", bot, exc)
+    return built
+
+
+def count_endpoints(bots: list) -> dict:
+    """按上游统计群成员数，不同上游的连接池分别预热"""
+    counts = {}
+    for bot in bots:
+        provider = BOT_PROVIDERS.get(bot)
+        if provider and provider in PROVIDER_REGISTRY:
+            endpoint = PROVIDER_REGISTRY.get(provider)["endpoint"]
+            counts[endpoint] = counts.get(endpoint, 0) + 1
+    return counts
+
+
+async def prewarm_group(group_id: str, bots: list):
+    try:
+        built = warm_prefixes(group_id, bots)
+        warmed = await asyncio.gather(*(
+            warm_connections(min(count, PREWARM_MAX_CONNECTIONS), endpoint)
+            for endpoint, count in count_endpoints(bots).items()
+        ))
+        connections = sum(warmed)
+        PREWARM_STATS["prefixes"] += built
+        PREWARM_STATS["connections"] += connections
+        logger.info("prewarm group done, group=%s prefixes=%s connections=%s", group_id, built, connections)
+    except Exception as exc:
+        PREWARM_STATS["errors"] += 1
+        logger.warning("prewarm group failed, group=%s error=%r", group_id, exc)
+
+
+def schedule_prewarm(group: dict) -> bool:
+    """
+    打开群组时在后台预热，不阻塞当前请求。
+    同一群组在间隔内只预热一次，全局再受令牌桶限制；返回是否真正发起了预热。
+    """
+    if not PREWARM_ENABLED or not group:
+        return False
+    group_id = group["id"]
+    now = time.monotonic()
+    last = LAST_PREWARM.get(group_id)
+    if last is not None and now - last < PREWARM_GROUP_INTERVAL_SECONDS:
+        PREWARM_STATS["skipped"] += 1
+        return False
+    if not PREWARM_BUCKET.acquire():
+        PREWARM_STATS["skipped"] += 1
+        return False
+
+    LAST_PREWARM[group_id] = now
+    PREWARM_STATS["scheduled"] += 1
+    task = asyncio.ensure_future(prewarm_group(group_id, list(group.get("bots", []))))
+    _pending_tasks.add(task)
+    task.add_done_callback(_pending_tasks.discard)
+    return True
+
+
+def get_prewarm_stats() -> dict:
+    return {**PREWARM_STATS, "tracked_groups": len(LAST_PREWARM)}
@@ -0,0 +1,503 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional
+
+from backend.config.constant import (
+    PROGRESSIVE_DRAIN_TIMEOUT_SECONDS,
+    PROGRESSIVE_IDLE_TIMEOUT_SECONDS,
+    PROGRESSIVE_INTENSITY,
+    PROGRESSIVE_PREVIOUS_MAX_CHARS,
+    PROGRESSIVE_RANDOM_BOTS,
+    PROGRESSIVE_SPECULATIVE_MIN_CHARS,
+    PROGRESSIVE_SPECULATIVE_MODES,
+)
+from backend.service.group_service import BOT_PROVIDERS
+from backend.service.prewarm_service import warm_connections
+from backend.service.service_openrouter import (
+    ANNOUNCEMENT_PREFIX,
+    API_KEY_POOL,
+    PROMPT_LEAK_MATCHER,
+    PROVIDER_REGISTRY,
+    build_headers,
+    build_prompt_prefix,
+    cached_system_prefix,
+    extract_delta_text,
+    fetch_with_retry,
+    format_model_error,
+    get_google_fallbacks,
+    get_http_client,
+    get_provider_config,
+    mark_cache_breakpoint,
+    missing_key_msg,
+    record_usage,
+    resolve_api_key,
+    should_fallback_on_error,
+    uses_cache_control,
+)
+from backend.service.upstream_endpoint import EndpointUnavailable
+from backend.util.leak_filter import StreamLeakFilter
+from backend.util.log import log
+
+logger = log(__name__)
+
+MENTION_NOTE = "注意：用户在群聊中@了你，请优先回应。"
+PREVIOUS_HEADER = "【前置发言】"
+# 前端可以透传的采样参数，其余字段忽略
+PASSTHROUGH_PARAMS = ("temperature", "max_tokens", "top_p")
+# API Key 无效：整轮终止，不再尝试后面的 AI
+FATAL_STATUS = {401}
+
+# 后台任务（finish_reason 之后读取 usage 帧、预启动时预热连接），保留引用避免被回收
+BACKGROUND_TASKS = set()
+
+
+class RoundAborted(Exception):
+    """网络错误或 API Key 无效，终止整轮递进"""
+
+
+class BotSkipped(Exception):
+    """单个 AI 出错、超时或返回空内容，跳过后继续下一个"""
+
+
+class RoundTranscript:
+    """
+    一轮递进对话的共享记录。
+    用户消息、采样参数、群公告只整理一次；各 AI 的系统前缀按 provider 缓存，
+    前置发言区块只在有新回复时重新渲染，每个 AI 的 payload 都由这些共享部分拼出。
+    """
+
+    def __init__(
+        self,
+        message: str,
+        announcement: str = "",
+        intensity: str = "medium",
+        params: Optional[dict] = None,
+        contexts: Optional[Dict[str, list]] = None,
+        system_prompts: Optional[Dict[str, str]] = None,
+        mentioned: Iterable[str] = (),
+    ):
+        self.user_message = {"role": "user", "content": message}
+        self.announcement = announcement
+        self.limit = PROGRESSIVE_INTENSITY.get(intensity, PROGRESSIVE_INTENSITY["medium"])
+        self.params = {k: v for k, v in (params or {}).items() if k in PASSTHROUGH_PARAMS and v is not None}
+        self.contexts = contexts or {}
+        self.system_prompts = system_prompts or {}
+        self.mentioned = set(mentioned)
+        self.replies: List[tuple] = []
+        self._prefixes: Dict[str, list] = {}
+        self._bases: Dict[str, list] = {}
+        self._block: Optional[dict] = None
+
+    def add_reply(self, provider: str, text: str):
+        """AI 完整回复后加入前置发言"""
+        self.replies.append((get_provider_config(provider)["name"], text))
+        self._block = None
+
+    def previous_block(self, pending: Optional[tuple] = None) -> Optional[dict]:
+        """
+        【前置发言】系统消息：按互动强度取最近几条，超出字数上限时优先保留最近的。
+        pending 为 (provider, 部分回复)，loose 预启动时把还没说完的回复也放进去（不缓存）
+        """
+        if pending is not None:
+            provider, partial = pending
+            name = get_provider_config(provider)["name"]
+            return self._render_block(self.replies + [(f"{name}（未说完）", partial)])
+        if self._block is None and self.replies:
+            self._block = self._render_block(self.replies)
+        return self._block
+
+    def _render_block(self, replies: List[tuple]) -> dict:
+        recent = replies if self.limit is None else replies[-self.limit:]
+        lines = []
+        budget = PROGRESSIVE_PREVIOUS_MAX_CHARS
+        for name, text in reversed(recent):
+            line = f"{name}说：{text}"
+            if len(line) > budget:
+                if not lines:
+                    lines.append(f"{name}说：…{text[-budget:]}")
+                break
+            lines.append(line)
+            budget -= len(line) + 1
+        return {"role": "system", "content": PREVIOUS_HEADER + "\n" + "\n".join(reversed(lines))}
+
+    def prefix_for(self, provider: str) -> list:
+        """系统提示词（用户自定义优先）+ 群公告，跨 AI、跨轮次不变，可命中提示词缓存"""
+        prefix = self._prefixes.get(provider)
+        if prefix is None:
+            custom = (self.system_prompts.get(provider) or "").strip()
+            if custom:
+                prefix = [{"role": "system", "content": custom}]
+                if self.announcement:
+                    prefix.append({"role": "system", "content": f"{ANNOUNCEMENT_PREFIX}{self.announcement}"})
+                if uses_cache_control(provider):
+                    prefix = [cached_system_prefix(message) for message in prefix]
+            else:
+                prefix = build_prompt_prefix(provider, self.announcement)
+            self._prefixes[provider] = prefix
+        return prefix
+
+    def prepare(self, provider: str) -> list:
+        """拼好与前置发言无关的部分：系统前缀 → 历史 → @ 提醒，预启动时提前调用"""
+        base = self._bases.get(provider)
+        if base is None:
+            base = list(self.prefix_for(provider))
+            history = self.contexts.get(provider) or []
+            if history:
+                base.extend(history[:-1])
+                last = history[-1]
+                base.append(mark_cache_breakpoint(last) if uses_cache_control(provider) else last)
+            if provider in self.mentioned:
+                base.append({"role": "system", "content": MENTION_NOTE})
+            self._bases[provider] = base
+        return base
+
+    def payload_for(self, provider: str, model_id: str, pending: Optional[tuple] = None) -> dict:
+        """
+        消息顺序：系统前缀 → 历史 → 本轮提示（@ 提醒、前置发言）→ 用户消息。
+        本轮才有的内容放在历史之后，前面的部分在各轮之间保持不变。
+        """
+        cfg = get_provider_config(provider)
+        messages = list(self.prepare(provider))
+        block = self.previous_block(pending)
+        if block is not None:
+            messages.append(block)
+        messages.append(self.user_message)
+        return {
+            **cfg["payload_defaults"],
+            **self.params,
+            "model": model_id,
+            "messages": messages,
+            "stream": True,
+            **cfg["endpoint"].payload_extras,
+        }
+
+
+def frame(data: dict) -> str:
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def parse_data_line(line: str) -> Optional[dict]:
+    line = line.strip()
+    if not line.startswith("data:"):
+        return None
+    data = line[5:].strip()
+    if not data or data == "[DONE]":
+        return None
+    try:
+        parsed = json.loads(data)
+    except json.JSONDecodeError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def normalize_contexts(contexts) -> Dict[str, list]:
+    """前端上传的各 AI 历史（provider 或 bot 名 -> 消息列表），只保留 role / content"""
+    if not isinstance(contexts, dict):
+        return {}
+    result = {}
+    for key, messages in contexts.items():
+        if not isinstance(messages, list):
+            continue
+        result[BOT_PROVIDERS.get(key, key)] = [
+            {"role": m["role"], "content": m["content"]}
+            for m in messages
+            if isinstance(m, dict) and m.get("role") in ("user", "assistant") and isinstance(m.get("content"), str)
+        ]
+    return result
+
+
+def normalize_system_prompts(prompts) -> Dict[str, str]:
+    """前端的各 AI 自定义提示词（provider 或 bot 名 -> 文本）"""
+    if not isinstance(prompts, dict):
+        return {}
+    return {BOT_PROVIDERS.get(k, k): v for k, v in prompts.items() if isinstance(v, str) and v.strip()}
+
+
+def select_round_providers(group: dict, mentioned: Iterable[str] = (), mention_all: bool = False) -> List[str]:
+    """
+    参与本轮的 AI，顺序每次随机打乱：
+    @ 了具体 AI 时只有被 @ 的；@所有人 或自定义群组为全部成员；全员群未 @ 时随机若干个
+    """
+    mentioned = [m for m in mentioned if m and m != "all"]
+    bots = list(group.get("bots", []))
+    if mentioned:
+        bots = mentioned
+    elif not mention_all and group.get("id") == "grp_all":
+        bots = random.sample(bots, min(PROGRESSIVE_RANDOM_BOTS, len(bots)))
+
+    providers = []
+    for bot in bots:
+        provider = BOT_PROVIDERS.get(bot, bot)
+        if provider in PROVIDER_REGISTRY and provider not in providers:
+            providers.append(provider)
+    random.shuffle(providers)
+    return providers
+
+
+async def open_bot_stream(provider: str, transcript: RoundTranscript, client, headers: dict, pending: tuple = None):
+    """
+    发起上游流式请求，返回 (响应, 模型 id)；google 按备选模型依次尝试。
+    自定义上游走各自的连接池，它不可用时只跳过这个 AI，不影响走 OpenRouter 的其他 AI
+    """
+    cfg = get_provider_config(provider)
+    endpoint = cfg["endpoint"]
+    if not endpoint.is_default:
+        client = get_http_client(endpoint)
+    candidates = get_google_fallbacks(cfg["id"]) if provider == "google" else [cfg["id"]]
+    last_error = None
+    for model_id in candidates:
+        try:
+            upstream = await fetch_with_retry(
+                client, endpoint.url, headers, transcript.payload_for(provider, model_id, pending)
+            )
+        except EndpointUnavailable as exc:
+            raise BotSkipped(format_model_error(model_id, str(exc)))
+        except Exception as exc:
+            if not endpoint.is_default:
+                raise BotSkipped(format_model_error(model_id, str(exc)))
+            raise RoundAborted(format_model_error(model_id, str(exc)))
+        if upstream.status_code < 400:
+            return upstream, model_id
+
+        raw = (await upstream.aread()).decode("utf-8", "ignore")
+        await upstream.aclose()
+        last_error = format_model_error(model_id, raw or f"HTTP {upstream.status_code}")
+        # 自定义上游或 Key 池中某个 Key 的 401 只影响这个 AI（池中的 Key 已进入冷却），只有前端的 Key 无效才终止整轮
+        if upstream.status_code in FATAL_STATUS and endpoint.forward_client_key and not API_KEY_POOL.key_in(headers):
+            raise RoundAborted(last_error)
+        if provider == "google" and should_fallback_on_error(upstream.status_code, raw):
+            continue
+        raise BotSkipped(last_error)
+    raise BotSkipped(last_error or "请求失败")
+
+
+async def drain_usage(lines, upstream, provider: str, model_id: str, api_key: str, group_id: str, request_id: str):
+    """读完 finish_reason 之后的帧（通常是 usage），记账后归还连接"""
+    try:
+        async for line in lines:
+            parsed = parse_data_line(line)
+            if parsed and parsed.get("usage"):
+                record_usage(provider, model_id, parsed["usage"], api_key, group_id, request_id)
+    except Exception as exc:
+        logger.info("progressive usage drain stopped, provider=%s error=%r", provider, exc)
+    finally:
+        await upstream.aclose()
+
+
+def track_task(task: asyncio.Task) -> asyncio.Task:
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
+    # 后台任务失败只影响记账或预热，取走异常避免 "never retrieved" 告警
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return task
+
+
+def spawn_drain(*args) -> asyncio.Task:
+    return track_task(asyncio.ensure_future(asyncio.wait_for(drain_usage(*args), PROGRESSIVE_DRAIN_TIMEOUT_SECONDS)))
+
+
+def new_result(provider: str) -> dict:
+    return {"provider": provider, "success": True, "content": "", "ttft_ms": None}
+
+
+async def stream_bot(
+    provider: str,
+    transcript: RoundTranscript,
+    client,
+    api_key: str,
+    group_id: str,
+    result: dict,
+    pending: tuple = None,
+):
+    """
+    流式读取一个 AI 的回复，逐段产出文本。
+    收到 finish_reason 即返回，让下一个 AI 立刻开始；剩余的 usage 帧交给后台任务读取。
+    前端没有传 Key 时每个 AI 各自从 Key 池取 Key，整轮的请求分摊到多个 Key 上。
+    """
+    started = time.perf_counter()
+    cfg = get_provider_config(provider)
+    api_key = resolve_api_key(cfg, api_key)
+    if api_key is None:
+        raise RoundAborted(missing_key_msg())
+    headers = build_headers(cfg, api_key)
+    upstream, model_id = await open_bot_stream(provider, transcript, client, headers, pending)
+    # 被限流重试时可能换过 Key，记账用实际发出的 Key
+    api_key = API_KEY_POOL.key_in(headers) or api_key
+    request_id = uuid.uuid4().hex
+    leak_filter = StreamLeakFilter(PROMPT_LEAK_MATCHER)
+    lines = upstream.aiter_lines()
+    parts = []
+    handed_off = False
+    try:
+        while True:
+            try:
+                line = await asyncio.wait_for(lines.__anext__(), PROGRESSIVE_IDLE_TIMEOUT_SECONDS)
+            except StopAsyncIteration:
+                break
+            except asyncio.TimeoutError:
+                raise BotSkipped(f"[{model_id}] 响应超时")
+            parsed = parse_data_line(line)
+            if parsed is None:
+                continue
+            if parsed.get("usage"):
+                record_usage(provider, model_id, parsed["usage"], api_key, group_id, request_id)
+            delta = leak_filter.feed(extract_delta_text(parsed))
+            if delta:
+                if result["ttft_ms"] is None:
+                    result["ttft_ms"] = round((time.perf_counter() - started) * 1000)
+                parts.append(delta)
+                yield delta
+            if (parsed.get("choices") or [{}])[0].get("finish_reason"):
+                break
+
+        tail = leak_filter.flush()
+        if tail:
+            parts.append(tail)
+            yield tail
+        spawn_drain(lines, upstream, provider, model_id, api_key, group_id, request_id)
+        handed_off = True
+    finally:
+        if not handed_off:
+            await upstream.aclose()
+
+    result["content"] = "".join(parts)
+    if not result["content"].strip():
+        raise BotSkipped(f"[{model_id}] 模型返回空内容")
+
+
+class AheadRun:
+    """
+    loose 预启动：下一个 AI 基于前一个 AI 的部分回复提前发出请求，
+    输出先缓存在队列里，轮到它时再按顺序转发给客户端。
+    """
+
+    def __init__(self, provider: str, stream):
+        self.provider = provider
+        self.result = new_result(provider)
+        self.result["speculative"] = True
+        self.queue = asyncio.Queue()
+        self.task = asyncio.ensure_future(self._run(stream(self.result)))
+
+    async def _run(self, deltas):
+        try:
+            async for delta in deltas:
+                await self.queue.put(delta)
+            await self.queue.put(None)
+        except Exception as exc:
+            await self.queue.put(exc)
+
+    async def deltas(self):
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    async def cancel(self):
+        if not self.task.done():
+            self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+
+
+def normalize_speculative(value) -> str:
+    """请求里的 speculative：true 等同 strict，未知取值视为关闭"""
+    if value is True:
+        return "strict"
+    return value if value in PROGRESSIVE_SPECULATIVE_MODES else "off"
+
+
+def start_ahead(mode: str, provider: str, transcript: RoundTranscript, current: str, partial: str, stream_args: tuple):
+    """
+    前一个 AI 已输出足够多内容时准备下一个：
+    strict 只提前拼好 payload 并预热一个上游连接，finish_reason 时才发请求；
+    loose 直接带着前一个 AI 的部分回复发请求
+    """
+    if mode == "loose":
+        pending = (current, partial)
+        return AheadRun(provider, lambda result: stream_bot(provider, transcript, *stream_args, result, pending))
+    transcript.prepare(provider)
+    track_task(asyncio.ensure_future(warm_connections(1, get_provider_config(provider)["endpoint"])))
+    return None
+
+
+async def progressive_round(
+    providers: List[str],
+    transcript: RoundTranscript,
+    api_key: str,
+    group_id: str = None,
+    speculative: str = "off",
+):
+    """
+    服务端递进：按顺序依次调用各 AI，每个 AI 的回复边生成边推送，
+    不同 AI 之间用 {"separator": true, "next_provider": ...} 分隔；
+    单个 AI 失败跳过，网络错误或 API Key 无效时终止整轮。最后一帧汇总各 AI 的结果与耗时。
+    speculative 为 strict / loose 时，前一个 AI 输出超过 PROGRESSIVE_SPECULATIVE_MIN_CHARS 后提前准备下一个。
+    """
+    client = get_http_client()
+    stream_args = (client, api_key, group_id)
+    started = time.perf_counter()
+    results = []
+    ahead: Optional[AheadRun] = None
+    try:
+        for index, provider in enumerate(providers):
+            next_provider = providers[index + 1] if index + 1 < len(providers) else None
+            if index:
+                yield frame({"separator": True, "next_provider": provider})
+            bot_started = time.perf_counter()
+            if ahead is not None and ahead.provider == provider:
+                result = ahead.result
+                source = ahead.deltas()
+            else:
+                result = new_result(provider)
+                source = stream_bot(provider, transcript, *stream_args, result)
+            ahead = None
+            prepared = speculative == "off" or next_provider is None
+            chars = 0
+            parts = []
+            try:
+                async for delta in source:
+                    yield frame({"provider": provider, "content": delta, "finished": False})
+                    chars += len(delta)
+                    if speculative == "loose":
+                        parts.append(delta)
+                    if not prepared and chars >= PROGRESSIVE_SPECULATIVE_MIN_CHARS:
+                        prepared = True
+                        ahead = start_ahead(speculative, next_provider, transcript, provider, "".join(parts), stream_args)
+                transcript.add_reply(provider, result["content"])
+            except BotSkipped as exc:
+                logger.warning("progressive bot skipped, provider=%s error=%s", provider, exc)
+                result.update(success=False, error=str(exc))
+                # 基于这段没有完成的回复提前启动的下一个 AI 作废，轮到它时重新请求
+                if ahead is not None:
+                    await ahead.cancel()
+                    ahead = None
+            result["latency_ms"] = round((time.perf_counter() - bot_started) * 1000)
+            results.append(result)
+            done = {"provider": provider, "content": "", "finished": True, "success": result["success"]}
+            if not result["success"]:
+                done["error"] = result["error"]
+            yield frame(done)
+    except RoundAborted as exc:
+        logger.warning("progressive round aborted, error=%s", exc)
+        yield frame({"success": False, "msg": str(exc), "results": results})
+        yield "data: [DONE]\n\n"
+        return
+    finally:
+        if ahead is not None:
+            await ahead.cancel()
+
+    summary = {
+        "success": any(item["success"] for item in results),
+        "results": results,
+        "round_ms": round((time.perf_counter() - started) * 1000),
+        "speculative": speculative,
+    }
+    if not summary["success"]:
+        summary["msg"] = "本轮没有 AI 成功回复"
+    yield frame(summary)
+    yield "data: [DONE]\n\n"
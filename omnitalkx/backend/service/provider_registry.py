@@ -0,0 +1,241 @@
+import asyncio
+import json
+import signal
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Mapping, Optional
+
+from fastapi import HTTPException
+
+from backend.config.constant import ENDPOINT_RETIRE_SECONDS
+from backend.service.upstream_endpoint import (
+    DEFAULT_ENDPOINT,
+    DIALECT_OPENROUTER,
+    OPENROUTER_PROFILE,
+    UpstreamEndpoint,
+    normalize_profile,
+)
+from backend.util.log import log
+
+logger = log(__name__)
+
+BASE_HEADERS = {
+    "Content-Type": "application/json",
+    "HTTP-Referer": "https://omnitalkx.example.com",
+    "X-Title": "OmniTalk X",
+}
+
+# 自定义上游（OpenAI 兼容接口）只需要 Content-Type，OpenRouter 的归因头对它们没有意义
+OPENAI_HEADERS = {
+    "Content-Type": "application/json",
+}
+
+PAYLOAD_DEFAULTS = {
+    "temperature": 0.9,
+    "max_tokens": 3000,
+}
+
+WATCH_INTERVAL_SECONDS = 2.0
+
+
+class ProviderRegistry:
+    """
+    提供方注册表：启动时一次性编译 PROVIDERS + models_override.json，
+    查询为 O(1) 字典访问；覆盖文件变化时整体原子替换快照。
+    已经拿到旧配置的请求（包括进行中的流）不受替换影响。
+    每个 bot 的 endpoint 编译成 UpstreamEndpoint，配置不变的上游在重载后继续复用原连接池。
+    """
+
+    def __init__(self, base: dict, override_path: Path):
+        self._base = base
+        self._override_path = override_path
+        self._entries: Mapping[str, Mapping[str, Any]] = MappingProxyType({})
+        self._mtime: Optional[float] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        self._endpoints: Mapping[str, UpstreamEndpoint] = MappingProxyType({})
+        self._retiring = set()
+        self.version = 0
+
+    @property
+    def entries(self) -> Mapping[str, Mapping[str, Any]]:
+        # 首次访问时才编译（通常在 lifespan 启动阶段），import 时不读磁盘
+        if not self.version:
+            self.reload()
+        return self._entries
+
+    def get(self, provider: str) -> Mapping[str, Any]:
+        """按 provider 获取配置，未知 provider 返回 404"""
+        entries = self.entries
+        cfg = entries.get(provider)
+        if cfg is None:
+            cfg = entries.get(provider.lower())
+        if cfg is None:
+            raise HTTPException(status_code=404, detail="未支持的提供方")
+        return cfg
+
+    def keys(self) -> list:
+        return list(self.entries.keys())
+
+    def items(self):
+        return self.entries.items()
+
+    def __contains__(self, provider: str) -> bool:
+        return provider in self.entries
+
+    @property
+    def endpoints(self) -> Mapping[str, UpstreamEndpoint]:
+        if not self.version:
+            self.reload()
+        return self._endpoints
+
+    def _read_overrides(self) -> tuple:
+        """返回 (命名上游配置, 各 bot 的覆盖配置)"""
+        if not self._override_path.exists():
+            return {}, {}
+        data = json.loads(self._override_path.read_text(encoding="utf-8"))
+        if not isinstance(data, dict):
+            raise ValueError("models_override.json 顶层必须是对象")
+
+        raw_profiles = data.get("endpoints") or {}
+        if not isinstance(raw_profiles, dict):
+            raise ValueError("endpoints 必须是对象")
+        if DEFAULT_ENDPOINT in raw_profiles:
+            raise ValueError(f"endpoints.{DEFAULT_ENDPOINT} 是内置上游，不能覆盖")
+        profiles = {name: normalize_profile(name, raw) for name, raw in raw_profiles.items()}
+
+        overrides = {}
+        for key, val in data.items():
+            if key == "endpoints":
+                continue
+            if key not in self._base:
+                logger.warning("models_override.json 中的未知提供方: %s", key)
+                continue
+            if not isinstance(val, dict):
+                raise ValueError(f"{key} 的覆盖配置必须是对象")
+            model_id = val.get("id")
+            if model_id is not None and (not isinstance(model_id, str) or not model_id.strip()):
+                raise ValueError(f"{key}.id 必须是非空字符串")
+            endpoint = val.get("endpoint")
+            if isinstance(endpoint, str):
+                if endpoint != DEFAULT_ENDPOINT and endpoint not in profiles:
+                    raise ValueError(f"{key}.endpoint 引用了未定义的上游: {endpoint}")
+            elif isinstance(endpoint, dict):
+                # 直接写在 bot 下的上游配置，以 bot 名作为上游名
+                profiles[key] = normalize_profile(key, endpoint)
+                val = {**val, "endpoint": key}
+            elif endpoint is not None:
+                raise ValueError(f"{key}.endpoint 必须是上游名称或对象")
+            headers = val.get("headers")
+            if headers is not None and (
+                not isinstance(headers, dict) or not all(isinstance(v, str) for v in headers.values())
+            ):
+                raise ValueError(f"{key}.headers 必须是字符串到字符串的对象")
+            overrides[key] = val
+        return profiles, overrides
+
+    def _build_endpoints(self, profiles: dict) -> Mapping[str, UpstreamEndpoint]:
+        """配置未变化的上游沿用现有对象（连接池、健康状态）"""
+        profiles = {DEFAULT_ENDPOINT: normalize_profile(DEFAULT_ENDPOINT, OPENROUTER_PROFILE), **profiles}
+        endpoints = {}
+        for name, profile in profiles.items():
+            current = self._endpoints.get(name)
+            if current is not None and current.profile == profile:
+                endpoints[name] = current
+            else:
+                endpoints[name] = UpstreamEndpoint(name, profile)
+        return MappingProxyType(endpoints)
+
+    def _compile(self, profiles: dict, overrides: dict) -> tuple:
+        endpoints = self._build_endpoints(profiles)
+        entries = {}
+        for key, base_cfg in self._base.items():
+            cfg = dict(base_cfg)
+            override = overrides.get(key, {})
+            if override.get("id"):
+                cfg["id"] = override["id"].strip()
+            endpoint = endpoints[override.get("endpoint") or base_cfg.get("endpoint") or DEFAULT_ENDPOINT]
+            base_headers = BASE_HEADERS if endpoint.dialect == DIALECT_OPENROUTER else OPENAI_HEADERS
+            cfg["endpoint"] = endpoint
+            cfg["headers"] = MappingProxyType({**base_headers, **endpoint.headers, **override.get("headers", {})})
+            cfg["payload_defaults"] = MappingProxyType(dict(PAYLOAD_DEFAULTS))
+            entries[key.lower()] = MappingProxyType(cfg)
+        return MappingProxyType(entries), endpoints
+
+    def _retire(self, endpoints: list):
+        """
+        配置变更后不再使用的上游连接池延迟关闭，让进行中的流读完；
+        没有运行中的事件循环时（脚本、测试）直接丢弃，连接池随对象回收
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        for endpoint in endpoints:
+            loop.call_later(ENDPOINT_RETIRE_SECONDS, self._close_endpoint, endpoint)
+
+    def _close_endpoint(self, endpoint: UpstreamEndpoint):
+        task = asyncio.ensure_future(endpoint.aclose())
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+
+    async def close_endpoints(self):
+        """关闭所有自定义上游的连接池，应用退出时调用"""
+        await asyncio.gather(*(endpoint.aclose() for endpoint in self._endpoints.values()), return_exceptions=True)
+
+    def reload(self) -> bool:
+        """重新编译注册表；覆盖文件无效时记录错误并保留当前快照"""
+        try:
+            mtime = self._override_path.stat().st_mtime if self._override_path.exists() else None
+            entries, endpoints = self._compile(*self._read_overrides())
+        except Exception as exc:
+            logger.error("加载 %s 失败，继续使用当前配置: %r", self._override_path, exc)
+            # 记下出错文件的 mtime，文件再次修改前轮询不再重复读取和报错
+            try:
+                mtime = self._override_path.stat().st_mtime
+            except OSError:
+                mtime = None
+            if self.version:
+                self._mtime = mtime
+                return False
+            # 首次加载就失败时退回内置配置，避免每次访问都重新读盘
+            entries, endpoints = self._compile({}, {})
+
+        retired = [ep for name, ep in self._endpoints.items() if endpoints.get(name) is not ep]
+        self._entries = entries
+        self._endpoints = endpoints
+        self._retire(retired)
+        self._mtime = mtime
+        self.version += 1
+        logger.info("provider registry loaded, version=%s", self.version)
+        return True
+
+    def reload_if_changed(self) -> bool:
+        """覆盖文件的 mtime 变化时重新加载"""
+        try:
+            mtime = self._override_path.stat().st_mtime if self._override_path.exists() else None
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        return self.reload()
+
+    async def _watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            self.reload_if_changed()
+
+    def start_watcher(self, interval: float = WATCH_INTERVAL_SECONDS):
+        """启动覆盖文件轮询，并在支持的平台上注册 SIGHUP 触发重载"""
+        loop = asyncio.get_running_loop()
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = loop.create_task(self._watch(interval))
+        if hasattr(signal, "SIGHUP"):
+            try:
+                loop.add_signal_handler(signal.SIGHUP, self.reload)
+            except (NotImplementedError, RuntimeError, ValueError):
+                pass
+
+    def stop_watcher(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
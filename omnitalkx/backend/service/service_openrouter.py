@@ -1,14 +1,23 @@
+from __future__ import annotations
+
 import asyncio
 import json
 import random
+import time
+import uuid
 from pathlib import Path
-from typing import Any
-
-import httpx
-from fastapi import HTTPException
+from typing import TYPE_CHECKING, Any, Optional
 
+from backend.service.key_pool import ApiKeyPool
+from backend.service.provider_registry import ProviderRegistry
+from backend.service.upstream_endpoint import OPENROUTER_BASE_URL, UpstreamEndpoint, get_health
+from backend.service.usage_service import USAGE_WRITER, build_usage_record
+from backend.util.leak_filter import AhoCorasick, StreamLeakFilter
 from backend.util.log import log
 
+if TYPE_CHECKING:
+    import httpx
+
 try:
     from backend.config.constant import DEFAULT_TIMEOUT_SECONDS
 except ImportError:
@@ -20,14 +29,33 @@ BASE_DIR = Path(__file__).resolve().parent
 API_KEY_FILE = BASE_DIR.parent.parent / "api_key.txt"
 FALLBACK_KEY_FILE = Path.home() / ".omnitalkx" / "api_key.txt"
 
-OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_URL = f"{OPENROUTER_BASE_URL}/chat/completions"
 DEFAULT_API_KEY = ""
 
 MAX_ATTEMPTS = 3
+# 上游错误日志只截取响应体开头，重复的错误由日志限流合并
+UPSTREAM_ERROR_BODY_LIMIT = 200
 RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
 
 CONTEXT_STORAGE = {}
 
+# 全局共享的 OpenRouter 连接池，避免每个请求重新握手；自定义上游各自持有连接池
+HTTP_LIMITS = {"max_connections": 200, "max_keepalive_connections": 50, "keepalive_expiry": 60}
+_http_client: Optional[httpx.AsyncClient] = None
+
+# OpenRouter 对这些提供方需要显式 cache_control 标记；其余（OpenAI/DeepSeek/Grok 等）为自动前缀缓存
+CACHE_CONTROL_PROVIDERS = {"anthropic", "google"}
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# provider -> 缓存命中统计
+CACHE_STATS = {}
+
+# system 提示词 -> 已打好 cache_control 标记的消息，群预热时提前构建
+PREFIX_CACHE = {}
+PREFIX_CACHE_MAX = 512
+
+ANNOUNCEMENT_PREFIX = "【群公告】"
+
 BASE_SYSTEM_PROMPT = (
     "你是群聊中的AI成员，请像真人一样自然简洁地回答。"
     "不要编造用户未说过的内容，不要假设被@，不要自称收到别人的话。"
@@ -45,16 +73,15 @@ PROMPT_LEAK_PATTERNS = [
 ]
 
 
+PROMPT_LEAK_MATCHER = AhoCorasick(PROMPT_LEAK_PATTERNS)
+
+
 def strip_prompt_leak(text: str) -> str:
+    """非流式回复的泄露过滤，与流式路径使用同一个 StreamLeakFilter，规则完全一致"""
     if not text:
         return text
-    lines = [line.strip() for line in text.splitlines() if line.strip()]
-    filtered = []
-    for line in lines:
-        if any(pat in line for pat in PROMPT_LEAK_PATTERNS):
-            continue
-        filtered.append(line)
-    return "\n".join(filtered) if filtered else text
+    leak_filter = StreamLeakFilter(PROMPT_LEAK_MATCHER)
+    return leak_filter.feed(text) + leak_filter.flush()
 
 PROVIDERS = {
     "openai": {
@@ -115,32 +142,32 @@ PROVIDERS = {
 }
 
 
-def load_model_overrides():
+OVERRIDE_FILE = BASE_DIR.parent / "config" / "models_override.json"
+
+PROVIDER_REGISTRY = ProviderRegistry(PROVIDERS, OVERRIDE_FILE)
+
+# 运营方配置的 OpenRouter Key 池，格式见 api_key_pool.example.json
+KEY_POOL_FILE = BASE_DIR.parent / "config" / "api_key_pool.json"
+
+API_KEY_POOL = ApiKeyPool(KEY_POOL_FILE)
+
+
+def load_model_overrides() -> bool:
     """
     Optional override file for self-hosted users.
     Format:
     {
+      "endpoints": {
+        "local-vllm": {"base_url": "http://127.0.0.1:8000/v1", "api_key_env": "VLLM_API_KEY"}
+      },
       "openai": {"id": "..."},
-      "google": {"id": "..."}
+      "qwen": {"id": "Qwen/Qwen2.5-7B-Instruct", "endpoint": "local-vllm"}
     }
+    未指定 endpoint 的 bot 走 OpenRouter。重新编译提供方注册表，文件无效时保留当前配置
     """
-    override_path = Path(__file__).resolve().parent.parent / "config" / "models_override.json"
-    if not override_path.exists():
-        return
-    try:
-        raw = override_path.read_text(encoding="utf-8")
-        data = json.loads(raw)
-        if isinstance(data, dict):
-            for key, val in data.items():
-                if key in PROVIDERS and isinstance(val, dict):
-                    if "id" in val:
-                        PROVIDERS[key]["id"] = val["id"]
-    except Exception:
-        pass
+    return PROVIDER_REGISTRY.reload()
 
 
-load_model_overrides()
-
 GOOGLE_FALLBACK_MODELS = [
     "google/gemini-2.5-flash-lite",
     "google/gemini-2.5-flash",
@@ -204,30 +231,203 @@ def get_context_with_messages(provider: str, user_message: str) -> list:
     return messages
 
 
+def get_http_client(endpoint: UpstreamEndpoint = None) -> httpx.AsyncClient:
+    """
+    获取上游对应的 AsyncClient：自定义上游用各自的连接池，OpenRouter 用共享连接池
+    （按需创建，httpx 也在此时才导入以缩短启动时间）
+    """
+    if endpoint is not None and not endpoint.is_default:
+        return endpoint.client()
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        import httpx
+
+        _http_client = httpx.AsyncClient(timeout=DEFAULT_TIMEOUT_SECONDS, limits=httpx.Limits(**HTTP_LIMITS))
+    return _http_client
+
+
+async def close_http_client():
+    """关闭共享连接池和各自定义上游的连接池，应用退出时调用"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+    await PROVIDER_REGISTRY.close_endpoints()
+
+
 def get_provider_config(provider: str) -> dict:
     """获取提供商配置"""
-    cfg = PROVIDERS.get(provider.lower())
-    if not cfg:
-        raise HTTPException(status_code=404, detail="未支持的提供方")
-    return cfg
+    return PROVIDER_REGISTRY.get(provider)
+
+
+def build_headers(cfg: dict, api_key: str) -> dict:
+    """在预编译的请求头上附加该 bot 上游的鉴权信息"""
+    return {**cfg["headers"], **cfg["endpoint"].auth_headers(api_key)}
+
+
+def requires_client_key(cfg: dict) -> bool:
+    """只有会透传前端 Key 的上游（OpenRouter）才要求请求带 API Key"""
+    return cfg["endpoint"].forward_client_key
+
+
+def resolve_api_key(cfg: dict, custom_api_key: str) -> Optional[str]:
+    """
+    优先使用前端传入的 API Key；没有时从 Key 池按权重轮询取一个。
+    需要 Key 却拿不到（未配置 Key 池或全部在冷却）时返回 None
+    """
+    if custom_api_key or not requires_client_key(cfg):
+        return custom_api_key or ""
+    return API_KEY_POOL.acquire() or None
+
+
+def missing_key_msg() -> str:
+    if len(API_KEY_POOL):
+        return f"API Key 池中的 Key 都在冷却中，请约 {API_KEY_POOL.retry_after():.0f} 秒后重试"
+    return "请在设置中输入 API Key"
+
+
+def uses_cache_control(provider: str) -> bool:
+    """需要显式 cache_control 标记的提供方；自定义上游不认这个标记"""
+    provider = provider.lower()
+    return provider in CACHE_CONTROL_PROVIDERS and get_provider_config(provider)["endpoint"].cache_control
+
+
+def mark_cache_breakpoint(message: dict) -> dict:
+    """把消息内容转成 content parts 并在末尾打上 cache_control 标记"""
+    content = message.get("content")
+    if isinstance(content, str):
+        if not content:
+            return message
+        parts = [{"type": "text", "text": content}]
+    elif isinstance(content, list) and content:
+        parts = [dict(part) for part in content]
+    else:
+        return message
+    parts[-1]["cache_control"] = CACHE_CONTROL
+    return {**message, "content": parts}
+
+
+def cached_system_prefix(message: dict) -> dict:
+    """同一段 system 提示词只标记一次，后续请求直接复用"""
+    content = message.get("content")
+    if not isinstance(content, str) or message.get("role") != "system":
+        return mark_cache_breakpoint(message)
+    marked = PREFIX_CACHE.get(content)
+    if marked is None:
+        if len(PREFIX_CACHE) >= PREFIX_CACHE_MAX:
+            PREFIX_CACHE.pop(next(iter(PREFIX_CACHE)))
+        marked = mark_cache_breakpoint(message)
+        PREFIX_CACHE[content] = marked
+    return marked
+
+
+def build_prompt_prefix(provider: str, announcement: str = "") -> list:
+    """预先构建 bot 的系统提示词 + 群公告前缀"""
+    cfg = get_provider_config(provider)
+    prefix = [{"role": "system", "content": cfg["default_system"]}]
+    if announcement:
+        prefix.append({"role": "system", "content": f"{ANNOUNCEMENT_PREFIX}{announcement}"})
+    if uses_cache_control(provider):
+        prefix = [cached_system_prefix(message) for message in prefix]
+    return prefix
+
+
+def apply_prompt_cache(provider: str, messages: list) -> list:
+    """
+    为支持显式缓存的提供方标记可复用前缀：
+    1. 首条 system 消息（系统提示词，跨轮次不变）
+    2. 最后一条用户消息之前的历史（下一轮会原样作为前缀重发）
+    """
+    if not messages or not uses_cache_control(provider):
+        return messages
+
+    marked = list(messages)
+    if marked[0].get("role") == "system":
+        marked[0] = cached_system_prefix(marked[0])
+
+    history_end = len(marked) - 2
+    if history_end > 0:
+        marked[history_end] = mark_cache_breakpoint(marked[history_end])
+    return marked
 
 
 def build_payload(provider: str, payload: dict[str, Any]) -> dict[str, Any]:
     """构建请求体，添加默认值和系统消息"""
     cfg = get_provider_config(provider)
+    provider = provider.lower()
     normalized = dict(payload or {})
+    # group_id 只用于记账，不发给上游
+    normalized.pop("group_id", None)
     normalized["stream"] = True
     normalized["model"] = cfg["id"]
-    normalized.setdefault("temperature", 0.9)
-    normalized.setdefault("max_tokens", 3000)
+    for key, val in cfg["payload_defaults"].items():
+        normalized.setdefault(key, val)
+    # 让 OpenRouter 在 usage 中返回缓存命中的 token 数；自定义上游没有这类扩展字段
+    normalized.update(cfg["endpoint"].payload_extras)
 
-    messages = normalized.get("messages", [])
+    messages = list(normalized.get("messages", []))
     if messages and messages[0].get("role") != "system":
-        normalized["messages"] = [{"role": "system", "content": cfg["default_system"]}] + messages
+        messages = [{"role": "system", "content": cfg["default_system"]}] + messages
+    if messages:
+        normalized["messages"] = apply_prompt_cache(provider, messages)
 
     return normalized
 
 
+def record_cache_usage(provider: str, usage: dict):
+    """记录 usage 中的缓存命中情况"""
+    if not isinstance(usage, dict):
+        return
+    details = usage.get("prompt_tokens_details") or {}
+    stats = CACHE_STATS.setdefault(provider, {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0})
+    stats["requests"] += 1
+    stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+    stats["cached_tokens"] += details.get("cached_tokens") or 0
+
+
+def record_usage(
+    provider: str,
+    model_id: str,
+    usage: dict,
+    api_key: str = "",
+    group_id: str = None,
+    request_id: str = None,
+):
+    """记录一次请求的 token / 费用，写盘由 USAGE_WRITER 在后台批量完成"""
+    if not isinstance(usage, dict):
+        return
+    record_cache_usage(provider, usage)
+    API_KEY_POOL.record_usage(api_key, usage)
+    USAGE_WRITER.record(build_usage_record(
+        request_id or uuid.uuid4().hex, provider, model_id, usage, api_key, group_id
+    ))
+
+
+def get_endpoint_status() -> dict:
+    """各上游的健康状态，以及每个 bot 当前走的上游"""
+    return {
+        "endpoints": [endpoint.status() for endpoint in PROVIDER_REGISTRY.endpoints.values()],
+        "providers": {key: cfg["endpoint"].name for key, cfg in PROVIDER_REGISTRY.items()},
+    }
+
+
+def get_key_pool_stats() -> list:
+    """Key 池中各 Key 的权重、冷却状态与用量（只返回指纹，不含明文）"""
+    return API_KEY_POOL.stats()
+
+
+def get_cache_stats() -> dict:
+    """获取各提供方的缓存命中统计"""
+    result = {}
+    for provider, stats in CACHE_STATS.items():
+        prompt_tokens = stats["prompt_tokens"]
+        result[provider] = {
+            **stats,
+            "hit_rate": round(stats["cached_tokens"] / prompt_tokens, 4) if prompt_tokens else 0.0,
+        }
+    return result
+
+
 def extract_delta_text(data: dict) -> str:
     """从响应数据中提取文本内容"""
     if not isinstance(data, dict):
@@ -302,19 +502,51 @@ def should_fallback_on_error(status_code: int, raw_text: str) -> bool:
     return False
 
 
+async def send_upstream(
+    client: httpx.AsyncClient,
+    url: str,
+    headers: dict,
+    payload: dict,
+    stream: bool = False,
+) -> httpx.Response:
+    """
+    向上游发一次请求并记录该上游的健康状态与所用 Key 的限流状态；
+    上游处于熔断冷却期时直接抛出 EndpointUnavailable。
+    stream=True 时只读到响应头，响应体由调用方读取并关闭
+    """
+    import httpx
+
+    health = get_health(url)
+    health.check()
+    started = time.monotonic()
+    try:
+        if stream:
+            request = client.build_request("POST", url, headers=headers, json=payload)
+            response = await client.send(request, stream=True)
+        else:
+            response = await client.post(url, headers=headers, json=payload)
+    except (httpx.TimeoutException, httpx.NetworkError) as exc:
+        health.record_failure(repr(exc))
+        raise
+    health.record_status(response.status_code, time.monotonic() - started)
+    API_KEY_POOL.observe(headers, response.status_code, response.headers)
+    return response
+
+
 async def fetch_with_retry(
     client: httpx.AsyncClient,
     url: str,
     headers: dict,
     payload: dict,
 ) -> httpx.Response:
-    """带重试的请求"""
+    """带重试的流式请求"""
+    import httpx
+
     last_error = None
 
     for attempt in range(1, MAX_ATTEMPTS + 1):
         try:
-            request = client.build_request("POST", url, headers=headers, json=payload)
-            response = await client.send(request, stream=True)
+            response = await send_upstream(client, url, headers, payload, stream=True)
         except (httpx.TimeoutException, httpx.NetworkError) as exc:
             last_error = exc
             if attempt >= MAX_ATTEMPTS:
@@ -325,6 +557,9 @@ async def fetch_with_retry(
         if response.status_code in RETRYABLE_STATUS and attempt < MAX_ATTEMPTS:
             await response.aread()
             await response.aclose()
+            # 池中的 Key 被限流时换一个 Key 立即重试
+            if response.status_code == 429 and API_KEY_POOL.rotate(headers):
+                continue
             delay = (1.4 if response.status_code == 429 else 0.7) * attempt
             await asyncio.sleep(delay)
             continue
@@ -342,82 +577,106 @@ def format_sse(delta: str, finish_reason: str = None) -> str:
     return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
 
 
+def parse_sse_delta(frame: str) -> Optional[str]:
+    """解析 format_sse 生成的纯增量帧，带 finish_reason 或其他帧返回 None"""
+    if not frame.startswith("data: {"):
+        return None
+    try:
+        choice = json.loads(frame[6:])["choices"][0]
+    except (ValueError, KeyError, IndexError):
+        return None
+    if choice.get("finish_reason"):
+        return None
+    content = (choice.get("delta") or {}).get("content")
+    return content if isinstance(content, str) else None
+
+
+def coalesce_sse(prev: str, new: str) -> Optional[str]:
+    """客户端读取跟不上时，把两个相邻增量帧合并成一帧"""
+    prev_delta = parse_sse_delta(prev)
+    if prev_delta is None:
+        return None
+    new_delta = parse_sse_delta(new)
+    if new_delta is None:
+        return None
+    return format_sse(prev_delta + new_delta)
+
+
 async def chat_completion_stream(provider: str, payload: dict[str, Any], custom_api_key: str = None):
     """流式聊天完成"""
     cfg = get_provider_config(provider)
 
-    # 优先使用前端传入的 API Key，不再读取后端文件
-    api_key = custom_api_key
-    if not api_key:
+    # 优先使用前端传入的 API Key，没有时使用 Key 池，不再读取后端文件
+    api_key = resolve_api_key(cfg, custom_api_key)
+    if api_key is None:
         yield format_sse("", "stop")
-        yield json.dumps({"success": "false", "msg": "请在设置中输入 API Key"})
+        yield json.dumps({"success": "false", "msg": missing_key_msg()})
         yield "data: [DONE]\n\n"
         return
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}",
-        "HTTP-Referer": "https://omnitalkx.example.com",
-        "X-Title": "OmniTalk X",
-    }
-
-    client = httpx.AsyncClient(timeout=DEFAULT_TIMEOUT_SECONDS)
-    last_error = None
-    model_candidates = (
-        get_google_fallbacks(cfg["id"]) if provider == "google" else [cfg["id"]]
-    )
-    for model_id in model_candidates:
-        normalized = build_payload(provider, payload)
-        normalized["model"] = model_id
-        try:
-            upstream = await fetch_with_retry(client, OPENROUTER_URL, headers, normalized)
-        except Exception as exc:
-            if provider == "google":
-                logger.warning(
-                    "google upstream exception model=%s error=%r",
-                    model_id,
-                    exc,
-                )
-            last_error = format_model_error(model_id, str(exc))
-            continue
+    headers = build_headers(cfg, api_key)
+    request_id = uuid.uuid4().hex
+    leak_filter = StreamLeakFilter(PROMPT_LEAK_MATCHER)
 
-        if upstream.status_code >= 400:
-            raw = await upstream.aread()
-            await upstream.aclose()
-            raw_text = raw.decode("utf-8", "ignore")
-            if provider == "google":
-                logger.warning(
-                    "google upstream error model=%s status=%s body=%s",
-                    model_id,
-                    upstream.status_code,
-                    raw_text[:800],
-                )
-            base_text = raw_text or f"HTTP {upstream.status_code}"
-            last_error = format_model_error(model_id, base_text)
-            if provider == "google" and should_fallback_on_error(upstream.status_code, raw_text):
+    endpoint = cfg["endpoint"]
+    client = get_http_client(endpoint)
+    upstream = None
+    # 客户端断开时生成器会在当前 await 处被取消或被 aclose()，finally 保证上游连接随之归还连接池
+    try:
+        last_error = None
+        model_candidates = (
+            get_google_fallbacks(cfg["id"]) if provider == "google" else [cfg["id"]]
+        )
+        for model_id in model_candidates:
+            normalized = build_payload(provider, payload)
+            normalized["model"] = model_id
+            try:
+                upstream = await fetch_with_retry(client, endpoint.url, headers, normalized)
+            except Exception as exc:
+                if provider == "google":
+                    logger.warning(
+                        "google upstream exception model=%s error=%r",
+                        model_id,
+                        exc,
+                    )
+                last_error = format_model_error(model_id, str(exc))
                 continue
-            await client.aclose()
+
+            if upstream.status_code >= 400:
+                raw = await upstream.aread()
+                await upstream.aclose()
+                raw_text = raw.decode("utf-8", "ignore")
+                if provider == "google":
+                    logger.warning(
+                        "google upstream error model=%s status=%s body=%s",
+                        model_id,
+                        upstream.status_code,
+                        raw_text[:UPSTREAM_ERROR_BODY_LIMIT],
+                    )
+                base_text = raw_text or f"HTTP {upstream.status_code}"
+                last_error = format_model_error(model_id, base_text)
+                if provider == "google" and should_fallback_on_error(upstream.status_code, raw_text):
+                    continue
+                yield format_sse("", "stop")
+                yield json.dumps({"success": "false", "msg": last_error})
+                yield "data: [DONE]\n\n"
+                return
+            # success path；被限流重试时可能换过 Key，记账用实际发出的 Key
+            api_key = API_KEY_POOL.key_in(headers) or api_key
+            break
+        else:
             yield format_sse("", "stop")
-            yield json.dumps({"success": "false", "msg": last_error})
+            if provider == "google":
+                if not last_error or last_error.strip() in {"请求失败", "Request failed"}:
+                    msg = "Gemini 模型暂不可用，请检查 OpenRouter 的 Google 模型权限或额度"
+                else:
+                    msg = last_error
+            else:
+                msg = last_error or "请求失败"
+            yield json.dumps({"success": "false", "msg": msg})
             yield "data: [DONE]\n\n"
             return
-        # success path
-        break
-    else:
-        await client.aclose()
-        yield format_sse("", "stop")
-        if provider == "google":
-            if not last_error or last_error.strip() in {"请求失败", "Request failed"}:
-                msg = "Gemini 模型暂不可用，请检查 OpenRouter 的 Google 模型权限或额度"
-            else:
-                msg = last_error
-        else:
-            msg = last_error or "请求失败"
-        yield json.dumps({"success": "false", "msg": msg})
-        yield "data: [DONE]\n\n"
-        return
 
-    try:
         async for line in upstream.aiter_lines():
             if not line or not line.strip().startswith("data:"):
                 continue
@@ -428,20 +687,30 @@ async def chat_completion_stream(provider: str, payload: dict[str, Any], custom_
 
             try:
                 parsed = json.loads(data)
-                delta = extract_delta_text(parsed)
-                finish_reason = parsed.get("choices", [{}])[0].get("finish_reason")
+                if parsed.get("usage"):
+                    record_usage(
+                        provider, model_id, parsed["usage"], api_key, payload.get("group_id"), request_id
+                    )
+                delta = leak_filter.feed(extract_delta_text(parsed))
+                finish_reason = (parsed.get("choices") or [{}])[0].get("finish_reason")
                 
                 if delta:
                     yield format_sse(delta)
                 if finish_reason:
+                    tail = leak_filter.flush()
+                    if tail:
+                        yield format_sse(tail)
                     yield format_sse("", finish_reason)
             except json.JSONDecodeError:
                 continue
 
+        tail = leak_filter.flush()
+        if tail:
+            yield format_sse(tail)
         yield "data: [DONE]\n\n"
     finally:
-        await upstream.aclose()
-        await client.aclose()
+        if upstream is not None:
+            await upstream.aclose()
 
 
 async def chat_completion(provider: str, payload: dict[str, Any], custom_api_key: str = None):
@@ -450,21 +719,15 @@ async def chat_completion(provider: str, payload: dict[str, Any], custom_api_key
     normalized = build_payload(provider, payload)
     normalized["stream"] = False
 
-    # 优先使用前端传入的 API Key，不再读取后端文件
-    api_key = custom_api_key
-    if not api_key:
-        return {"success": False, "msg": "请在设置中输入 API Key"}
-    
-    print(f"[DEBUG] provider={provider}, api_key={api_key[:10]}..., custom_api_key={custom_api_key[:10] if custom_api_key else None}")
+    # 优先使用前端传入的 API Key，没有时使用 Key 池，不再读取后端文件
+    api_key = resolve_api_key(cfg, custom_api_key)
+    if api_key is None:
+        return {"success": False, "msg": missing_key_msg()}
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}",
-        "HTTP-Referer": "https://omnitalkx.example.com",
-        "X-Title": "OmniTalk X",
-    }
+    headers = build_headers(cfg, api_key)
 
-    client = httpx.AsyncClient(timeout=DEFAULT_TIMEOUT_SECONDS)
+    endpoint = cfg["endpoint"]
+    client = get_http_client(endpoint)
     last_error = None
     model_candidates = (
         get_google_fallbacks(cfg["id"]) if provider == "google" else [cfg["id"]]
@@ -475,34 +738,32 @@ async def chat_completion(provider: str, payload: dict[str, Any], custom_api_key
         normalized["model"] = model_id
         normalized["stream"] = False
         try:
-            response = await client.post(OPENROUTER_URL, headers=headers, json=normalized)
+            response = await send_upstream(client, endpoint.url, headers, normalized)
         except Exception as exc:
             last_error = format_model_error(model_id, str(exc))
             continue
-        
+    
         if response.status_code >= 400:
             if provider == "google":
                 logger.warning(
                     "google upstream error model=%s status=%s body=%s",
                     model_id,
                     response.status_code,
-                    response.text[:800],
+                    response.text[:UPSTREAM_ERROR_BODY_LIMIT],
                 )
             base_text = response.text or f"HTTP {response.status_code}"
             last_error = format_model_error(model_id, base_text)
             if provider == "google" and should_fallback_on_error(response.status_code, response.text):
                 continue
-            await client.aclose()
             return {"success": False, "msg": last_error}
         break
     else:
-        await client.aclose()
         if provider == "google":
             if not last_error or last_error.strip() in {"请求失败", "Request failed"}:
                 return {"success": False, "msg": "Gemini 模型暂不可用，请检查 OpenRouter 的 Google 模型权限或额度"}
             return {"success": False, "msg": last_error}
         return {"success": False, "msg": last_error or "请求失败"}
-    
+
     try:
         result = response.json()
         if isinstance(result, dict) and "error" in result:
@@ -511,22 +772,20 @@ async def chat_completion(provider: str, payload: dict[str, Any], custom_api_key
                 logger.warning(
                     "google response contains error model=%s body=%s",
                     normalized.get("model"),
-                    err_text[:800],
+                    err_text[:UPSTREAM_ERROR_BODY_LIMIT],
                 )
-            await client.aclose()
             return {"success": False, "msg": format_model_error(normalized.get("model"), err_text)}
+        record_usage(provider, normalized.get("model"), result.get("usage"), api_key, payload.get("group_id"))
         content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
-        content = strip_prompt_leak(content or "")
+        content = strip_prompt_leak(content or "").strip()
         if not content:
-            await client.aclose()
             return {"success": False, "msg": "模型返回空内容"}
         if provider == "google" and not content:
             logger.warning(
                 "google response empty content model=%s body=%s",
                 normalized.get("model"),
-                json.dumps(result, ensure_ascii=False)[:800],
+                json.dumps(result, ensure_ascii=False)[:UPSTREAM_ERROR_BODY_LIMIT],
             )
-        await client.aclose()
         return {"success": True, "msg": content}
     except Exception as exc:
         if provider == "google":
@@ -534,68 +793,61 @@ async def chat_completion(provider: str, payload: dict[str, Any], custom_api_key
                 "google response parse error model=%s error=%r body=%s",
                 normalized.get("model"),
                 exc,
-                (response.text or "")[:800],
+                (response.text or "")[:UPSTREAM_ERROR_BODY_LIMIT],
             )
-        await client.aclose()
         return {"success": False, "msg": str(exc)}
 
 
-async def chat_completion_with_context(provider: str, user_message: str, custom_api_key: str = None):
-    """非流式聊天完成（带上下文）"""
+async def chat_completion_with_context(
+    provider: str, user_message: str, custom_api_key: str = None, group_id: str = None
+):
+    """非流式聊天完成（带上下文），group_id 只用于用量记账"""
     cfg = get_provider_config(provider)
     messages = get_context_with_messages(provider, user_message)
-    
-    payload = {
-        "model": cfg["id"],
+
+    payload = build_payload(provider, {
         "temperature": 0.7,
         "max_tokens": 100,
-        "messages": [{"role": "system", "content": cfg["default_system"]}] + messages
-    }
+        "messages": messages,
+    })
+    payload["stream"] = False
 
-    # 优先使用前端传入的 API Key，不再读取后端文件
-    api_key = custom_api_key
-    if not api_key:
-        return {"success": False, "msg": "请在设置中输入 API Key", "provider": provider}
+    # 优先使用前端传入的 API Key，没有时使用 Key 池，不再读取后端文件
+    api_key = resolve_api_key(cfg, custom_api_key)
+    if api_key is None:
+        return {"success": False, "msg": missing_key_msg(), "provider": provider}
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}",
-        "HTTP-Referer": "https://omnitalkx.example.com",
-        "X-Title": "OmniTalk X",
-    }
+    headers = build_headers(cfg, api_key)
 
-    client = httpx.AsyncClient(timeout=DEFAULT_TIMEOUT_SECONDS)
+    endpoint = cfg["endpoint"]
+    client = get_http_client(endpoint)
     try:
-        response = await client.post(OPENROUTER_URL, headers=headers, json=payload)
+        response = await send_upstream(client, endpoint.url, headers, payload)
     except Exception as exc:
-        await client.aclose()
         return {"success": False, "msg": normalize_error(str(exc)), "provider": provider}
-    
+
     if response.status_code >= 400:
-        await client.aclose()
         return {"success": False, "msg": normalize_error(response.text), "provider": provider}
-    
+
     try:
         result = response.json()
+        record_usage(provider, payload["model"], result.get("usage"), api_key, group_id)
         content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
-        content = strip_prompt_leak(content or "")
+        content = strip_prompt_leak(content or "").strip()
         if not content:
-            await client.aclose()
             return {"success": False, "msg": "模型返回空内容"}
         add_to_context(provider, "user", user_message)
         add_to_context(provider, "assistant", content)
-        await client.aclose()
         return {"success": True, "msg": content, "provider": provider}
     except Exception as exc:
-        await client.aclose()
         return {"success": False, "msg": str(exc), "provider": provider}
 
 
-async def group_chat(providers: list, user_message: str, custom_api_key: str = None):
+async def group_chat(providers: list, user_message: str, custom_api_key: str = None, group_id: str = None):
     """群聊：同时调用多个 AI，返回按完成时间排序的结果"""
     tasks = []
     for provider in providers:
-        task = chat_completion_with_context(provider, user_message, custom_api_key)
+        task = chat_completion_with_context(provider, user_message, custom_api_key, group_id)
         tasks.append(task)
     
     results = await asyncio.gather(*tasks, return_exceptions=True)
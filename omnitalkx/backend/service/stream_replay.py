@@ -0,0 +1,213 @@
+import asyncio
+import time
+import uuid
+from collections import deque
+from typing import AsyncIterator, Callable, Optional
+
+from backend.config.constant import (
+    REPLAY_MAX_BYTES_PER_STREAM,
+    REPLAY_MAX_STREAMS,
+    REPLAY_RESUME_GRACE_SECONDS,
+    REPLAY_TTL_SECONDS,
+)
+from backend.util.log import log
+
+logger = log(__name__)
+
+# stream id -> ReplayStream
+REPLAY_STREAMS = {}
+
+
+class ReplayGap(Exception):
+    """请求续传的事件已经被淘汰出环形缓冲"""
+
+
+class ReplayStream:
+    """
+    一次上游生成的服务端回放缓冲。
+    上游由独立任务读取，事件按序号写入环形缓冲；客户端订阅时从指定序号开始读取，
+    断线重连后凭 Last-Event-ID 续传，不会再次请求上游。
+    缓冲按字节数限制：只淘汰已经发送过的事件，未发送的事件占满时暂停读取上游。
+    """
+
+    def __init__(self, source: AsyncIterator[str], max_bytes: int = REPLAY_MAX_BYTES_PER_STREAM):
+        self.id = uuid.uuid4().hex
+        self.source = source
+        self.max_bytes = max_bytes
+        self.ring = deque()
+        self.ring_bytes = 0
+        self.next_seq = 0
+        self.sent_seq = -1
+        self.done = False
+        self.subscribers = 0
+        self.created_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self._changed = asyncio.Condition()
+        self._producer: Optional[asyncio.Task] = None
+        self._grace_handle: Optional[asyncio.TimerHandle] = None
+
+    def start(self):
+        self._producer = asyncio.ensure_future(self._produce())
+        # 客户端在响应体开始前就断开时 subscribe() 不会执行，这里先计时，首个订阅开始后取消
+        self._arm_grace()
+
+    @property
+    def first_seq(self) -> int:
+        return self.ring[0][0] if self.ring else self.next_seq
+
+    def expired(self, now: float) -> bool:
+        return self.done and self.subscribers == 0 and now - self.finished_at > REPLAY_TTL_SECONDS
+
+    async def _append(self, frame: str):
+        size = len(frame.encode("utf-8"))
+        async with self._changed:
+            while self.ring and self.ring_bytes + size > self.max_bytes:
+                oldest_seq, _, oldest_size = self.ring[0]
+                if oldest_seq <= self.sent_seq:
+                    self.ring.popleft()
+                    self.ring_bytes -= oldest_size
+                    continue
+                await self._changed.wait()
+            self.ring.append((self.next_seq, frame, size))
+            self.ring_bytes += size
+            self.next_seq += 1
+            self._changed.notify_all()
+
+    async def _produce(self):
+        try:
+            async for frame in self.source:
+                await self._append(frame)
+        except asyncio.CancelledError:
+            logger.info("replay stream cancelled, id=%s", self.id)
+        finally:
+            aclose = getattr(self.source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            self.done = True
+            self.finished_at = time.monotonic()
+            async with self._changed:
+                self._changed.notify_all()
+
+    def _arm_grace(self):
+        if self._grace_handle is not None:
+            self._grace_handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._grace_handle = loop.call_later(REPLAY_RESUME_GRACE_SECONDS, self._cancel_if_abandoned)
+
+    def _cancel_if_abandoned(self):
+        self._grace_handle = None
+        if self.subscribers == 0 and not self.done and self._producer is not None:
+            logger.info("no client resumed stream within grace period, cancel upstream, id=%s", self.id)
+            self._producer.cancel()
+
+    def _frame_at(self, seq: int) -> Optional[str]:
+        if not self.ring or seq < self.ring[0][0] or seq >= self.next_seq:
+            return None
+        return self.ring[seq - self.ring[0][0]][1]
+
+    def event_frame(self, seq: int, frame: str) -> str:
+        """给 SSE 数据帧加上 id 行，其他帧原样输出"""
+        if frame.startswith("data:"):
+            return f"id: {self.id}-{seq}\n{frame}"
+        return frame
+
+    @staticmethod
+    def split_event_id(frame: str):
+        """拆出 event_frame 加上的 id 行，返回 (id 行, 原始帧)"""
+        if frame.startswith("id: "):
+            head, _, rest = frame.partition("\n")
+            return head + "\n", rest
+        return "", frame
+
+    async def subscribe(self, after_seq: int = -1):
+        """从 after_seq 之后开始输出事件，直到上游结束"""
+        if after_seq + 1 < self.first_seq:
+            raise ReplayGap()
+        self.subscribers += 1
+        if self._grace_handle is not None:
+            self._grace_handle.cancel()
+            self._grace_handle = None
+        seq = after_seq + 1
+        try:
+            while True:
+                async with self._changed:
+                    frame = self._frame_at(seq)
+                    if frame is None:
+                        if self.done:
+                            break
+                        await self._changed.wait()
+                        continue
+                    if seq > self.sent_seq:
+                        self.sent_seq = seq
+                        self._changed.notify_all()
+                yield self.event_frame(seq, frame)
+                seq += 1
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self._arm_grace()
+
+
+def merge_event_frames(merge: Callable[[str, str], Optional[str]]) -> Callable[[str, str], Optional[str]]:
+    """
+    订阅输出的帧带有 id 行，包装原始帧的合并函数：
+    合并两帧的内容，保留后一帧的 id，客户端续传时从合并后的最后一个事件之后开始
+    """
+    def merged(prev: str, new: str) -> Optional[str]:
+        _, prev_frame = ReplayStream.split_event_id(prev)
+        new_id, new_frame = ReplayStream.split_event_id(new)
+        frame = merge(prev_frame, new_frame)
+        return None if frame is None else new_id + frame
+    return merged
+
+
+def evict_streams():
+    """淘汰过期的流；数量超限时从最早结束的开始淘汰"""
+    now = time.monotonic()
+    for stream_id in [sid for sid, s in REPLAY_STREAMS.items() if s.expired(now)]:
+        REPLAY_STREAMS.pop(stream_id, None)
+
+    if len(REPLAY_STREAMS) < REPLAY_MAX_STREAMS:
+        return
+    finished = sorted(
+        (s for s in REPLAY_STREAMS.values() if s.done and s.subscribers == 0),
+        key=lambda s: s.finished_at,
+    )
+    for stream in finished[:len(REPLAY_STREAMS) - REPLAY_MAX_STREAMS + 1]:
+        REPLAY_STREAMS.pop(stream.id, None)
+
+
+def start_replay_stream(source: AsyncIterator[str]) -> ReplayStream:
+    """为一次上游生成创建可续传的流，并立即开始读取上游"""
+    evict_streams()
+    stream = ReplayStream(source)
+    REPLAY_STREAMS[stream.id] = stream
+    stream.start()
+    return stream
+
+
+def parse_last_event_id(last_event_id: str):
+    """Last-Event-ID 格式为 {stream_id}-{seq}"""
+    stream_id, _, seq = (last_event_id or "").strip().rpartition("-")
+    if not stream_id or not seq.isdigit():
+        return None, None
+    return stream_id, int(seq)
+
+
+def resume_stream(stream_id: str, after_seq: int = -1):
+    """返回续传的事件迭代器；流不存在或已过期返回 None，事件已被淘汰抛出 ReplayGap"""
+    evict_streams()
+    stream = REPLAY_STREAMS.get(stream_id)
+    if stream is None:
+        return None
+    if after_seq + 1 < stream.first_seq:
+        raise ReplayGap()
+    return stream.subscribe(after_seq)
+
+
+def get_replay_stats() -> dict:
+    return {
+        "streams": len(REPLAY_STREAMS),
+        "buffered_bytes": sum(s.ring_bytes for s in REPLAY_STREAMS.values()),
+        "active": sum(1 for s in REPLAY_STREAMS.values() if not s.done),
+    }
@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import os
+import time
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, Mapping, Optional
+
+from backend.config.constant import (
+    DEFAULT_TIMEOUT_SECONDS,
+    ENDPOINT_COOLDOWN_SECONDS,
+    ENDPOINT_FAILURE_THRESHOLD,
+    ENDPOINT_MAX_CONNECTIONS,
+    ENDPOINT_MAX_KEEPALIVE_CONNECTIONS,
+)
+from backend.util.log import log
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = log(__name__)
+
+DEFAULT_ENDPOINT = "openrouter"
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+# openrouter：带 usage.include、cache_control 等 OpenRouter 扩展；openai：标准 OpenAI 兼容接口（vLLM / llama.cpp / LMDeploy）
+DIALECT_OPENROUTER = "openrouter"
+DIALECT_OPENAI = "openai"
+DIALECTS = (DIALECT_OPENROUTER, DIALECT_OPENAI)
+
+# 上游配置可用的字段及默认值
+PROFILE_DEFAULTS = {
+    "base_url": "",
+    "dialect": DIALECT_OPENAI,
+    "api_key": "",
+    "api_key_env": "",
+    "auth_header": "Authorization",
+    "auth_scheme": "Bearer",
+    # 是否把前端传入的 X-Api-Key（OpenRouter Key）发给该上游；自定义上游默认不发，避免 Key 外泄
+    "forward_client_key": False,
+    "headers": {},
+    "timeout": DEFAULT_TIMEOUT_SECONDS,
+    "max_connections": ENDPOINT_MAX_CONNECTIONS,
+    "max_keepalive_connections": ENDPOINT_MAX_KEEPALIVE_CONNECTIONS,
+    # 连续失败达到阈值后熔断 cooldown_seconds 秒，期间请求直接失败；0 表示不熔断
+    "failure_threshold": ENDPOINT_FAILURE_THRESHOLD,
+    "cooldown_seconds": ENDPOINT_COOLDOWN_SECONDS,
+}
+
+# 内置的 OpenRouter 上游，连接池由 service_openrouter 的共享 AsyncClient 承担
+OPENROUTER_PROFILE = {
+    "base_url": OPENROUTER_BASE_URL,
+    "dialect": DIALECT_OPENROUTER,
+    "forward_client_key": True,
+    # 公网上游偶发抖动很常见，只记录健康状态不熔断
+    "failure_threshold": 0,
+}
+
+# chat 地址 -> 健康状态；同一地址的多个配置共用，配置热更新后保留
+ENDPOINT_HEALTH = {}
+
+
+class EndpointUnavailable(Exception):
+    """上游处于熔断冷却期，请求直接失败"""
+
+
+class EndpointHealth:
+    """单个上游的请求计数、连续失败次数、延迟与熔断状态"""
+
+    def __init__(self, name: str, failure_threshold: int = 0, cooldown_seconds: float = ENDPOINT_COOLDOWN_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.last_error = ""
+        self.latency_ms: Optional[float] = None
+
+    def available(self) -> bool:
+        # 冷却结束后放行请求试探，失败会立即再次进入冷却
+        return time.monotonic() >= self.cooldown_until
+
+    def check(self):
+        if not self.available():
+            remaining = self.cooldown_until - time.monotonic()
+            raise EndpointUnavailable(f"上游 {self.name} 暂不可用，约 {remaining:.0f} 秒后重试: {self.last_error}")
+
+    def record_success(self, latency: float):
+        self.requests += 1
+        self.consecutive_failures = 0
+        latency_ms = latency * 1000
+        # 指数滑动平均，反映最近的响应头延迟
+        self.latency_ms = latency_ms if self.latency_ms is None else self.latency_ms * 0.8 + latency_ms * 0.2
+
+    def record_failure(self, error: str):
+        self.requests += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = error
+        if self.failure_threshold and self.consecutive_failures >= self.failure_threshold:
+            self.cooldown_until = time.monotonic() + self.cooldown_seconds
+            logger.warning(
+                "upstream %s unhealthy, failures=%s cooldown=%ss error=%s",
+                self.name,
+                self.consecutive_failures,
+                self.cooldown_seconds,
+                error,
+            )
+
+    def record_status(self, status_code: int, latency: float):
+        """5xx 计为上游故障；4xx 是请求本身的问题，不影响健康状态"""
+        if status_code >= 500:
+            self.record_failure(f"HTTP {status_code}")
+        else:
+            self.record_success(latency)
+
+    def snapshot(self) -> dict:
+        return {
+            "healthy": self.available(),
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "cooldown_seconds": max(0, round(self.cooldown_until - time.monotonic(), 1)),
+            "latency_ms": None if self.latency_ms is None else round(self.latency_ms, 1),
+            "last_error": self.last_error,
+        }
+
+
+def get_health(url: str) -> EndpointHealth:
+    health = ENDPOINT_HEALTH.get(url)
+    if health is None:
+        health = ENDPOINT_HEALTH[url] = EndpointHealth(url)
+    return health
+
+
+class UpstreamEndpoint:
+    """
+    一个上游配置：chat 地址、鉴权方式、附加请求头，以及独立的连接池与健康状态。
+    多个 bot 引用同一个命名配置时共用连接池。
+    """
+
+    def __init__(self, name: str, profile: Mapping[str, Any]):
+        self.name = name
+        self.profile = profile
+        self.base_url = profile["base_url"].rstrip("/")
+        self.url = f"{self.base_url}/chat/completions"
+        self.models_url = f"{self.base_url}/models"
+        self.dialect = profile["dialect"]
+        self.api_key = profile["api_key"] or os.environ.get(profile["api_key_env"] or "", "")
+        self.forward_client_key = profile["forward_client_key"]
+        self.headers = MappingProxyType(dict(profile["headers"]))
+        self.timeout = profile["timeout"]
+        self.limits = {
+            "max_connections": profile["max_connections"],
+            "max_keepalive_connections": profile["max_keepalive_connections"],
+        }
+        self.health = get_health(self.url)
+        self.health.name = name
+        self.health.failure_threshold = profile["failure_threshold"]
+        self.health.cooldown_seconds = profile["cooldown_seconds"]
+        # OpenRouter 扩展：请求体里要求返回 usage，anthropic / google 需要显式 cache_control
+        self.cache_control = self.dialect == DIALECT_OPENROUTER
+        self.payload_extras = MappingProxyType({"usage": {"include": True}} if self.cache_control else {})
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def is_default(self) -> bool:
+        return self.name == DEFAULT_ENDPOINT
+
+    def auth_headers(self, client_key: str) -> dict:
+        """配置了专用 Key 时用专用 Key，否则按 forward_client_key 决定是否透传前端的 Key"""
+        key = self.api_key or (client_key if self.forward_client_key else "")
+        if not key:
+            return {}
+        return {self.profile["auth_header"]: f"{self.profile['auth_scheme']} {key}".strip()}
+
+    def client(self) -> httpx.AsyncClient:
+        """该上游独立的连接池，按需创建"""
+        if self._client is None or self._client.is_closed:
+            import httpx
+
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=httpx.Limits(**self.limits))
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "dialect": self.dialect,
+            **self.health.snapshot(),
+        }
+
+
+def normalize_profile(name: str, raw: Any) -> dict:
+    """校验一个上游配置并补全默认值，无效时抛出 ValueError"""
+    if not isinstance(raw, dict):
+        raise ValueError(f"endpoints.{name} 必须是对象")
+    unknown = set(raw) - set(PROFILE_DEFAULTS)
+    if unknown:
+        logger.warning("endpoints.%s 中的未知字段: %s", name, ", ".join(sorted(unknown)))
+    profile = {**PROFILE_DEFAULTS, **{k: v for k, v in raw.items() if k in PROFILE_DEFAULTS}}
+    base_url = profile["base_url"]
+    if not isinstance(base_url, str) or not base_url.startswith(("http://", "https://")):
+        raise ValueError(f"endpoints.{name}.base_url 必须是 http(s) 地址")
+    if profile["dialect"] not in DIALECTS:
+        raise ValueError(f"endpoints.{name}.dialect 只能是 {' / '.join(DIALECTS)}")
+    for key in ("api_key", "api_key_env", "auth_header", "auth_scheme"):
+        if not isinstance(profile[key], str):
+            raise ValueError(f"endpoints.{name}.{key} 必须是字符串")
+    if not profile["auth_header"]:
+        raise ValueError(f"endpoints.{name}.auth_header 不能为空")
+    if not isinstance(profile["forward_client_key"], bool):
+        raise ValueError(f"endpoints.{name}.forward_client_key 必须是布尔值")
+    headers = profile["headers"]
+    if not isinstance(headers, dict) or not all(isinstance(v, str) for v in headers.values()):
+        raise ValueError(f"endpoints.{name}.headers 必须是字符串到字符串的对象")
+    for key in ("timeout", "cooldown_seconds"):
+        if not isinstance(profile[key], (int, float)) or profile[key] <= 0:
+            raise ValueError(f"endpoints.{name}.{key} 必须是正数")
+    if not isinstance(profile["max_connections"], int) or profile["max_connections"] <= 0:
+        raise ValueError(f"endpoints.{name}.max_connections 必须是正整数")
+    for key in ("max_keepalive_connections", "failure_threshold"):
+        if not isinstance(profile[key], int) or profile[key] < 0:
+            raise ValueError(f"endpoints.{name}.{key} 必须是非负整数")
+    return profile
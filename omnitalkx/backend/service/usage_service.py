@@ -0,0 +1,162 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional
+
+from backend.util.log import log
+
+logger = log(__name__)
+
+USAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "usage")
+
+FLUSH_INTERVAL_SECONDS = 2.0
+FLUSH_BATCH_SIZE = 200
+MAX_PENDING_RECORDS = 10000
+
+
+def key_fingerprint(api_key: str) -> str:
+    """API Key 只记录指纹，不落盘明文"""
+    if not api_key:
+        return ""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+def build_usage_record(
+    request_id: str,
+    provider: str,
+    model: str,
+    usage: dict,
+    api_key: str = "",
+    group_id: str = None,
+) -> dict:
+    """把上游 usage 字段整理成统一的记账记录"""
+    details = usage.get("prompt_tokens_details") or {}
+    return {
+        "ts": time.time(),
+        "request_id": request_id,
+        "provider": provider,
+        "model": model,
+        "group_id": group_id or "",
+        "key_id": key_fingerprint(api_key),
+        "prompt_tokens": usage.get("prompt_tokens") or 0,
+        "completion_tokens": usage.get("completion_tokens") or 0,
+        "cached_tokens": details.get("cached_tokens") or 0,
+        "cost": float(usage.get("cost") or 0),
+    }
+
+
+class UsageWriter:
+    """
+    批量异步写入 usage 记录。
+    record() 只做一次内存追加，不做 IO；后台任务定期把积压的记录
+    追加到按天滚动的 JSONL 文件中（usage-YYYYMMDD.jsonl）。
+    """
+
+    def __init__(self, directory: str = USAGE_DIR, max_pending: int = MAX_PENDING_RECORDS):
+        self.directory = directory
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.dropped = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, record: dict):
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self.pending.append(record)
+
+    def _write_batch(self, batch: list):
+        os.makedirs(self.directory, exist_ok=True)
+        by_day = {}
+        for record in batch:
+            day = datetime.fromtimestamp(record["ts"]).strftime("%Y%m%d")
+            by_day.setdefault(day, []).append(record)
+        for day, records in by_day.items():
+            path = os.path.join(self.directory, f"usage-{day}.jsonl")
+            with open(path, "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _drain(self, limit: int = None) -> list:
+        batch = []
+        while self.pending and (limit is None or len(batch) < limit):
+            batch.append(self.pending.popleft())
+        return batch
+
+    async def flush(self):
+        """把当前积压的记录写入磁盘"""
+        while self.pending:
+            batch = self._drain(FLUSH_BATCH_SIZE)
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as exc:
+                logger.error("写入 usage 记录失败, count=%s error=%r", len(batch), exc)
+                return
+
+    async def _run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    def start(self, interval: float = FLUSH_INTERVAL_SECONDS):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+def iter_usage_records(directory: str, days: int):
+    """读取最近 days 天的 usage 记录"""
+    today = datetime.now().date()
+    for offset in range(days - 1, -1, -1):
+        day = (today - timedelta(days=offset)).strftime("%Y%m%d")
+        path = os.path.join(directory, f"usage-{day}.jsonl")
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def aggregate_daily(directory: str = USAGE_DIR, days: int = 7, group_by: str = "provider") -> list:
+    """按天 + 维度（provider / group_id / key_id / model）汇总 usage"""
+    rollup = {}
+    for record in iter_usage_records(directory, days):
+        day = datetime.fromtimestamp(record.get("ts", 0)).strftime("%Y-%m-%d")
+        key = (day, record.get(group_by, ""))
+        row = rollup.setdefault(key, {
+            "day": day,
+            group_by: key[1],
+            "requests": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cached_tokens": 0,
+            "cost": 0.0,
+        })
+        row["requests"] += 1
+        row["prompt_tokens"] += record.get("prompt_tokens", 0)
+        row["completion_tokens"] += record.get("completion_tokens", 0)
+        row["cached_tokens"] += record.get("cached_tokens", 0)
+        row["cost"] += record.get("cost", 0.0)
+
+    result = sorted(rollup.values(), key=lambda r: (r["day"], str(r[group_by])))
+    for row in result:
+        row["cost"] = round(row["cost"], 6)
+    return result
+
+
+USAGE_WRITER = UsageWriter()
@@ -0,0 +1,121 @@
+import gzip
+import hashlib
+import json
+from typing import Any, Callable, Hashable
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 轮询类接口：允许缓存，但每次都要用 ETag 向服务端确认
+REVALIDATE = "no-cache"
+# 太小的响应压缩收益不抵头部开销
+MIN_COMPRESS_BYTES = 256
+
+
+def make_etag(body: bytes) -> str:
+    """按响应内容生成强 ETag，内容不变则 ETag 不变（重启后也一致）"""
+    return '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+
+def accepted_encodings(request: Request) -> set:
+    """解析 Accept-Encoding，忽略 q=0 的编码"""
+    accepted = set()
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name)
+    return accepted
+
+
+def etag_matches(request: Request, etags) -> bool:
+    """If-None-Match 是否命中任一 ETag（支持逗号分隔的多个值、弱校验前缀和 *）"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = {tag.strip() for tag in header.split(",")}
+    tags |= {tag[2:] for tag in tags if tag.startswith("W/")}
+    return any(etag in tags for etag in etags)
+
+
+class CachedBody:
+    """
+    预先序列化好的 JSON 响应体，连同强 ETag 和 gzip / brotli 压缩版本。
+    不同编码是不同的表示，ETag 加上编码后缀区分；条件请求时任一表示命中都算未修改。
+    """
+
+    def __init__(self, data: Any = None, body: bytes = None):
+        if body is None:
+            body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.body = body
+        self.etag = make_etag(body)
+        self.encoded = {}
+        if len(body) >= MIN_COMPRESS_BYTES:
+            if brotli is not None:
+                self._add("br", brotli.compress(body))
+            self._add("gzip", gzip.compress(body, compresslevel=9, mtime=0))
+
+    def _add(self, encoding: str, data: bytes):
+        if len(data) < len(self.body):
+            self.encoded[encoding] = data
+
+    def etag_for(self, encoding: str = None) -> str:
+        return self.etag if encoding is None else f'{self.etag[:-1]}-{encoding}"'
+
+    def matches(self, request: Request) -> bool:
+        return etag_matches(request, [self.etag_for(enc) for enc in (None, *self.encoded)])
+
+    def negotiate(self, request: Request):
+        accepted = accepted_encodings(request)
+        for encoding in ("br", "gzip"):
+            if encoding in self.encoded and encoding in accepted:
+                return encoding
+        return None
+
+
+def cached_json_response(request: Request, cached: CachedBody, cache_control: str = REVALIDATE) -> Response:
+    """返回预先序列化好的 JSON；客户端 ETag 一致时直接 304，不重新计算"""
+    encoding = cached.negotiate(request)
+    headers = {"ETag": cached.etag_for(encoding), "Cache-Control": cache_control}
+    if cached.encoded:
+        headers["Vary"] = "Accept-Encoding"
+    if cached.matches(request):
+        return Response(status_code=304, headers=headers)
+    if encoding is None:
+        return Response(content=cached.body, media_type="application/json", headers=headers)
+    headers["Content-Encoding"] = encoding
+    return Response(content=cached.encoded[encoding], media_type="application/json", headers=headers)
+
+
+class PrecomputedJSON:
+    """按 key（通常是配置版本号）缓存的 JSON 响应，key 变化时才重新构建"""
+
+    def __init__(self, builder: Callable[[], Any], cache_control: str = REVALIDATE):
+        self.builder = builder
+        self.cache_control = cache_control
+        self.key = None
+        self.cached = None
+
+    def get(self, key: Hashable = None) -> CachedBody:
+        if self.cached is None or key != self.key:
+            self.cached = CachedBody(self.builder())
+            self.key = key
+        return self.cached
+
+    def response(self, request: Request, key: Hashable = None) -> Response:
+        return cached_json_response(request, self.get(key), self.cache_control)
@@ -0,0 +1,131 @@
+from collections import deque
+from typing import Iterable, List
+
+
+class AhoCorasick:
+    """
+    多模式匹配自动机，按字符推进状态，整体为线性复杂度。
+    depth[state] 是当前已匹配的模式前缀长度，也就是仍可能构成匹配、需要暂扣的后缀长度。
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.goto: List[dict] = [{}]
+        self.fail: List[int] = [0]
+        self.depth: List[int] = [0]
+        self.terminal: List[bool] = [False]
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str):
+        state = 0
+        for ch in pattern:
+            nxt = self.goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.depth.append(self.depth[state] + 1)
+                self.terminal.append(False)
+                self.goto[state][ch] = nxt
+            state = nxt
+        self.terminal[state] = True
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                self.terminal[nxt] = self.terminal[nxt] or self.terminal[self.fail[nxt]]
+
+    def step(self, state: int, ch: str) -> int:
+        while state and ch not in self.goto[state]:
+            state = self.fail[state]
+        return self.goto[state].get(ch, 0)
+
+    def search(self, text: str) -> bool:
+        """text 中是否包含任一模式"""
+        state = 0
+        for ch in text:
+            state = self.step(state, ch)
+            if self.terminal[state]:
+                return True
+        return False
+
+
+class StreamLeakFilter:
+    """
+    提示词泄露过滤：按增量喂入文本，只暂扣可能仍在匹配中的最短后缀。
+    命中模式后，从命中处到行尾的内容全部丢弃；命中前只有空白的行连同换行整行去掉。
+    行首空白在该行出现其他内容前暂不输出，以便整行丢弃。
+    流式与非流式（strip_prompt_leak）共用这一规则，两者输出一致。
+    """
+
+    def __init__(self, matcher: AhoCorasick):
+        self.matcher = matcher
+        self.state = 0
+        self.held = ""
+        self.indent = ""
+        self.suppressing = False
+        self.line_has_output = False
+
+    def _release(self, text: str, out: list):
+        for ch in text:
+            if ch == "\n":
+                out.append(self.indent + ch)
+                self.indent = ""
+                self.line_has_output = False
+            elif self.line_has_output:
+                out.append(ch)
+            elif ch.isspace():
+                self.indent += ch
+            else:
+                out.append(self.indent + ch)
+                self.indent = ""
+                self.line_has_output = True
+
+    def feed(self, text: str) -> str:
+        out = []
+        matcher = self.matcher
+        for ch in text:
+            if self.suppressing:
+                if ch == "\n":
+                    self.suppressing = False
+                    if self.line_has_output:
+                        out.append("\n")
+                    self.line_has_output = False
+                continue
+
+            self.state = matcher.step(self.state, ch)
+            if matcher.terminal[self.state]:
+                self.suppressing = True
+                self.state = 0
+                self.held = ""
+                self.indent = ""
+                continue
+
+            self.held += ch
+            keep = matcher.depth[self.state]
+            if len(self.held) > keep:
+                released = self.held[:len(self.held) - keep]
+                self.held = self.held[len(self.held) - keep:] if keep else ""
+                self._release(released, out)
+        return "".join(out)
+
+    def flush(self) -> str:
+        """流结束时输出暂扣的内容"""
+        out = []
+        if not self.suppressing:
+            self._release(self.held, out)
+            out.append(self.indent)
+        self.held = ""
+        self.indent = ""
+        self.state = 0
+        return "".join(out)
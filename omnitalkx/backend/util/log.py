@@ -1,4 +1,190 @@
+import atexit
+import copy
+import json
 import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# 输出格式：text（默认，与原来一致）或 json（每行一个 JSON 对象，便于采集）
+LOG_FORMAT = os.environ.get("OMNITALKX_LOG_FORMAT", "text").lower()
+# 队列上限：写不过来时直接丢弃并计数，不阻塞事件循环
+LOG_QUEUE_SIZE = 10000
+# 同一条告警/错误模板在窗口内最多输出的次数，超出的合并为一条计数
+RATE_LIMIT_WINDOW_SECONDS = 10.0
+RATE_LIMIT_BURST = 5
+
+
+def parse_sample_rates(value: str) -> dict:
+    """
+    解析采样配置，如 "backend.api.route_groups=0.1,backend.service=0.5"；
+    格式不对或比例不在 [0, 1] 内的项忽略
+    """
+    rates = {}
+    for item in (value or "").split(","):
+        prefix, sep, rate = item.strip().partition("=")
+        if not sep or not prefix.strip():
+            continue
+        try:
+            rate = float(rate)
+        except ValueError:
+            continue
+        if 0.0 <= rate <= 1.0:
+            rates[prefix.strip()] = rate
+    return rates
+
+
+# 按 logger 名（或 extra={"path": ...} 指定的请求路径）前缀对 INFO 及以下的日志采样，1.0 表示全部保留；
+# 通过环境变量 OMNITALKX_LOG_SAMPLE 配置
+SAMPLE_RATES = parse_sample_rates(os.environ.get("OMNITALKX_LOG_SAMPLE", ""))
+
+TEXT_FORMAT = "%(levelname)s:     %(asctime)s - %(module)s-%(funcName)s-line:%(lineno)d - %(message)s"
+
+# 通过 log() 创建的业务 logger，clear_other_log 不会屏蔽它们
+APP_LOGGERS = set()
+
+# LogRecord 自带的属性，其余的视为 extra 字段输出到 JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """结构化输出：固定字段 + 调用方通过 extra 传入的字段"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "func": record.funcName,
+            "line": record.lineno,
+            "msg": record.getMessage(),
+        }
+        for key, val in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                data[key] = val
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """按前缀对低级别日志采样；WARNING 及以上不采样"""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        key = getattr(record, "path", None) or record.name
+        rate = 1.0
+        matched = -1
+        for prefix, val in self.rates.items():
+            if key.startswith(prefix) and len(prefix) > matched:
+                rate, matched = val, len(prefix)
+        return rate >= 1.0 or random.random() < rate
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    按 (logger, 日志模板, 级别) 限流，上游故障时同一条错误不会刷屏；
+    窗口结束后的第一条会带上被合并掉的条数。
+    """
+
+    def __init__(self, window: float = RATE_LIMIT_WINDOW_SECONDS, burst: int = RATE_LIMIT_BURST):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+        key = (record.name, str(record.msg), record.levelno)
+        now = time.monotonic()
+        with self._lock:
+            start, count, suppressed = self.buckets.get(key, (now, 0, 0))
+            if now - start >= self.window:
+                start, count = now, 0
+            if count >= self.burst:
+                self.buckets[key] = (start, count, suppressed + 1)
+                return False
+            self.buckets[key] = (start, count + 1, 0)
+        if suppressed:
+            record.suppressed = suppressed
+            record.msg = f"{record.msg} (suppressed {suppressed} similar)"
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """队列满时丢弃并计数，而不是阻塞调用方"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        调用线程里只把参数合并进消息（参数对象之后可能被修改），不做格式化；
+        exc_info 原样保留，由后台线程的 formatter 输出异常堆栈（JSON 格式为 exc 字段）
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def build_formatter(fmt: str = LOG_FORMAT) -> logging.Formatter:
+    return JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT)
+
+
+_queue_handler = None
+_listener = None
+_handler_lock = threading.Lock()
+
+
+def get_queue_handler() -> DroppingQueueHandler:
+    """
+    所有业务 logger 共用一个队列 handler：调用方只做过滤、合并消息参数和入队，
+    格式化（含异常堆栈）与写 stderr 在后台线程完成。
+    """
+    global _queue_handler, _listener
+    if _queue_handler is not None:
+        return _queue_handler
+    with _handler_lock:
+        if _queue_handler is None:
+            log_queue = queue.Queue(LOG_QUEUE_SIZE)
+            handler = DroppingQueueHandler(log_queue)
+            handler.addFilter(SamplingFilter(SAMPLE_RATES))
+            handler.addFilter(RateLimitFilter())
+            stream = logging.StreamHandler(sys.stderr)
+            stream.setFormatter(build_formatter())
+            _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+            _listener.start()
+            atexit.register(stop_logging)
+            _queue_handler = handler
+    return _queue_handler
+
+
+def stop_logging():
+    """停止后台线程，退出前把队列里的日志写完"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
 
 
 def log(name):
@@ -8,22 +194,21 @@ def log(name):
     """
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
-    formatter = logging.Formatter(
-        "%(levelname)s:     %(asctime)s - %(module)s-%(funcName)s-line:%(lineno)d - %(message)s"
-    )
-    ch = logging.StreamHandler()
-    ch.setFormatter(formatter)
-    logger.addHandler(ch)
+    handler = get_queue_handler()
+    # 同名 logger 多次获取时不重复挂 handler，避免日志重复输出
+    if handler not in logger.handlers:
+        logger.addHandler(handler)
+    APP_LOGGERS.add(name)
     return logger
 
 
 def clear_other_log():
-    for name, item in logging.Logger.manager.loggerDict.items():
+    """屏蔽第三方 logger；在应用启动（lifespan）时调用一次，而不是 import 时遍历"""
+    for name, item in list(logging.Logger.manager.loggerDict.items()):
         if not isinstance(item, logging.Logger):
             continue
-        if "aoe" not in name:
+        if "aoe" not in name and name not in APP_LOGGERS:
             item.setLevel(logging.CRITICAL)
 
 
-clear_other_log()
 logger = log("util")
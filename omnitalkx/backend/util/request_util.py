@@ -0,0 +1,72 @@
+import asyncio
+from typing import AsyncIterator, Awaitable
+
+from starlette.requests import Request
+
+from backend.util.log import log
+
+logger = log(__name__)
+
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+class ClientDisconnected(Exception):
+    """客户端在响应完成前断开"""
+
+
+async def watch_disconnect(request: Request, interval: float = DISCONNECT_POLL_SECONDS):
+    """轮询直到客户端断开后返回"""
+    while not await request.is_disconnected():
+        await asyncio.sleep(interval)
+
+
+async def run_until_disconnected(request: Request, awaitable: Awaitable, interval: float = DISCONNECT_POLL_SECONDS):
+    """
+    运行 awaitable，客户端先断开时取消它（连带取消其中的上游请求）并抛出 ClientDisconnected
+    """
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(watch_disconnect(request, interval))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            return task.result()
+        logger.info("client disconnected, cancel pending upstream work: %s", request.url.path)
+        raise ClientDisconnected()
+    finally:
+        for pending in (task, watcher):
+            if not pending.done():
+                pending.cancel()
+        await asyncio.gather(task, watcher, return_exceptions=True)
+
+
+async def stream_until_disconnected(
+    request: Request,
+    stream: AsyncIterator,
+    interval: float = DISCONNECT_POLL_SECONDS,
+):
+    """
+    包装上游流：客户端断开后立即停止拉取并关闭上游流。
+    上游长时间无输出时也能感知断开，不必等下一个 chunk。
+    """
+    watcher = asyncio.ensure_future(watch_disconnect(request, interval))
+    iterator = stream.__aiter__()
+    try:
+        while True:
+            next_chunk = asyncio.ensure_future(iterator.__anext__())
+            await asyncio.wait({next_chunk, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_chunk.done():
+                next_chunk.cancel()
+                await asyncio.gather(next_chunk, return_exceptions=True)
+                logger.info("client disconnected, close upstream stream: %s", request.url.path)
+                break
+            try:
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                break
+            yield chunk
+    finally:
+        watcher.cancel()
+        await asyncio.gather(watcher, return_exceptions=True)
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
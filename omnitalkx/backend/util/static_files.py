@@ -0,0 +1,199 @@
+import mimetypes
+import os
+import re
+from typing import Dict, Optional
+
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+from backend.util.http_cache import accepted_encodings, etag_matches
+from backend.util.log import log
+
+logger = log(__name__)
+
+# vite 构建产物 assets/ 下的文件名带内容哈希，可以永久缓存
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+# 预压缩文件后缀，按优先级排列
+ENCODED_SUFFIXES = (("br", ".br"), ("gzip", ".gz"))
+RANGE_CHUNK_SIZE = 64 * 1024
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _etag(stat: os.stat_result) -> str:
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _variant_etag(etag: str, encoding: str) -> str:
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def _not_modified(request: Request, entry: dict) -> bool:
+    etag = entry["etag"]
+    return etag_matches(request, [etag, *(_variant_etag(etag, enc) for enc in entry["variants"])])
+
+
+def _same_file(stat: os.stat_result, cached: os.stat_result) -> bool:
+    return stat.st_mtime_ns == cached.st_mtime_ns and stat.st_size == cached.st_size
+
+
+def _is_current(entry: dict) -> bool:
+    """索引条目记录的 stat 是否仍与磁盘上的文件（含预压缩版本）一致"""
+    try:
+        if not _same_file(os.stat(entry["path"]), entry["stat"]):
+            return False
+        return all(_same_file(os.stat(path), stat) for path, stat in entry["variants"].values())
+    except OSError:
+        return False
+
+
+def _parse_range(header: str, size: int):
+    """只支持单个区间；多区间或格式不对返回 None（按完整响应处理），越界返回 False"""
+    match = RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        length = int(end)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _iter_file_range(path: str, start: int, end: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(RANGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+class StaticIndex:
+    """
+    启动时把前端 dist 目录扫描成内存索引，请求时查字典，不再逐个拼路径、猜类型、找预压缩文件。
+    返回前会重新 stat 一次，前端重新构建后文件变了就重建该条目，避免返回过期的长度和 ETag。
+    同目录下的 .br / .gz 文件作为预压缩版本，客户端支持时优先返回。
+    未知的无后缀路径回退到 index.html（前端路由）。
+    """
+
+    def __init__(self, root: str, index_file: str = "index.html", immutable_prefix: str = "assets/"):
+        self.root = root
+        self.index_file = index_file
+        self.immutable_prefix = immutable_prefix
+        self.entries: Dict[str, dict] = {}
+
+    def _build_entry(self, full_path: str, rel_path: str, names: set) -> dict:
+        name = os.path.basename(full_path)
+        stat = os.stat(full_path)
+        variants = {}
+        for encoding, suffix in ENCODED_SUFFIXES:
+            if name + suffix in names:
+                variants[encoding] = (full_path + suffix, os.stat(full_path + suffix))
+        return {
+            "path": full_path,
+            "stat": stat,
+            "etag": _etag(stat),
+            "media_type": mimetypes.guess_type(name)[0] or "application/octet-stream",
+            "cache_control": IMMUTABLE_CACHE if rel_path.startswith(self.immutable_prefix) else REVALIDATE_CACHE,
+            "variants": variants,
+        }
+
+    def scan(self) -> int:
+        entries = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            names = set(filenames)
+            for name in filenames:
+                if any(name.endswith(suffix) and name[:-len(suffix)] in names for _, suffix in ENCODED_SUFFIXES):
+                    continue
+                full_path = os.path.join(dirpath, name)
+                rel_path = os.path.relpath(full_path, self.root).replace(os.sep, "/")
+                entries[rel_path] = self._build_entry(full_path, rel_path, names)
+        self.entries = entries
+        logger.info("static index built, root=%s files=%s", self.root, len(entries))
+        return len(entries)
+
+    def _load_late_file(self, path: str) -> Optional[dict]:
+        """启动后才生成的文件（如 tmp/img 下的图片）：校验路径后补进索引"""
+        rel_path = os.path.normpath(path).replace(os.sep, "/")
+        if rel_path.startswith("../") or rel_path == ".." or os.path.isabs(rel_path) or "\\" in path:
+            return None
+        full_path = os.path.join(self.root, rel_path)
+        if not os.path.isfile(full_path):
+            return None
+        entry = self._build_entry(full_path, rel_path, set(os.listdir(os.path.dirname(full_path))))
+        self.entries[rel_path] = entry
+        return entry
+
+    def _current(self, rel_path: str) -> Optional[dict]:
+        """取索引条目，磁盘上的文件变了就重建，文件已删除则移出索引"""
+        entry = self.entries.get(rel_path)
+        if entry is None or _is_current(entry):
+            return entry
+        del self.entries[rel_path]
+        return self._load_late_file(rel_path)
+
+    def lookup(self, path: str) -> Optional[dict]:
+        path = path.lstrip("/")
+        entry = self._current(path)
+        if entry is not None:
+            return entry
+        last = path.rsplit("/", 1)[-1]
+        if "." in last:
+            return self._load_late_file(path)
+        # 前端路由（无扩展名）回退到 index.html
+        if path.startswith(self.immutable_prefix):
+            return None
+        return self._current(self.index_file)
+
+    def response(self, request: Request, path: str) -> Response:
+        entry = self.lookup(path)
+        if entry is None:
+            return Response(status_code=404, content="path is not existed")
+
+        headers = {"Cache-Control": entry["cache_control"], "ETag": entry["etag"]}
+        range_header = request.headers.get("range")
+        encoding = None
+        if entry["variants"]:
+            headers["Vary"] = "Accept-Encoding"
+            # 区间请求总是基于原始文件，避免压缩后的偏移量与原文件不一致
+            if not range_header:
+                accepted = accepted_encodings(request)
+                encoding = next((enc for enc, _ in ENCODED_SUFFIXES if enc in accepted and enc in entry["variants"]), None)
+        if encoding is not None:
+            headers["ETag"] = _variant_etag(entry["etag"], encoding)
+        if _not_modified(request, entry):
+            return Response(status_code=304, headers=headers)
+
+        if encoding is not None:
+            variant_path, variant_stat = entry["variants"][encoding]
+            headers["Content-Encoding"] = encoding
+            return FileResponse(variant_path, media_type=entry["media_type"], headers=headers, stat_result=variant_stat)
+
+        size = entry["stat"].st_size
+        headers["Accept-Ranges"] = "bytes"
+        byte_range = _parse_range(range_header, size) if range_header else None
+        if byte_range is False:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                _iter_file_range(entry["path"], start, end),
+                status_code=206,
+                media_type=entry["media_type"],
+                headers=headers,
+            )
+        return FileResponse(entry["path"], media_type=entry["media_type"], headers=headers, stat_result=entry["stat"])
@@ -0,0 +1,159 @@
+import asyncio
+import itertools
+from collections import deque
+from typing import AsyncIterator, Callable, Optional
+
+from backend.util.log import log
+
+logger = log(__name__)
+
+# 缓冲区满时的策略
+POLICY_BLOCK = "block"  # 暂停读取上游，直到客户端消费
+POLICY_COALESCE = "coalesce"  # 把新的增量合并进队尾；超过硬上限后退化为 block
+POLICY_DROP = "drop"  # 超过上限直接断开该连接
+POLICIES = {POLICY_BLOCK, POLICY_COALESCE, POLICY_DROP}
+
+COALESCE_HARD_LIMIT_FACTOR = 2
+
+# connection id -> BoundedStreamBuffer，用于按连接统计内存
+ACTIVE_BUFFERS = {}
+_buffer_ids = itertools.count(1)
+
+
+class BoundedStreamBuffer:
+    """
+    上游读取与响应写出之间的有界缓冲。
+    上游由独立任务读取并写入缓冲，客户端按自己的速度消费；
+    缓冲字节数受 max_bytes 约束，满了以后按 policy 处理。
+    """
+
+    def __init__(
+        self,
+        source: AsyncIterator[str],
+        max_bytes: int,
+        policy: str = POLICY_BLOCK,
+        merge: Optional[Callable[[str, str], Optional[str]]] = None,
+        label: str = "",
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown stream buffer policy: {policy}")
+        self.id = next(_buffer_ids)
+        self.label = label
+        self.source = source
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.merge = merge
+        self.queue = deque()
+        self.buffered_bytes = 0
+        self.peak_bytes = 0
+        self.total_bytes = 0
+        self.coalesced = 0
+        self.blocked = 0
+        self.overflowed = False
+        self.done = False
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    def stats(self) -> dict:
+        return {
+            "id": self.id,
+            "label": self.label,
+            "policy": self.policy,
+            "buffered_bytes": self.buffered_bytes,
+            "peak_bytes": self.peak_bytes,
+            "total_bytes": self.total_bytes,
+            "queued_chunks": len(self.queue),
+            "coalesced": self.coalesced,
+            "blocked": self.blocked,
+            "overflowed": self.overflowed,
+        }
+
+    def _push(self, chunk: str, size: int):
+        self.queue.append((chunk, size))
+        self.buffered_bytes += size
+        self.total_bytes += size
+        self.peak_bytes = max(self.peak_bytes, self.buffered_bytes)
+        self._readable.set()
+
+    def _try_coalesce(self, chunk: str, size: int) -> bool:
+        if self.policy != POLICY_COALESCE or self.merge is None or not self.queue:
+            return False
+        tail, tail_size = self.queue[-1]
+        merged = self.merge(tail, chunk)
+        if merged is None:
+            return False
+        merged_size = len(merged.encode("utf-8"))
+        if self.buffered_bytes - tail_size + merged_size > self.max_bytes * COALESCE_HARD_LIMIT_FACTOR:
+            return False
+        self.queue[-1] = (merged, merged_size)
+        self.buffered_bytes += merged_size - tail_size
+        self.total_bytes += size
+        self.peak_bytes = max(self.peak_bytes, self.buffered_bytes)
+        self.coalesced += 1
+        return True
+
+    async def _put(self, chunk: str):
+        size = len(chunk.encode("utf-8"))
+        while self.queue and self.buffered_bytes + size > self.max_bytes:
+            if self._try_coalesce(chunk, size):
+                return
+            if self.policy == POLICY_DROP:
+                self.overflowed = True
+                return
+            self.blocked += 1
+            self._writable.clear()
+            await self._writable.wait()
+        self._push(chunk, size)
+
+    async def _produce(self):
+        try:
+            async for chunk in self.source:
+                await self._put(chunk)
+                if self.overflowed:
+                    logger.warning(
+                        "stream buffer overflow, drop connection id=%s label=%s buffered=%s",
+                        self.id, self.label, self.buffered_bytes,
+                    )
+                    break
+        finally:
+            self.done = True
+            self._readable.set()
+            aclose = getattr(self.source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    async def __aiter__(self):
+        ACTIVE_BUFFERS[self.id] = self
+        producer = asyncio.ensure_future(self._produce())
+        try:
+            while True:
+                if self.overflowed:
+                    break
+                if self.queue:
+                    chunk, size = self.queue.popleft()
+                    self.buffered_bytes -= size
+                    self._writable.set()
+                    yield chunk
+                    continue
+                if self.done:
+                    break
+                self._readable.clear()
+                await self._readable.wait()
+            if producer.done() and not producer.cancelled() and producer.exception():
+                raise producer.exception()
+        finally:
+            ACTIVE_BUFFERS.pop(self.id, None)
+            if not producer.done():
+                producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+
+
+def get_buffer_stats() -> dict:
+    """所有活跃流连接的缓冲内存统计"""
+    connections = [buf.stats() for buf in ACTIVE_BUFFERS.values()]
+    return {
+        "connections": len(connections),
+        "buffered_bytes": sum(c["buffered_bytes"] for c in connections),
+        "details": connections,
+    }
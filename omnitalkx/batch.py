@@ -0,0 +1,41 @@
+import argparse
+import asyncio
+import json
+import os
+
+from backend.config.constant import BATCH_MAX_RETRIES, BATCH_MODEL_CONCURRENCY
+from backend.service.batch_service import BatchJob
+from backend.service.service_openrouter import close_http_client
+from backend.service.usage_service import USAGE_WRITER
+
+
+async def run_batch(args) -> dict:
+    job = BatchJob(args.input, args.output, args.api_key, args.concurrency, args.retries)
+    try:
+        return await job.run()
+    finally:
+        await close_http_client()
+        await USAGE_WRITER.flush()
+
+
+def main():
+    """
+    批量评测命令行：python batch.py prompts.jsonl -o results.jsonl
+    输入每行 {"id"?, "provider", "messages", ...}；中断后用同样的参数重新执行即可从断点继续
+    """
+    parser = argparse.ArgumentParser(description="OmniTalk X batch completion")
+    parser.add_argument("input", help="输入 JSONL 文件")
+    parser.add_argument("-o", "--output", required=True, help="输出 JSONL 文件（同时作为检查点）")
+    parser.add_argument("-c", "--concurrency", type=int, default=BATCH_MODEL_CONCURRENCY, help="每个模型的并发数")
+    parser.add_argument("-r", "--retries", type=int, default=BATCH_MAX_RETRIES, help="可重试错误的最大重试次数")
+    parser.add_argument("--api-key", default=os.environ.get("OPENROUTER_API_KEY", ""), help="默认读取 OPENROUTER_API_KEY")
+    args = parser.parse_args()
+    if not args.api_key:
+        parser.error("请通过 --api-key 或环境变量 OPENROUTER_API_KEY 提供 API Key")
+
+    report = asyncio.run(run_batch(args))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,20 @@
 import os
-import argparse
+from contextlib import asynccontextmanager
 
-import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
 from starlette.responses import HTMLResponse
 
-from backend.api.route_openrouter import router as openrouter
+from backend.api.route_openrouter import router as openrouter, precompute_responses
 from backend.api.route_groups import router as groups
-from backend.config.biz_config import img_out_path, load_config, BizConfig
-from backend.util.log import log
-from backend.util.str_util import safe_join
+from backend.api.route_batch import router as batch
+from backend.config.biz_config import img_out_path, BizConfig
+from backend.service.group_service import ensure_contexts_dir
+from backend.service.service_openrouter import API_KEY_POOL, PROVIDER_REGISTRY, close_http_client
+from backend.service.usage_service import USAGE_WRITER
+from backend.util.http_cache import PrecomputedJSON
+from backend.util.log import clear_other_log, log
+from backend.util.static_files import StaticIndex
 
 
 logger = log(__name__)
@@ -20,6 +23,7 @@ API_VER = 'v1'
 base_dir = os.path.dirname(os.path.abspath(__file__))
 STATIC_RESOURCE_DIR = os.path.join(base_dir, "frontend", "dist")
 ASSETS_RESOURCE_DIR = os.path.join(STATIC_RESOURCE_DIR, "assets")
+STATIC_INDEX = StaticIndex(STATIC_RESOURCE_DIR)
 
 path = img_out_path()
 
@@ -99,36 +103,66 @@ DEFAULT_CONFIG = {
 }
 
 BIZ_CONFIG = BizConfig(**DEFAULT_CONFIG)
+# BizConfig.json 每次都会 deepcopy，这里只在配置对象替换时重新生成
+CONFIG_RESPONSE = PrecomputedJSON(lambda: BIZ_CONFIG.json)
 
-app = FastAPI(title="OmniTalk X - AI Chat Group")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    启动时才做的初始化：import main 只定义对象，不读写磁盘，
+    这样扩容新 worker 时 import 尽可能快，耗时的准备工作集中在这里。
+    """
+    clear_other_log()
+    ensure_contexts_dir()
+    # 编译提供方注册表；models_override.json 变更或收到 SIGHUP 时热更新
+    PROVIDER_REGISTRY.reload()
+    PROVIDER_REGISTRY.start_watcher()
+    # OpenRouter Key 池；api_key_pool.json 变更后在下次分配 Key 时热更新
+    API_KEY_POOL.reload()
+    # 前端构建产物建立索引，请求时不再逐个 stat
+    STATIC_INDEX.scan()
+    # /config/json、/api/providers、/api/default-prompts 序列化并压缩好
+    CONFIG_RESPONSE.get(id(BIZ_CONFIG))
+    precompute_responses()
+    USAGE_WRITER.start()
+    try:
+        yield
+    finally:
+        PROVIDER_REGISTRY.stop_watcher()
+        # 退出前把内存中的 usage 记录写完
+        await USAGE_WRITER.stop()
+        await close_http_client()
+
+
+app = FastAPI(title="OmniTalk X - AI Chat Group", lifespan=lifespan)
 
 
 @app.get("/config/json")
-async def get_config_json():
-    return BIZ_CONFIG.json
+async def get_config_json(request: Request):
+    return CONFIG_RESPONSE.response(request, id(BIZ_CONFIG))
 
 
 # add api routers
 app.include_router(openrouter, prefix="/api")
 app.include_router(groups, prefix="/api")
+app.include_router(batch, prefix="/api")
 
 
 @app.get("/", response_class=HTMLResponse)
 @app.get("/home", response_class=HTMLResponse)
-async def server():
-    return FileResponse(f"{STATIC_RESOURCE_DIR}/index.html")
+async def server(request: Request):
+    return STATIC_INDEX.response(request, "index.html")
 
 
 @app.get("/assets/{path:path}")
-async def build_resource(path: str):
-    static_file = safe_join(ASSETS_RESOURCE_DIR, path)
-    return FileResponse(static_file)
+async def build_resource(path: str, request: Request):
+    return STATIC_INDEX.response(request, f"assets/{path}")
 
 
 @app.get("/{path:path}")
-async def build_resource(path: str):
-    static_file = safe_join(STATIC_RESOURCE_DIR, path)
-    return FileResponse(static_file)
+async def build_resource(path: str, request: Request):
+    return STATIC_INDEX.response(request, path)
 
 
 # add middlewares here if you need
@@ -146,6 +180,8 @@ def main():
     main function
     start server use uvicorn, default workers: 3
     """
+    import uvicorn
+
     uvicorn.run(
         "main:app",
         host='0.0.0.0',
@@ -0,0 +1,80 @@
+import json
+import logging
+import queue
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from omnitalkx.backend.util import log as log_util
+
+
+def make_record(msg, level=logging.WARNING, args=(), **extra):
+    record = logging.LogRecord("backend.service", level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_log_attaches_single_shared_handler():
+    first = log_util.log("test.duplicate")
+    second = log_util.log("test.duplicate")
+    assert first is second
+    assert first.handlers.count(log_util.get_queue_handler()) == 1
+    assert len(first.handlers) == 1
+
+
+def test_rate_limit_filter_merges_repeated_errors():
+    limiter = log_util.RateLimitFilter(window=0.05, burst=2)
+    template = "google upstream error model=%s status=%s body=%s"
+    passed = [limiter.filter(make_record(template, args=("m", 429, "x"))) for _ in range(10)]
+    assert passed == [True, True] + [False] * 8
+
+    import time
+    time.sleep(0.06)
+    record = make_record(template, args=("m", 429, "x"))
+    assert limiter.filter(record)
+    assert record.suppressed == 8
+    assert "suppressed 8 similar" in record.getMessage()
+
+    assert all(limiter.filter(make_record("info %s", logging.INFO, ("x",))) for _ in range(10))
+
+
+def test_sampling_filter_only_samples_low_levels():
+    sampler = log_util.SamplingFilter({"backend": 0.0, "backend.api.route_groups": 1.0})
+    assert not sampler.filter(make_record("poll", logging.INFO))
+    assert sampler.filter(make_record("poll", logging.INFO, path="backend.api.route_groups"))
+    assert sampler.filter(make_record("boom", logging.ERROR))
+
+
+def test_json_formatter_and_dropping_queue():
+    line = log_util.JsonFormatter().format(make_record("status=%s", args=(502,), group_id="grp_all"))
+    data = json.loads(line)
+    assert data["msg"] == "status=502"
+    assert data["level"] == "WARNING"
+    assert data["group_id"] == "grp_all"
+
+    handler = log_util.DroppingQueueHandler(queue.Queue(1))
+    handler.emit(make_record("a"))
+    handler.emit(make_record("b"))
+    assert handler.dropped == 1
+
+
+def test_queue_handler_keeps_exception_for_background_formatter():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.LogRecord("backend.service", logging.ERROR, __file__, 1, "failed %s", ("x",), sys.exc_info())
+
+    prepared = log_util.DroppingQueueHandler(queue.Queue()).prepare(record)
+    assert prepared.msg == "failed x" and prepared.args is None
+    data = json.loads(log_util.JsonFormatter().format(prepared))
+    assert data["msg"] == "failed x"
+    assert "ValueError: boom" in data["exc"]
+
+
+def test_parse_sample_rates():
+    rates = log_util.parse_sample_rates("backend.api.route_groups=0.1, backend.service=1,bad,x=2,y=abc")
+    assert rates == {"backend.api.route_groups": 0.1, "backend.service": 1.0}
+    assert log_util.parse_sample_rates("") == {}
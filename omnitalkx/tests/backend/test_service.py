@@ -42,3 +42,465 @@ def test_get_random_providers_subset():
     providers = svc.get_random_providers(5)
     assert 0 < len(providers) <= 5
     assert set(providers).issubset(set(svc.PROVIDERS.keys()))
+
+
+def test_build_payload_marks_cache_breakpoints_for_anthropic():
+    payload = {
+        "messages": [
+            {"role": "user", "content": "first"},
+            {"role": "assistant", "content": "reply"},
+            {"role": "user", "content": "second"},
+        ],
+    }
+    normalized = svc.build_payload("anthropic", payload)
+    system, _, history_tail, last = normalized["messages"]
+    assert system["content"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert history_tail["content"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert last["content"] == "second"
+    assert payload["messages"][1]["content"] == "reply"
+
+
+def test_build_payload_keeps_plain_prefix_for_auto_cache_providers():
+    normalized = svc.build_payload("openai", {"messages": [{"role": "user", "content": "hi"}]})
+    assert normalized["messages"][0]["content"] == svc.PROVIDERS["openai"]["default_system"]
+    assert normalized["usage"] == {"include": True}
+
+
+def test_record_cache_usage_tracks_hit_rate():
+    svc.CACHE_STATS.clear()
+    svc.record_cache_usage("anthropic", {"prompt_tokens": 100, "prompt_tokens_details": {"cached_tokens": 80}})
+    svc.record_cache_usage("anthropic", {"prompt_tokens": 100})
+    stats = svc.get_cache_stats()["anthropic"]
+    assert stats["requests"] == 2
+    assert stats["cached_tokens"] == 80
+    assert stats["hit_rate"] == 0.4
+
+
+def test_provider_registry_hot_reload(tmp_path):
+    from omnitalkx.backend.service.provider_registry import ProviderRegistry
+
+    override = tmp_path / "models_override.json"
+    registry = ProviderRegistry(svc.PROVIDERS, override)
+    assert registry.get("OpenAI")["id"] == svc.PROVIDERS["openai"]["id"]
+
+    override.write_text(json.dumps({"openai": {"id": "openai/gpt-4o-mini"}}), encoding="utf-8")
+    in_flight = registry.get("openai")
+    assert registry.reload() is True
+    assert registry.get("openai")["id"] == "openai/gpt-4o-mini"
+    assert in_flight["id"] == svc.PROVIDERS["openai"]["id"]
+
+    override.write_text("{broken", encoding="utf-8")
+    assert registry.reload() is False
+    assert registry.get("openai")["id"] == "openai/gpt-4o-mini"
+
+    # 出错的文件不会被轮询反复读取，直到它再次被修改
+    reads = []
+    read_overrides = registry._read_overrides
+    registry._read_overrides = lambda: reads.append(1) or read_overrides()
+    registry.reload_if_changed()
+    assert reads == []
+
+
+def test_get_provider_config_unknown_provider():
+    with pytest.raises(Exception):
+        svc.get_provider_config("unknown")
+
+
+def test_usage_writer_flush_and_daily_rollup(tmp_path):
+    import asyncio
+    from omnitalkx.backend.service import usage_service
+
+    writer = usage_service.UsageWriter(directory=str(tmp_path))
+    usage = {"prompt_tokens": 10, "completion_tokens": 5, "cost": 0.001,
+             "prompt_tokens_details": {"cached_tokens": 4}}
+    writer.record(usage_service.build_usage_record("r1", "openai", "m", usage, "sk-a", "grp_all"))
+    writer.record(usage_service.build_usage_record("r2", "openai", "m", usage, "sk-b"))
+    asyncio.run(writer.flush())
+    assert not writer.pending
+
+    rows = usage_service.aggregate_daily(str(tmp_path), days=1, group_by="provider")
+    assert len(rows) == 1
+    assert rows[0]["requests"] == 2
+    assert rows[0]["cached_tokens"] == 8
+    assert rows[0]["cost"] == 0.002
+    assert "sk-a" not in (tmp_path / f"usage-{rows[0]['day'].replace('-', '')}.jsonl").read_text()
+
+
+def test_prompt_prefix_is_built_once_and_reused():
+    svc.PREFIX_CACHE.clear()
+    prefix = svc.build_prompt_prefix("anthropic", "群公告内容")
+    assert len(prefix) == 2
+    assert prefix[1]["content"][0]["text"] == "【群公告】群公告内容"
+
+    payload = svc.build_payload("anthropic", {"messages": [{"role": "user", "content": "hi"}]})
+    assert payload["messages"][0] is prefix[0]
+
+
+def test_schedule_prewarm_is_rate_limited(monkeypatch):
+    import asyncio
+    from omnitalkx.backend.service import prewarm_service
+
+    warmed = []
+
+    async def fake_prewarm(group_id, bots):
+        warmed.append(group_id)
+
+    monkeypatch.setattr(prewarm_service, "prewarm_group", fake_prewarm)
+    monkeypatch.setattr(prewarm_service, "PREWARM_BUCKET", prewarm_service.TokenBucket(0, 2))
+    prewarm_service.LAST_PREWARM.clear()
+
+    async def open_groups():
+        results = [
+            prewarm_service.schedule_prewarm({"id": "g1", "bots": ["claude"]}),
+            prewarm_service.schedule_prewarm({"id": "g1", "bots": ["claude"]}),
+            prewarm_service.schedule_prewarm({"id": "g2", "bots": ["qwen"]}),
+            prewarm_service.schedule_prewarm({"id": "g3", "bots": ["kimi"]}),
+        ]
+        await asyncio.sleep(0)
+        return results
+
+    assert asyncio.run(open_groups()) == [True, False, True, False]
+    assert warmed == ["g1", "g2"]
+
+
+def test_prewarm_only_builds_prefixes_for_cache_control_providers(monkeypatch):
+    from omnitalkx.backend.service import prewarm_service
+
+    built = []
+    monkeypatch.setattr(prewarm_service, "get_group_announcement", lambda group_id: "群公告内容")
+    monkeypatch.setattr(prewarm_service, "build_prompt_prefix", lambda provider, announcement: built.append(provider))
+    assert prewarm_service.warm_prefixes("g1", ["claude", "chatgpt", "gemini", "qwen", "unknown"]) == 2
+    assert built == ["anthropic", "google"]
+
+
+def test_groups_view_is_rebuilt_only_on_mutation(tmp_path, monkeypatch):
+    from omnitalkx.backend.service import group_service
+
+    monkeypatch.setattr(group_service, "GROUPS_FILE", str(tmp_path / "groups.json"))
+    monkeypatch.setattr(group_service, "CONTEXTS_DIR", str(tmp_path))
+    group_service.invalidate_groups_view()
+
+    view = group_service.get_groups_view()
+    assert group_service.get_groups_view() is view
+    assert "等等（包含小庄）" in group_service.get_group_announcement("grp_all")
+
+    group = group_service.create_group("测试群", ["claude", "qwen"])
+    updated = group_service.get_groups_view()
+    assert updated is not view
+    assert updated["response"].etag != view["response"].etag
+    summary = updated["by_id"][group["id"]]["summary"]
+    assert summary["bot_names"] == ["Claude", "Qwen"]
+    assert summary["bot_count"] == 2
+
+
+def test_cached_json_response_negotiates_encoding_and_etag():
+    import gzip
+    from starlette.requests import Request
+    from omnitalkx.backend.util import http_cache
+
+    def make_request(headers):
+        raw = [(k.lower().encode(), v.encode()) for k, v in headers.items()]
+        return Request({"type": "http", "method": "GET", "path": "/", "headers": raw})
+
+    cached = http_cache.CachedBody({"prompts": {"claude": "提示词" * 200}})
+    resp = http_cache.cached_json_response(make_request({"Accept-Encoding": "br;q=0, gzip"}), cached)
+    assert resp.headers["content-encoding"] == "gzip"
+    assert json.loads(gzip.decompress(resp.body)) == json.loads(cached.body)
+
+    plain = http_cache.cached_json_response(make_request({}), cached)
+    assert "content-encoding" not in plain.headers
+    assert plain.body == cached.body
+
+    not_modified = http_cache.cached_json_response(make_request({"If-None-Match": resp.headers["etag"]}), cached)
+    assert not_modified.status_code == 304
+
+
+class FakeBatchResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data or {}
+        self.text = json.dumps(self.data)
+        self.headers = {"retry-after": "0"} if status_code == 429 else {}
+
+    def json(self):
+        return self.data
+
+
+class FakeBatchClient:
+    def __init__(self):
+        self.calls = 0
+        self.active = {}
+        self.peak = {}
+
+    async def post(self, url, headers, json):
+        import asyncio
+        model = json["model"]
+        self.calls += 1
+        self.active[model] = self.active.get(model, 0) + 1
+        self.peak[model] = max(self.peak.get(model, 0), self.active[model])
+        await asyncio.sleep(0.01)
+        self.active[model] -= 1
+        if json["messages"][-1]["content"] == "flaky" and self.calls % 2:
+            return FakeBatchResponse(429)
+        return FakeBatchResponse(200, {
+            "choices": [{"message": {"content": "ok"}}],
+            "usage": {"completion_tokens": 3},
+        })
+
+
+def test_batch_job_concurrency_retry_and_resume(tmp_path, monkeypatch):
+    import asyncio
+    from omnitalkx.backend.service import batch_service
+
+    client = FakeBatchClient()
+    monkeypatch.setattr(batch_service, "get_http_client", lambda endpoint=None: client)
+    monkeypatch.setattr(batch_service, "record_usage", lambda *args, **kwargs: None)
+
+    input_path = tmp_path / "input.jsonl"
+    output_path = tmp_path / "output.jsonl"
+    lines = [{"id": f"a{i}", "provider": "openai", "messages": [{"role": "user", "content": "hi"}]} for i in range(6)]
+    lines.append({"id": "q", "provider": "qwen", "messages": [{"role": "user", "content": "flaky"}]})
+    input_path.write_text("\n".join(json.dumps(line) for line in lines))
+    # 模拟上次运行已完成 a0，且最后一行只写了一半
+    output_path.write_text(json.dumps({"id": "a0", "success": True}) + "\n{\"id\": \"a1\", \"succ")
+
+    job = batch_service.BatchJob(str(input_path), str(output_path), "sk-test", concurrency=2, max_retries=2)
+    report = asyncio.run(job.run())
+
+    assert report["status"] == "done"
+    assert report["skipped"] == 1
+    assert report["succeeded"] == 6
+    assert max(client.peak.values()) <= 2
+    # 半行被截掉，第一行之后都是本次写入的记录
+    ids = [json.loads(line)["id"] for line in output_path.read_text().splitlines()[1:]]
+    assert sorted(ids) == ["a1", "a2", "a3", "a4", "a5", "q"]
+    assert batch_service.read_checkpoint(str(output_path)) >= {"a0", "q"}
+
+
+def test_batch_job_resumes_after_truncated_multibyte_line(tmp_path, monkeypatch):
+    import asyncio
+    from omnitalkx.backend.service import batch_service
+
+    client = FakeBatchClient()
+    monkeypatch.setattr(batch_service, "get_http_client", lambda endpoint=None: client)
+    monkeypatch.setattr(batch_service, "record_usage", lambda *args, **kwargs: None)
+
+    input_path = tmp_path / "input.jsonl"
+    output_path = tmp_path / "output.jsonl"
+    lines = [{"id": f"a{i}", "provider": "openai", "messages": [{"role": "user", "content": "hi"}]} for i in range(2)]
+    input_path.write_text("\n".join(json.dumps(line) for line in lines))
+    done = json.dumps({"id": "a0", "success": True, "content": "你好"}, ensure_ascii=False) + "\n"
+    partial = json.dumps({"id": "a1", "success": True, "content": "中文回复"}, ensure_ascii=False).encode("utf-8")
+    # 中断在“回”字的 UTF-8 字节中间
+    cut = partial.index("回".encode("utf-8")) + 1
+    output_path.write_bytes(done.encode("utf-8") + partial[:cut])
+
+    job = batch_service.BatchJob(str(input_path), str(output_path), "sk-test", concurrency=1, max_retries=0)
+    report = asyncio.run(job.run())
+
+    assert report["status"] == "done"
+    assert report["skipped"] == 1 and report["succeeded"] == 1
+    records = [json.loads(line) for line in output_path.read_text(encoding="utf-8").splitlines()]
+    assert [record["id"] for record in records] == ["a0", "a1"]
+    assert records[0]["content"] == "你好"
+
+
+def test_batch_retry_delay_honours_http_date_retry_after():
+    import time
+    from email.utils import formatdate
+    from omnitalkx.backend.service import batch_service
+
+    assert batch_service.retry_delay(1, "3") == 3.0
+    assert batch_service.retry_delay(1, "3600") == 60.0
+    assert 8 <= batch_service.retry_delay(1, formatdate(time.time() + 10, usegmt=True)) <= 10
+    # 无法解析时退回指数退避
+    assert batch_service.retry_delay(2, "soon") == 1.4
+
+
+def test_provider_registry_routes_bots_to_custom_endpoints(tmp_path):
+    from omnitalkx.backend.service.provider_registry import ProviderRegistry
+
+    override = tmp_path / "models_override.json"
+    override.write_text(json.dumps({
+        "endpoints": {"local": {"base_url": "http://127.0.0.1:8000/v1/", "api_key": "sk-local"}},
+        "qwen": {"id": "Qwen/Qwen2.5-7B-Instruct", "endpoint": "local"},
+        "deepseek": {"endpoint": {"base_url": "http://10.0.0.2:8080/v1", "headers": {"X-Team": "a"}}},
+    }), encoding="utf-8")
+    registry = ProviderRegistry(svc.PROVIDERS, override)
+
+    qwen, deepseek, openai = registry.get("qwen"), registry.get("deepseek"), registry.get("openai")
+    assert qwen["endpoint"].url == "http://127.0.0.1:8000/v1/chat/completions"
+    assert deepseek["endpoint"].name == "deepseek"
+    assert openai["endpoint"].url == svc.OPENROUTER_URL
+    # 自定义上游用自己的 Key（或不带鉴权），不会收到前端的 OpenRouter Key
+    assert svc.build_headers(qwen, "sk-or")["Authorization"] == "Bearer sk-local"
+    assert "Authorization" not in svc.build_headers(deepseek, "sk-or")
+    assert deepseek["headers"]["X-Team"] == "a" and "X-Title" not in deepseek["headers"]
+    assert svc.build_headers(openai, "sk-or")["Authorization"] == "Bearer sk-or"
+
+    local = qwen["endpoint"]
+    override.write_text(json.dumps({
+        "endpoints": {"local": {"base_url": "http://127.0.0.1:8000/v1/", "api_key": "sk-local"}},
+        "qwen": {"endpoint": "local"},
+        "google": {"endpoint": "missing"},
+    }), encoding="utf-8")
+    assert registry.reload() is False
+    override.write_text(json.dumps({
+        "endpoints": {"local": {"base_url": "http://127.0.0.1:8000/v1/", "api_key": "sk-local"}},
+        "qwen": {"endpoint": "local"},
+    }), encoding="utf-8")
+    assert registry.reload() is True
+    # 配置不变的上游沿用原对象（连接池、健康状态）
+    assert registry.get("qwen")["endpoint"] is local
+    assert "deepseek" not in registry.endpoints
+
+
+def test_custom_endpoint_request_and_cooldown(tmp_path, monkeypatch):
+    import asyncio
+
+    import httpx
+
+    from omnitalkx.backend.service import upstream_endpoint
+    from omnitalkx.backend.service.provider_registry import ProviderRegistry
+
+    monkeypatch.setattr(upstream_endpoint, "ENDPOINT_HEALTH", {})
+    override = tmp_path / "models_override.json"
+    override.write_text(json.dumps({
+        "endpoints": {"local": {"base_url": "http://local.test/v1", "failure_threshold": 2}},
+        "qwen": {"id": "qwen2.5-7b", "endpoint": "local"},
+    }), encoding="utf-8")
+    registry = ProviderRegistry(svc.PROVIDERS, override)
+    monkeypatch.setattr(svc, "PROVIDER_REGISTRY", registry)
+    monkeypatch.setattr(svc, "record_usage", lambda *args, **kwargs: None)
+
+    requests = []
+    status = {"code": 200}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if status["code"] != 200:
+            return httpx.Response(status["code"], text="overloaded")
+        return httpx.Response(200, json={"choices": [{"message": {"content": "本地回复"}}]})
+
+    endpoint = registry.get("qwen")["endpoint"]
+    endpoint._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    async def scenario():
+        payload = {"messages": [{"role": "user", "content": "hi"}]}
+        # 自定义上游不需要前端的 OpenRouter Key
+        ok = await svc.chat_completion("qwen", payload, "")
+        status["code"] = 503
+        failed = [await svc.chat_completion("qwen", payload, "") for _ in range(3)]
+        return ok, failed
+
+    ok, failed = asyncio.run(scenario())
+    assert ok == {"success": True, "msg": "本地回复"}
+    sent = json.loads(requests[0].content)
+    assert str(requests[0].url) == "http://local.test/v1/chat/completions"
+    assert sent["model"] == "qwen2.5-7b" and "usage" not in sent
+    assert "authorization" not in requests[0].headers
+    # 连续两次 503 后熔断，第三次不再打到上游
+    assert len(requests) == 3
+    assert "暂不可用" in failed[2]["msg"]
+    status_by_name = {item["name"]: item for item in svc.get_endpoint_status()["endpoints"]}
+    assert status_by_name["local"]["healthy"] is False
+    assert status_by_name["local"]["failures"] == 2
+
+
+def test_api_key_pool_weighted_round_robin_and_cooldown(tmp_path, monkeypatch):
+    from omnitalkx.backend.service.key_pool import ApiKeyPool
+
+    path = tmp_path / "api_key_pool.json"
+    monkeypatch.setenv("POOL_KEY_B", "sk-b")
+    path.write_text(json.dumps({"keys": [
+        {"name": "a", "key": "sk-a", "weight": 2},
+        {"name": "b", "key_env": "POOL_KEY_B"},
+        {"name": "c", "key_env": "POOL_KEY_MISSING"},
+    ]}), encoding="utf-8")
+    pool = ApiKeyPool(path)
+    assert len(pool) == 2
+    # 平滑加权轮询：权重 2:1，且不会连续把同一个 Key 用满
+    assert [pool.acquire() for _ in range(6)] == ["sk-a", "sk-b", "sk-a", "sk-a", "sk-b", "sk-a"]
+
+    pool.observe({"Authorization": "Bearer sk-a"}, 429, {"retry-after": "30"})
+    assert {pool.acquire() for _ in range(3)} == {"sk-b"}
+    pool.observe({"Authorization": "Bearer sk-b"}, 200, {"x-ratelimit-remaining": "0", "x-ratelimit-reset": "20"})
+    assert pool.acquire() == ""
+    assert 19 < pool.retry_after() <= 20
+    # 不是池中的 Key 不影响状态
+    pool.observe({"Authorization": "Bearer sk-user"}, 429, {})
+
+    pool.record_usage("sk-a", {"prompt_tokens": 10, "completion_tokens": 5, "cost": 0.01})
+    stats = {item["name"]: item for item in pool.stats()}
+    assert stats["a"]["cooldown_reason"] == "rate_limited" and stats["a"]["rate_limited"] == 1
+    assert stats["a"]["requests"] == 4 and stats["a"]["prompt_tokens"] == 10
+    assert stats["b"]["cooldown_reason"] == "rate_limit_reached"
+    assert "sk-a" not in json.dumps(stats)
+
+    # 热更新：仍在池中的 Key 保留冷却状态与计数
+    path.write_text(json.dumps({"keys": [{"name": "a2", "key": "sk-a"}, {"key": "sk-d"}]}), encoding="utf-8")
+    assert pool.reload() is True
+    assert pool.acquire() == "sk-d"
+    assert {item["name"]: item["requests"] for item in pool.stats()} == {"a2": 4, "key-2": 1}
+
+
+def test_stream_switches_pooled_key_after_rate_limit(tmp_path, monkeypatch):
+    import asyncio
+
+    import httpx
+
+    from omnitalkx.backend.service.key_pool import ApiKeyPool, key_fingerprint
+
+    path = tmp_path / "api_key_pool.json"
+    path.write_text(json.dumps({"keys": [{"name": "a", "key": "sk-a"}, {"name": "b", "key": "sk-b"}]}))
+    pool = ApiKeyPool(path)
+    monkeypatch.setattr(svc, "API_KEY_POOL", pool)
+    usage_keys = []
+    monkeypatch.setattr(svc.USAGE_WRITER, "record", lambda record: usage_keys.append(record["key_id"]))
+
+    used = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        key = request.headers["authorization"]
+        used.append(key)
+        if key == "Bearer sk-a":
+            return httpx.Response(429, headers={"retry-after": "30"}, text="rate limited")
+        body = (
+            'data: {"choices": [{"delta": {"content": "ok"}}]}\n\n'
+            'data: {"choices": [{"delta": {}, "finish_reason": "stop"}], "usage": {"prompt_tokens": 3}}\n\n'
+            "data: [DONE]\n\n"
+        )
+        return httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+
+    monkeypatch.setattr(svc, "_http_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    async def consume():
+        return [frame async for frame in svc.chat_completion_stream("openai", {"messages": []}, "")]
+
+    frames = asyncio.run(consume())
+    assert used == ["Bearer sk-a", "Bearer sk-b"]
+    assert any('"ok"' in frame for frame in frames)
+    # 记账归到实际发出请求的 Key
+    assert usage_keys == [key_fingerprint("sk-b")]
+    stats = {item["name"]: item for item in pool.stats()}
+    assert stats["a"]["available"] is False and stats["b"]["successes"] == 1
+    assert stats["b"]["prompt_tokens"] == 3
+
+
+def test_group_chat_records_usage_under_group_id(monkeypatch):
+    import asyncio
+
+    import httpx
+
+    monkeypatch.setattr(svc, "CONTEXT_STORAGE", {})
+    groups = []
+    monkeypatch.setattr(svc.USAGE_WRITER, "record", lambda record: groups.append(record["group_id"]))
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}], "usage": {"prompt_tokens": 3}})
+
+    monkeypatch.setattr(svc, "_http_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    results = asyncio.run(svc.group_chat(["openai", "deepseek"], "hi", "sk-test", "grp_work"))
+    assert [item["success"] for item in results] == [True, True]
+    assert groups == ["grp_work", "grp_work"]
@@ -0,0 +1,79 @@
+import gzip
+import sys
+from pathlib import Path
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from omnitalkx.backend.util.static_files import IMMUTABLE_CACHE, StaticIndex
+
+
+def make_client(tmp_path):
+    (tmp_path / "assets").mkdir()
+    (tmp_path / "index.html").write_text("<html>app</html>")
+    script = b"console.log('hello');" * 100
+    (tmp_path / "assets" / "index-abc123.js").write_bytes(script)
+    (tmp_path / "assets" / "index-abc123.js.gz").write_bytes(gzip.compress(script))
+
+    index = StaticIndex(str(tmp_path))
+    index.scan()
+    app = FastAPI()
+
+    @app.get("/{path:path}")
+    async def serve(path: str, request: Request):
+        return index.response(request, path)
+
+    return TestClient(app), index, script
+
+
+def test_static_index_serves_precompressed_immutable_assets(tmp_path):
+    client, index, script = make_client(tmp_path)
+    assert set(index.entries) == {"index.html", "assets/index-abc123.js"}
+
+    resp = client.get("/assets/index-abc123.js", headers={"Accept-Encoding": "gzip"})
+    assert resp.status_code == 200
+    assert resp.headers["content-encoding"] == "gzip"
+    assert resp.headers["cache-control"] == IMMUTABLE_CACHE
+    assert resp.content == script
+
+    again = client.get("/assets/index-abc123.js", headers={"If-None-Match": resp.headers["etag"]})
+    assert again.status_code == 304
+
+
+def test_static_index_range_and_spa_fallback(tmp_path):
+    client, _, script = make_client(tmp_path)
+
+    partial = client.get("/assets/index-abc123.js", headers={"Range": "bytes=0-6", "Accept-Encoding": "gzip"})
+    assert partial.status_code == 206
+    assert partial.content == script[:7]
+    assert partial.headers["content-range"] == f"bytes 0-6/{len(script)}"
+    assert client.get("/assets/index-abc123.js", headers={"Range": "bytes=99999-"}).status_code == 416
+
+    assert client.get("/chat/grp_all").text == "<html>app</html>"
+    assert client.get("/assets/missing.js").status_code == 404
+    assert client.get("/../secret.txt").status_code == 404
+
+
+def test_static_index_picks_up_rebuilt_files(tmp_path):
+    import os
+
+    client, _, _ = make_client(tmp_path)
+    first = client.get("/")
+    assert first.text == "<html>app</html>"
+
+    # 前端重新构建：同名文件内容和长度都变了
+    (tmp_path / "index.html").write_text("<html>rebuilt app</html>")
+    stat = os.stat(tmp_path / "index.html")
+    os.utime(tmp_path / "index.html", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    rebuilt = client.get("/")
+    assert rebuilt.text == "<html>rebuilt app</html>"
+    assert rebuilt.headers["content-length"] == str(len("<html>rebuilt app</html>"))
+    assert rebuilt.headers["etag"] != first.headers["etag"]
+
+    os.remove(tmp_path / "assets" / "index-abc123.js.gz")
+    os.remove(tmp_path / "assets" / "index-abc123.js")
+    assert client.get("/assets/index-abc123.js", headers={"Accept-Encoding": "gzip"}).status_code == 404
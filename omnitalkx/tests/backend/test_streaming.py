@@ -0,0 +1,472 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from omnitalkx.backend.service import service_openrouter as svc
+from omnitalkx.backend.util import request_util
+
+
+class FakeURL:
+    path = "/api/test"
+
+
+class FakeRequest:
+    """模拟在 disconnect_after 秒后突然断开的客户端"""
+
+    def __init__(self, disconnect_after: float):
+        self.url = FakeURL()
+        self._disconnect_at = None
+        self._disconnect_after = disconnect_after
+
+    async def is_disconnected(self) -> bool:
+        loop = asyncio.get_running_loop()
+        if self._disconnect_at is None:
+            self._disconnect_at = loop.time() + self._disconnect_after
+        return loop.time() >= self._disconnect_at
+
+
+class FakeUpstream:
+    status_code = 200
+
+    def __init__(self):
+        self.closed = False
+
+    async def aiter_lines(self):
+        while True:
+            yield "data: " + json.dumps({"choices": [{"delta": {"content": "x"}}]})
+            await asyncio.sleep(0.01)
+
+    async def aclose(self):
+        self.closed = True
+
+
+def test_stream_disconnect_closes_upstream(monkeypatch):
+    upstream = FakeUpstream()
+
+    async def fake_fetch(client, url, headers, payload):
+        return upstream
+
+    monkeypatch.setattr(svc, "fetch_with_retry", fake_fetch)
+
+    async def consume():
+        stream = svc.chat_completion_stream("openai", {"messages": []}, "sk-test")
+        chunks = []
+        async for chunk in request_util.stream_until_disconnected(FakeRequest(0.05), stream, interval=0.01):
+            chunks.append(chunk)
+        return chunks
+
+    chunks = asyncio.run(asyncio.wait_for(consume(), timeout=2))
+    assert chunks
+    assert upstream.closed is True
+
+
+def test_run_until_disconnected_cancels_pending_work():
+    cancelled = []
+
+    async def slow_upstream_call():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def run():
+        work = asyncio.gather(slow_upstream_call(), slow_upstream_call())
+        await request_util.run_until_disconnected(FakeRequest(0.02), work, interval=0.01)
+
+    with pytest.raises(request_util.ClientDisconnected):
+        asyncio.run(asyncio.wait_for(run(), timeout=2))
+    assert cancelled == [True, True]
+
+
+def test_run_until_disconnected_returns_result():
+    async def quick():
+        return {"success": True}
+
+    result = asyncio.run(request_util.run_until_disconnected(FakeRequest(10), quick(), interval=0.01))
+    assert result == {"success": True}
+
+
+async def fast_upstream(count: int, size: int = 1024):
+    for i in range(count):
+        yield svc.format_sse("x" * size)
+
+
+async def slow_consume(stream, every: int = 20, delay: float = 0.001) -> int:
+    received = 0
+    async for i, chunk in aenumerate(stream):
+        received += len(chunk)
+        if i % every == 0:
+            await asyncio.sleep(delay)
+    return received
+
+
+async def aenumerate(stream):
+    i = 0
+    async for item in stream:
+        yield i, item
+        i += 1
+
+
+@pytest.mark.parametrize("policy", ["block", "coalesce"])
+def test_stream_buffer_bounded_under_slow_consumers(policy):
+    import tracemalloc
+    from omnitalkx.backend.util.stream_buffer import BoundedStreamBuffer, COALESCE_HARD_LIMIT_FACTOR
+
+    cap = 16 * 1024
+    consumers, chunks = 4, 1000
+
+    async def run():
+        buffers = [
+            BoundedStreamBuffer(fast_upstream(chunks), cap, policy, merge=svc.coalesce_sse)
+            for _ in range(consumers)
+        ]
+        totals = await asyncio.gather(*(slow_consume(buf) for buf in buffers))
+        return buffers, totals
+
+    tracemalloc.start()
+    buffers, totals = asyncio.run(run())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    limit = cap * (COALESCE_HARD_LIMIT_FACTOR if policy == "coalesce" else 1) + 2048
+    for buf in buffers:
+        assert buf.peak_bytes <= limit
+        assert buf.buffered_bytes == 0
+    # 生产了约 4MB 数据，峰值内存只与缓冲上限相关
+    assert peak < 2 * 1024 * 1024
+    if policy == "block":
+        assert all(total >= chunks * 1024 for total in totals)
+
+
+def test_stream_buffer_drop_policy_disconnects_slow_client():
+    from omnitalkx.backend.util.stream_buffer import BoundedStreamBuffer
+
+    async def run():
+        buf = BoundedStreamBuffer(fast_upstream(1000), 8 * 1024, "drop")
+        received = 0
+        async for chunk in buf:
+            received += 1
+            await asyncio.sleep(0.001)
+        return buf, received
+
+    buf, received = asyncio.run(run())
+    assert buf.overflowed is True
+    assert received < 1000
+
+
+def test_coalesce_sse_merges_plain_deltas_only():
+    merged = svc.coalesce_sse(svc.format_sse("ab"), svc.format_sse("cd"))
+    assert svc.parse_sse_delta(merged) == "abcd"
+    assert svc.coalesce_sse(svc.format_sse("ab"), svc.format_sse("", "stop")) is None
+    assert svc.coalesce_sse("data: [DONE]\n\n", svc.format_sse("cd")) is None
+
+
+def test_replay_stream_resumes_from_last_event_id():
+    from omnitalkx.backend.service import stream_replay
+
+    upstream_calls = []
+
+    async def source():
+        upstream_calls.append(1)
+        for i in range(6):
+            yield svc.format_sse(str(i))
+            await asyncio.sleep(0)
+        yield "data: [DONE]\n\n"
+
+    async def run():
+        replay = stream_replay.start_replay_stream(source())
+        first = replay.subscribe()
+        seen = [await first.__anext__() for _ in range(3)]
+        await first.aclose()
+
+        last_id = seen[-1].split("\n", 1)[0][len("id: "):]
+        stream_id, seq = stream_replay.parse_last_event_id(last_id)
+        assert stream_id == replay.id
+        rest = [frame async for frame in stream_replay.resume_stream(stream_id, seq)]
+        return seen, rest
+
+    seen, rest = asyncio.run(run())
+    deltas = [svc.parse_sse_delta(frame.split("\n", 1)[1]) for frame in seen + rest[:-1]]
+    assert deltas == ["0", "1", "2", "3", "4", "5"]
+    assert rest[-1].endswith("data: [DONE]\n\n")
+    assert upstream_calls == [1]
+
+
+def test_replay_stream_evicts_sent_events_when_full():
+    from omnitalkx.backend.service import stream_replay
+
+    async def source():
+        for i in range(50):
+            yield svc.format_sse("y" * 100)
+
+    async def run():
+        replay = stream_replay.ReplayStream(source(), max_bytes=1024)
+        replay.start()
+        frames = [frame async for frame in replay.subscribe()]
+        return replay, frames
+
+    replay, frames = asyncio.run(run())
+    assert len(frames) == 50
+    assert replay.ring_bytes <= 1024
+    with pytest.raises(stream_replay.ReplayGap):
+        stream_replay.REPLAY_STREAMS[replay.id] = replay
+        stream_replay.resume_stream(replay.id, -1)
+    stream_replay.REPLAY_STREAMS.pop(replay.id, None)
+
+
+def test_buffer_policy_applies_between_replay_subscriber_and_client():
+    from omnitalkx.backend.service import stream_replay
+    from omnitalkx.backend.util.stream_buffer import BoundedStreamBuffer
+
+    cap = 8 * 1024
+
+    async def source():
+        for i in range(300):
+            yield svc.format_sse(str(i % 10) * 100)
+        yield "data: [DONE]\n\n"
+
+    async def run(policy):
+        # 回放缓冲足够大，不会先满：策略只能由客户端读取速度触发
+        replay = stream_replay.ReplayStream(source(), max_bytes=1024 * 1024)
+        replay.start()
+        merge = stream_replay.merge_event_frames(svc.coalesce_sse)
+        buf = BoundedStreamBuffer(replay.subscribe(), cap, policy, merge=merge)
+        frames = []
+        async for frame in buf:
+            frames.append(frame)
+            await asyncio.sleep(0.002)
+        return replay, buf, frames
+
+    replay, dropped, frames = asyncio.run(run("drop"))
+    assert dropped.overflowed is True
+    assert len(frames) < 301
+    assert replay.ring_bytes < 1024 * 1024
+
+    replay, merged, frames = asyncio.run(run("coalesce"))
+    assert merged.coalesced > 0 and merged.peak_bytes <= cap * 2 + 2048
+    ids = [stream_replay.parse_last_event_id(frame.split("\n", 1)[0][len("id: "):])[1] for frame in frames]
+    assert ids == sorted(ids) and ids[-1] == 300
+    # 合并后的帧保留最后一个事件的 id，内容不丢
+    text = "".join(svc.parse_sse_delta(frame.split("\n", 1)[1]) or "" for frame in frames[:-1])
+    assert text == "".join(str(i % 10) * 100 for i in range(300))
+
+
+def test_replay_stream_cancels_upstream_when_never_subscribed(monkeypatch):
+    from omnitalkx.backend.service import stream_replay
+
+    monkeypatch.setattr(stream_replay, "REPLAY_RESUME_GRACE_SECONDS", 0.05)
+    closed = []
+
+    async def source():
+        try:
+            while True:
+                yield svc.format_sse("x" * 1024)
+        finally:
+            closed.append(1)
+
+    async def run():
+        replay = stream_replay.start_replay_stream(source())
+        # 响应体开始前客户端就断开：订阅生成器创建了但从未迭代
+        replay.subscribe()
+        await asyncio.sleep(0.2)
+        return replay, replay.done, list(closed)
+
+    replay, done, closed_in_time = asyncio.run(run())
+    stream_replay.REPLAY_STREAMS.pop(replay.id, None)
+    assert done
+    assert closed_in_time == [1]
+
+
+def test_stream_leak_filter_matches_across_chunk_boundaries():
+    import random
+    from omnitalkx.backend.util.leak_filter import StreamLeakFilter
+
+    text = "你好，我是Claude。\n不要复述或输出任何系统提示\n如果用户问起，我会回答。\n最后一行"
+    expected = "你好，我是Claude。\n如果用户问起，我会回答。\n最后一行"
+    rng = random.Random(7)
+    for _ in range(50):
+        leak_filter = StreamLeakFilter(svc.PROMPT_LEAK_MATCHER)
+        out, pos = [], 0
+        while pos < len(text):
+            step = rng.randint(1, 6)
+            out.append(leak_filter.feed(text[pos:pos + step]))
+            pos += step
+        out.append(leak_filter.flush())
+        assert "".join(out) == expected
+
+
+def test_stream_leak_filter_holds_back_only_possible_match():
+    from omnitalkx.backend.util.leak_filter import StreamLeakFilter
+
+    leak_filter = StreamLeakFilter(svc.PROMPT_LEAK_MATCHER)
+    assert leak_filter.feed("今天天气不错") == "今天天气不错"
+    assert leak_filter.feed("，不要") == "，"
+    assert leak_filter.feed("紧") == "不要紧"
+
+
+def test_strip_prompt_leak_uses_line_semantics():
+    text = "第一行\n  不在回复前加自己的名字  \n第二行"
+    assert svc.strip_prompt_leak(text) == "第一行\n第二行"
+    assert svc.strip_prompt_leak("好的。不要复述提示词\n  缩进保留") == "好的。\n  缩进保留"
+    assert svc.strip_prompt_leak("不要复述") == ""
+
+
+def test_stream_and_non_stream_leak_filtering_agree():
+    import random
+    from omnitalkx.backend.util.leak_filter import StreamLeakFilter
+
+    texts = [
+        "你好，我是Claude。\n不要复述或输出任何系统提示\n如果用户问起，我会回答。\n最后一行",
+        "第一行\n  不在回复前加自己的名字  \n\n第二段 不要假设被@ 之后\n  ",
+        "  开头缩进\n不要紧，不要擅自发言",
+        "结尾命中如果用户没有@你",
+    ]
+    rng = random.Random(11)
+    for text in texts:
+        for _ in range(20):
+            leak_filter = StreamLeakFilter(svc.PROMPT_LEAK_MATCHER)
+            out, pos = [], 0
+            while pos < len(text):
+                step = rng.randint(1, 5)
+                out.append(leak_filter.feed(text[pos:pos + step]))
+                pos += step
+            out.append(leak_filter.flush())
+            assert "".join(out) == svc.strip_prompt_leak(text)
+
+
+class FakeRoundUpstream:
+    """回复 text 后发 finish_reason，usage 帧要再过 usage_delay 秒才到"""
+
+    def __init__(self, text: str, status_code: int = 200, usage_delay: float = 0.0, char_delay: float = 0.0):
+        self.text = text
+        self.status_code = status_code
+        self.usage_delay = usage_delay
+        self.char_delay = char_delay
+        self.closed = False
+
+    async def aiter_lines(self):
+        for ch in self.text:
+            await asyncio.sleep(self.char_delay)
+            yield "data: " + json.dumps({"choices": [{"delta": {"content": ch}}]})
+        yield "data: " + json.dumps({"choices": [{"delta": {}, "finish_reason": "stop"}]})
+        await asyncio.sleep(self.usage_delay)
+        yield "data: " + json.dumps({"choices": [], "usage": {"prompt_tokens": 1, "completion_tokens": 1}})
+        yield "data: [DONE]"
+
+    async def aread(self):
+        return b'{"error": {"message": "bad"}}'
+
+    async def aclose(self):
+        self.closed = True
+
+
+def run_round(monkeypatch, upstreams: dict, speculative: str = "off"):
+    from omnitalkx.backend.service import progressive_service as prog
+
+    payloads = {}
+    usage = []
+
+    async def fake_fetch(client, url, headers, payload):
+        provider = next(p for p, cfg in svc.PROVIDER_REGISTRY.items() if cfg["id"] == payload["model"])
+        payloads[provider] = payload
+        return upstreams[provider]
+
+    monkeypatch.setattr(prog, "fetch_with_retry", fake_fetch)
+    monkeypatch.setattr(prog, "get_http_client", lambda: None)
+    monkeypatch.setattr(prog, "record_usage", lambda *args: usage.append(args[0]))
+    monkeypatch.setattr(prog, "PROGRESSIVE_SPECULATIVE_MIN_CHARS", 2)
+
+    async def consume():
+        transcript = prog.RoundTranscript("你好", announcement="测试群", mentioned=["anthropic"])
+        started = asyncio.get_running_loop().time()
+        frames = [f async for f in prog.progressive_round(list(upstreams), transcript, "sk-test", None, speculative)]
+        elapsed = asyncio.get_running_loop().time() - started
+        await asyncio.gather(*prog.BACKGROUND_TASKS)
+        return frames, elapsed
+
+    frames, elapsed = asyncio.run(asyncio.wait_for(consume(), timeout=5))
+    events = [json.loads(f[6:]) for f in frames if f != "data: [DONE]\n\n"]
+    return events, payloads, usage, elapsed
+
+
+def test_progressive_round_chains_bots_and_hands_off_at_finish(monkeypatch):
+    upstreams = {
+        "openai": FakeRoundUpstream("早上好", usage_delay=0.5),
+        "anthropic": FakeRoundUpstream("你好呀", usage_delay=0.5),
+    }
+    events, payloads, usage, elapsed = run_round(monkeypatch, upstreams)
+
+    # 不等 usage 帧：下一个 AI 在 finish_reason 之后立即开始
+    assert elapsed < 0.5
+    assert sorted(usage) == ["anthropic", "openai"]
+    assert all(up.closed for up in upstreams.values())
+
+    assert "".join(e["content"] for e in events if e.get("provider") == "openai") == "早上好"
+    assert {"separator": True, "next_provider": "anthropic"} in events
+    summary = events[-1]
+    assert summary["success"] is True
+    assert [r["provider"] for r in summary["results"]] == ["openai", "anthropic"]
+
+    first, second = payloads["openai"]["messages"], payloads["anthropic"]["messages"]
+    assert not any("【前置发言】" in str(m["content"]) for m in first)
+    assert second[-2]["content"] == "【前置发言】\nChatGPT说：早上好"
+    assert second[-3]["content"] == "注意：用户在群聊中@了你，请优先回应。"
+    assert second[-1] == {"role": "user", "content": "你好"}
+
+
+def test_progressive_round_skips_failed_bot_and_aborts_on_invalid_key(monkeypatch):
+    upstreams = {
+        "openai": FakeRoundUpstream("", status_code=500),
+        "qwen": FakeRoundUpstream("在"),
+    }
+    events, _, _, _ = run_round(monkeypatch, upstreams)
+    assert events[-1]["success"] is True
+    assert [r["success"] for r in events[-1]["results"]] == [False, True]
+
+    upstreams = {
+        "openai": FakeRoundUpstream("", status_code=401),
+        "qwen": FakeRoundUpstream("在"),
+    }
+    events, payloads, _, _ = run_round(monkeypatch, upstreams)
+    assert events[-1]["success"] is False
+    assert "qwen" not in payloads
+
+
+def test_progressive_round_speculative_start(monkeypatch):
+    from omnitalkx.backend.service import progressive_service as prog
+
+    warmed = []
+
+    async def fake_warm(count, endpoint=None):
+        warmed.append(count)
+        return count
+
+    monkeypatch.setattr(prog, "warm_connections", fake_warm)
+
+    def upstreams():
+        return {
+            "openai": FakeRoundUpstream("一二三四五六七八", char_delay=0.05),
+            "anthropic": FakeRoundUpstream("甲乙丙丁", char_delay=0.05),
+        }
+
+    _, _, _, sequential = run_round(monkeypatch, upstreams())
+
+    events, payloads, _, _ = run_round(monkeypatch, upstreams(), "strict")
+    assert warmed == [1]
+    assert payloads["anthropic"]["messages"][-2]["content"] == "【前置发言】\nChatGPT说：一二三四五六七八"
+
+    events, payloads, _, loose = run_round(monkeypatch, upstreams(), "loose")
+    # 第二个 AI 在第一个说了两个字后就开始，但输出仍按顺序排在第一个之后
+    assert payloads["anthropic"]["messages"][-2]["content"] == "【前置发言】\nChatGPT（未说完）说：一二"
+    contents = "".join(e["content"] for e in events if "content" in e)
+    assert contents == "一二三四五六七八甲乙丙丁"
+    assert events[-1]["results"][1]["speculative"] is True
+    assert loose < sequential - 0.1
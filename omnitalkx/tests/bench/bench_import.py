@@ -0,0 +1,59 @@
+"""
+冷启动基准：多次在新进程中 import main，统计耗时中位数，并列出 -X importtime 中最耗时的顶层模块。
+用法（在 omnitalkx 目录）：python tests/bench/bench_import.py [--runs 5] [--target-ms 700]
+超过目标耗时返回非零退出码，可以放进 CI。
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parents[2]
+
+# 基线（开发机，python 3.11）：改造前 import main 中位数约 770ms，其中 httpx 约 140ms、uvicorn 约 60ms；
+# 改为延迟导入并把初始化移到 lifespan 后约 630ms，剩余主要是 fastapi 本身（openapi 模型约 300ms）
+COLD_START_TARGET_MS = 700
+
+
+def import_once() -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import main"], cwd=APP_DIR, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+
+def top_level_imports(limit: int) -> list:
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=APP_DIR,
+                          check=True, capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # 只统计 main 直接导入的模块（-X importtime 用缩进表示层级）
+        if name.startswith("   ") and not name.startswith("    "):
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--target-ms", type=float, default=COLD_START_TARGET_MS)
+    args = parser.parse_args()
+
+    import_once()  # 预热 .pyc
+    timings = [import_once() for _ in range(args.runs)]
+    median = statistics.median(timings)
+    print(f"import main: median {median:.0f} ms, min {min(timings):.0f} ms, max {max(timings):.0f} ms")
+    for cumulative, name in top_level_imports(10):
+        print(f"  {cumulative / 1000:>8.1f} ms  {name}")
+    if median > args.target_ms:
+        print(f"cold start exceeds target {args.target_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+递进式互动基准：对比前端串联（每个 AI 一次完整的非流式往返，上下文整段重传）、服务端递进引擎，
+以及服务端递进的两种预启动模式（strict / loose）的整轮耗时。
+上游用本地 mock 模拟：建连握手、首 token 延迟、逐 token 输出、finish_reason 之后再过一段时间才到的 usage 帧。
+用法（在仓库根目录）：python omnitalkx/tests/bench/bench_progressive.py [--bots 5] [--rtt 0.04] [--rounds 3]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT))
+
+from backend.service import group_service, progressive_service  # noqa: E402
+from backend.service import service_openrouter as svc  # noqa: E402
+from main import app  # noqa: E402
+
+PROVIDERS = ["openai", "anthropic", "xai", "zhipu", "qwen", "deepseek", "minimax", "bytedance"]
+BOT_OF = {provider: bot for bot, provider in group_service.BOT_PROVIDERS.items()}
+
+
+class ReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, body, on_close):
+        self.body = body
+        self.on_close = on_close
+
+    async def __aiter__(self):
+        async for chunk in self.body:
+            yield chunk
+
+    async def aclose(self):
+        await self.body.aclose()
+        self.on_close()
+
+
+class MockUpstream(httpx.AsyncBaseTransport):
+    """
+    模拟上游。新连接要付一次握手延迟；HEAD 预热或响应结束后归还的连接可以直接复用。
+    每轮使用新的实例，相当于两轮之间隔得足够久、空闲连接已被上游关闭。
+    """
+
+    def __init__(self, ttft: float, token_delay: float, tokens: int, usage_delay: float, handshake: float):
+        self.ttft = ttft
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.usage_delay = usage_delay
+        self.handshake = handshake
+        self.idle = 0
+
+    async def _connect(self):
+        if self.idle:
+            self.idle -= 1
+        else:
+            await asyncio.sleep(self.handshake)
+
+    def _release(self):
+        self.idle += 1
+
+    async def _stream_body(self):
+        usage = {"prompt_tokens": 100, "completion_tokens": self.tokens}
+        await asyncio.sleep(self.ttft)
+        for i in range(self.tokens):
+            yield f"data: {json.dumps({'choices': [{'delta': {'content': f'词{i}'}}]})}\n\n".encode()
+            await asyncio.sleep(self.token_delay)
+        yield f"data: {json.dumps({'choices': [{'delta': {}, 'finish_reason': 'stop'}]})}\n\n".encode()
+        await asyncio.sleep(self.usage_delay)
+        yield f"data: {json.dumps({'choices': [], 'usage': usage})}\n\ndata: [DONE]\n\n".encode()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await self._connect()
+        if request.method == "HEAD":
+            self._release()
+            return httpx.Response(200)
+        payload = json.loads(await request.aread())
+        if payload.get("stream"):
+            return httpx.Response(
+                200,
+                stream=ReleasingStream(self._stream_body(), self._release),
+                headers={"content-type": "text/event-stream"},
+            )
+        # 非流式：上游生成完并统计好 usage 后才返回
+        await asyncio.sleep(self.ttft + self.token_delay * self.tokens + self.usage_delay)
+        self._release()
+        text = "".join(f"词{i}" for i in range(self.tokens))
+        usage = {"prompt_tokens": 100, "completion_tokens": self.tokens}
+        return httpx.Response(200, json={"choices": [{"message": {"content": text}}], "usage": usage})
+
+
+async def client_driven_round(client: httpx.AsyncClient, providers: list, rtt: float) -> tuple:
+    """现有做法：前端逐个调用非流式接口，把前面 AI 的回复拼进 system prompt 后整段重传"""
+    started = time.perf_counter()
+    first_visible = None
+    previous = []
+    for provider in providers:
+        messages = [{"role": "system", "content": svc.BASE_SYSTEM_PROMPT}]
+        if previous:
+            messages.append({"role": "system", "content": "【前置发言】\n" + "\n".join(previous)})
+        messages.append({"role": "user", "content": "大家怎么看？"})
+        await asyncio.sleep(rtt)
+        resp = await client.post(
+            f"/api/v1/{provider}/chat/completions/non-stream",
+            json={"messages": messages},
+            headers={"X-Api-Key": "sk-bench"},
+        )
+        data = resp.json()
+        assert data["success"], data
+        first_visible = first_visible or time.perf_counter() - started
+        previous.append(f"{svc.get_provider_config(provider)['name']}说：{data['msg']}")
+    return time.perf_counter() - started, first_visible
+
+
+async def stream_asgi(path: str, body: dict, headers: dict):
+    """直接调用 ASGI 应用并逐块返回响应体（httpx.ASGITransport 会等整个响应结束才返回）"""
+    chunks = asyncio.Queue()
+    raw_body = json.dumps(body).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json")] + [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        "client": ("127.0.0.1", 0), "server": ("bench", 80),
+    }
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": raw_body, "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            await chunks.put(message.get("body", b""))
+            if not message.get("more_body"):
+                await chunks.put(None)
+
+    task = asyncio.ensure_future(app(scope, receive, send))
+    try:
+        while True:
+            chunk = await chunks.get()
+            if chunk is None:
+                break
+            yield chunk.decode()
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def server_round(client: httpx.AsyncClient, providers: list, rtt: float, speculative: str = "off") -> tuple:
+    """服务端递进：一次请求，整轮在服务端串联并流式推送"""
+    started = time.perf_counter()
+    first_visible = None
+    await asyncio.sleep(rtt / 2)
+    body = {
+        "message": "大家怎么看？",
+        "group_id": "grp_all",
+        "mentioned": [BOT_OF[p] for p in providers],
+        "speculative": speculative,
+    }
+    summary = None
+    async for chunk in stream_asgi("/api/chat/progressive", body, {"X-Api-Key": "sk-bench"}):
+        if first_visible is None and '"content": "词' in chunk:
+            first_visible = time.perf_counter() - started + rtt / 2
+        for line in chunk.splitlines():
+            if line.startswith("data: {") and '"results"' in line:
+                summary = json.loads(line[6:])
+    assert summary and summary["success"], summary
+    await asyncio.sleep(rtt / 2)
+    return time.perf_counter() - started, first_visible
+
+
+CASES = [
+    ("client-driven", client_driven_round),
+    ("server-side", server_round),
+    ("server strict", lambda *args: server_round(*args, speculative="strict")),
+    ("server loose", lambda *args: server_round(*args, speculative="loose")),
+]
+
+
+async def run(args) -> dict:
+    providers = PROVIDERS[:args.bots]
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        for name, fn in CASES:
+            samples = []
+            for _ in range(args.rounds):
+                svc._http_client = httpx.AsyncClient(transport=MockUpstream(
+                    args.ttft, args.token_delay, args.tokens, args.usage_delay, args.handshake
+                ))
+                samples.append(await fn(client, providers, args.rtt))
+            results[name] = (
+                sum(s[0] for s in samples) / len(samples),
+                sum(s[1] for s in samples) / len(samples),
+            )
+    await asyncio.gather(*progressive_service.BACKGROUND_TASKS, return_exceptions=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bots", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--rtt", type=float, default=0.04, help="浏览器到后端的往返时间（秒）")
+    parser.add_argument("--ttft", type=float, default=0.3)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--usage-delay", type=float, default=0.15, help="finish_reason 到 usage 帧的间隔（秒）")
+    parser.add_argument("--handshake", type=float, default=0.12, help="新建上游连接（TCP + TLS）的耗时（秒）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        group_service.GROUPS_FILE = str(Path(tmp) / "groups.json")
+        # 记账与本基准无关，避免写 usage/ 目录
+        svc.record_usage = progressive_service.record_usage = lambda *a, **k: None
+        results = asyncio.run(run(args))
+
+    base_round, base_first = results["client-driven"]
+    for name, (round_s, first_s) in results.items():
+        print(
+            f"{name:<14} round {round_s * 1000:>7.0f} ms ({(round_s / base_round - 1) * 100:+6.1f}%)"
+            f"   first token {first_s * 1000:>6.0f} ms ({(first_s / base_first - 1) * 100:+6.1f}%)"
+        )
+
+
+if __name__ == "__main__":
+    main()
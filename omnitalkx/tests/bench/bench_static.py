@@ -0,0 +1,95 @@
+"""
+静态资源服务基准：对比旧的 safe_join + FileResponse 处理方式与 StaticIndex 的 RPS。
+用法（在仓库根目录）：python omnitalkx/tests/bench/bench_static.py [--requests 3000] [--concurrency 50]
+"""
+import argparse
+import asyncio
+import gzip
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import FileResponse
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT))
+
+from backend.util.static_files import StaticIndex  # noqa: E402
+from backend.util.str_util import safe_join  # noqa: E402
+
+
+def build_dist(root: str, files: int = 200):
+    os.makedirs(os.path.join(root, "assets"), exist_ok=True)
+    with open(os.path.join(root, "index.html"), "w") as f:
+        f.write("<html><body>app</body></html>")
+    for i in range(files):
+        data = (f"export const chunk{i} = () => 'omnitalk';\n" * 400).encode()
+        path = os.path.join(root, "assets", f"chunk-{i:04x}.js")
+        with open(path, "wb") as f:
+            f.write(data)
+        with open(path + ".gz", "wb") as f:
+            f.write(gzip.compress(data))
+
+
+def legacy_app(root: str) -> FastAPI:
+    app = FastAPI()
+    assets = os.path.join(root, "assets")
+
+    @app.get("/assets/{path:path}")
+    async def build_resource(path: str):
+        return FileResponse(safe_join(assets, path))
+
+    return app
+
+
+def indexed_app(root: str) -> FastAPI:
+    app = FastAPI()
+    index = StaticIndex(root)
+    index.scan()
+
+    @app.get("/assets/{path:path}")
+    async def build_resource(path: str, request: Request):
+        return index.response(request, f"assets/{path}")
+
+    return app
+
+
+async def run(app: FastAPI, total: int, concurrency: int, headers: dict) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        counter = iter(range(total))
+
+        async def worker():
+            for i in counter:
+                resp = await client.get(f"/assets/chunk-{i % 200:04x}.js", headers=headers)
+                assert resp.status_code in (200, 304)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return total / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        build_dist(root)
+        cases = [
+            ("legacy  identity", legacy_app(root), {}),
+            ("indexed identity", indexed_app(root), {}),
+            ("indexed gzip", indexed_app(root), {"Accept-Encoding": "gzip"}),
+        ]
+        for name, app, headers in cases:
+            rps = asyncio.run(run(app, args.requests, args.concurrency, headers))
+            print(f"{name:<18} {rps:>10.0f} req/s")
+
+
+if __name__ == "__main__":
+    main()
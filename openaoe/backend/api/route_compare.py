@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Request
+
+from openaoe.backend.model.compare import CompareChatBody
+from openaoe.backend.service.service_compare import compare_chat_stream_svc
+
+router = APIRouter()
+
+
+@router.post("/v1/text/chat-stream", tags=["Compare"])
+async def compare_chat_stream(request: Request, body: CompareChatBody):
+    """
+    run one prompt against several (provider, model) targets concurrently
+    @param request: fastapi request
+    @param body: request body
+    @return: multiplexed stream, every event carries target index, final event is a metrics summary
+    """
+    ret = compare_chat_stream_svc(request, body)
+    return ret
@@ -0,0 +1,36 @@
+from fastapi import APIRouter, Request
+
+from openaoe.backend.model.local import LocalChatBody, LocalPreloadBody
+from openaoe.backend.service.service_local import local_chat_svc, local_preload_svc, local_status_svc
+
+router = APIRouter()
+
+
+@router.post("/v1/local/chat", tags=["Local"])
+async def local_chat(body: LocalChatBody, request: Request):
+    """
+    chat stream api for models served by a local Ollama or LMDeploy server
+    @param body: request body
+    @param request: fastapi request
+    @return: response
+    """
+    return local_chat_svc(request, body)
+
+
+@router.post("/v1/local/preload", tags=["Local"])
+async def local_preload(body: LocalPreloadBody):
+    """
+    load a local model before its first chat
+    @param body: request body
+    @return: response
+    """
+    return await local_preload_svc(body)
+
+
+@router.get("/v1/local/status", tags=["Local"])
+async def local_status():
+    """
+    loaded models and queue depth per model of the local inference servers
+    @return: response
+    """
+    return await local_status_svc()
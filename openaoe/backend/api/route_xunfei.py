@@ -1,7 +1,7 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 
 from openaoe.backend.model.xunfei import XunfeiSparkChatBody
-from openaoe.backend.service.service_xunfei import spark_chat_svc
+from openaoe.backend.service.service_xunfei import spark_chat_svc, spark_chat_stream_svc
 
 router = APIRouter()
 
@@ -13,5 +13,17 @@ async def spark_chat(body: XunfeiSparkChatBody):
     @param body: request body
     @return: response
     """
-    ret = spark_chat_svc(body)
+    ret = await spark_chat_svc(body)
+    return ret
+
+
+@router.post("/v1/spark/chat-stream", tags=["Spark"])
+async def spark_chat_stream(request: Request, body: XunfeiSparkChatBody):
+    """
+    chat stream api for Xunfei Spark model
+    @param request: fastapi request
+    @param body: request body
+    @return: response
+    """
+    ret = spark_chat_stream_svc(request, body)
     return ret
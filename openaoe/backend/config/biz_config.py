@@ -3,7 +3,11 @@
 import argparse
 import os
 import sys
+import time
+from bisect import bisect_left
 from copy import deepcopy
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
 
 import yaml
 
@@ -11,6 +15,14 @@ from openaoe.backend.util.log import log
 
 logger = log(__name__)
 BIZ_CONFIG = None
+# compiled lookup index of BIZ_CONFIG, replaced together with it on (re)load
+MODEL_INDEX = None
+
+# at most one stat() of the config file per interval, a changed mtime triggers a reload
+CONFIG_RELOAD_INTERVAL_SECONDS = 5
+_config_path = None
+_config_mtime = None
+_next_reload_check = 0.0
 
 
 class BizConfig:
@@ -39,10 +51,9 @@ class BizConfig:
     @property
     def json(self):
         ret = deepcopy(self.__dict__)
-        if "models" in ret:
-            models_config = ret["models"]
+        models_config = ret.get("models") or {}
         for model_name, config in models_config.items():
-            config.pop("api")
+            config.pop("api", None)
             ret["models"][model_name] = config
         return ret
 
@@ -53,6 +64,96 @@ class ModelConfig:
         self.api_config = api_config
 
 
+class ResolvedEndpoint(NamedTuple):
+    """
+    everything a service needs to call one configured model, resolved once per config load
+    """
+    provider: str
+    model: str
+    api_base: str
+    api_path: str
+    api_key: str
+    # read-only view of the whole api section, provider specific fields (jwt, group_id, ak...) live here
+    api: Mapping
+
+    @property
+    def url(self) -> str:
+        return f"{self.api_base}{self.api_path}"
+
+    def get(self, field: str, default=""):
+        value = self.api.get(field)
+        return default if value is None else value
+
+
+class ModelIndex:
+    """
+    immutable lookup index compiled from the models section of the config.
+    per provider: exact name -> ResolvedEndpoint, plus the sorted names for prefix lookups
+    """
+
+    def __init__(self, models: dict):
+        exact = {}
+        order = {}
+        for position, (model_name, model_config) in enumerate((models or {}).items()):
+            provider = model_config["provider"]
+            api_config = MappingProxyType(dict(model_config.get("api") or {}))
+            endpoint = ResolvedEndpoint(
+                provider=provider,
+                model=model_name,
+                api_base=api_config.get("api_base") or "",
+                api_path=api_config.get("api_path") or "",
+                api_key=api_config.get("api_key") or "",
+                api=api_config,
+            )
+            exact.setdefault(provider, {})[model_name] = endpoint
+            order[(provider, model_name)] = position
+        self._exact = MappingProxyType({provider: MappingProxyType(names) for provider, names in exact.items()})
+        self._sorted_names = {provider: tuple(sorted(names)) for provider, names in exact.items()}
+        self._order = order
+        # provider -> first model in the YAML, used when the caller does not name a model
+        self._defaults = {provider: next(iter(names.values())) for provider, names in exact.items()}
+
+    def __bool__(self):
+        return bool(self._exact)
+
+    def providers(self):
+        return self._exact
+
+    def resolve(self, provider: str, model_name: str = None):
+        """
+        exact name first, then the first configured model (YAML order) whose name starts with model_name,
+        then the longest configured name that model_name starts with, e.g. gpt-4-0613 -> gpt-4
+        """
+        names = self._exact.get(provider)
+        if not names:
+            return None
+        if not model_name:
+            return self._defaults[provider]
+
+        endpoint = names.get(model_name)
+        if endpoint is not None:
+            return endpoint
+
+        sorted_names = self._sorted_names[provider]
+        # configured names extending model_name are contiguous in sorted order
+        lo = bisect_left(sorted_names, model_name)
+        hi = lo
+        while hi < len(sorted_names) and sorted_names[hi].startswith(model_name):
+            hi += 1
+        if hi > lo:
+            first = min(sorted_names[lo:hi], key=lambda name: self._order[(provider, name)])
+            return names[first]
+
+        # longest configured prefix of model_name: walk back from the insertion point
+        for i in range(lo - 1, -1, -1):
+            candidate = sorted_names[i]
+            if model_name.startswith(candidate):
+                return names[candidate]
+            if candidate[:1] != model_name[:1]:
+                break
+        return None
+
+
 def init_config() -> BizConfig:
     parser = argparse.ArgumentParser(description="LLM group chat framework")
     parser.add_argument('-f', '--file', type=str, required=True, help='Path to the YAML config file.')
@@ -61,53 +162,96 @@ def init_config() -> BizConfig:
     return load_config(config_path.file)
 
 
+def _read_config(config_path) -> dict:
+    with open(config_path) as fin:
+        return yaml.safe_load(fin)
+
+
+def _apply_config(m: dict, config_path, mtime):
+    global BIZ_CONFIG, MODEL_INDEX, _config_path, _config_mtime
+    index = ModelIndex(m.get("models"))
+    # lookups only read MODEL_INDEX, a single assignment swaps the whole index
+    BIZ_CONFIG = BizConfig(**m)
+    MODEL_INDEX = index
+    _config_path = config_path
+    _config_mtime = mtime
+
+
 def load_config(config_path) -> BizConfig:
     logger.info(f"start to init configuration from {config_path}.")
     if not os.path.isfile(config_path):
         logger.error(f"invalid path: {config_path}, not exist or not file")
         sys.exit(-1)
 
-    with open(config_path) as fin:
-        m = yaml.safe_load(fin)
-        if not m or len(m) == 0:
-            logger.error("init configuration failed. Exit")
-            sys.exit(-1)
+    mtime = os.path.getmtime(config_path)
+    m = _read_config(config_path)
+    if not m or len(m) == 0:
+        logger.error("init configuration failed. Exit")
+        sys.exit(-1)
 
-        global BIZ_CONFIG
-        BIZ_CONFIG = BizConfig(**m)
+    _apply_config(m, config_path, mtime)
     logger.info("init configuration successfully.")
     return BIZ_CONFIG
 
 
-def get_model_configuration(provider: str, field, model_name: str = None):
-    models = BIZ_CONFIG.models_map
-    if not models:
+def reload_config(force: bool = False) -> bool:
+    """
+    reload the YAML if it changed on disk since the last load.
+    a broken or missing file is logged and the running configuration is kept.
+    """
+    global _next_reload_check, _config_mtime
+    _next_reload_check = time.monotonic() + CONFIG_RELOAD_INTERVAL_SECONDS
+    if not _config_path:
+        return False
+    try:
+        mtime = os.path.getmtime(_config_path)
+    except OSError:
+        mtime = None
+    if not force and mtime == _config_mtime:
+        return False
+    try:
+        if mtime is None:
+            raise FileNotFoundError(f"{_config_path} not exist")
+        m = _read_config(_config_path)
+        if not m or not isinstance(m, dict) or not m.get("models"):
+            raise ValueError("empty configuration or no models")
+        _apply_config(m, _config_path, mtime)
+    except Exception as e:
+        logger.error(f"reload configuration from {_config_path} failed, keep the current one: {e}")
+        # remember the broken file, it is only read again after it changes
+        _config_mtime = mtime
+        return False
+    logger.info(f"configuration reloaded from {_config_path}.")
+    return True
+
+
+def get_biz_config() -> BizConfig:
+    if time.monotonic() >= _next_reload_check:
+        reload_config()
+    return BIZ_CONFIG
+
+
+def get_endpoint(provider: str, model_name: str = None) -> ResolvedEndpoint:
+    """
+    resolved endpoint of a model, fields are empty if the provider or model is not configured
+    """
+    if time.monotonic() >= _next_reload_check:
+        reload_config()
+    if not MODEL_INDEX:
         logger.error(f"invalid configuration file")
         sys.exit(-1)
 
-    provider_config = models.get(provider)
-    if provider_config:
-        if model_name:
-            try:
-                return provider_config.get(model_name).api_config.get(field)
-            except:
-                for config_model_name, config in provider_config.items():
-                    if config_model_name.startswith(model_name):
-                        return config.api_config.get(field)
-                logger.error(f"{provider} get field: {field} for model: {model_name} failed")
-                return ""
-        elif not model_name:
-            # default the first provider ModelConfig
-            provider_models_config_list = list(provider_config.values())
-            try:
-                logger.info(f"{provider} get field: {field} for anonymous model, use the first one as default.")
-                return provider_models_config_list[0].api_config.get(field)
-            except:
-                logger.error(f"{provider} get field: {field} for anonymous model failed")
-                return ""
-
-    logger.error(f"provider: {provider} has no field: {field} configuration for model: {model_name}")
-    return ""
+    endpoint = MODEL_INDEX.resolve(provider, model_name)
+    if endpoint is None:
+        logger.error(f"provider: {provider} has no configuration for model: {model_name}")
+        return ResolvedEndpoint(provider, model_name or "", "", "", "", MappingProxyType({}))
+    if not model_name:
+        logger.info(f"{provider} get configuration for anonymous model, use the first one as default.")
+    return endpoint
+
+
+def get_model_configuration(provider: str, field, model_name: str = None):
+    return get_endpoint(provider, model_name).api.get(field, "")
 
 
 def get_base_url(provider: str, model_name: str = None) -> str:
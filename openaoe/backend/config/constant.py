@@ -14,6 +14,19 @@ PROVIDER_INTERNLM = "internlm"
 PROVIDER_MISTRAL = "mistral"
 PROVIDER_GEMMA = "gemma"
 PROVIDER_ALI = "ali"
+PROVIDER_LOCAL = "local"
 
 DEFAULT_TIMEOUT_SECONDS = 600
 
+# cached async SDK clients, each one owns an HTTP connection pool
+SDK_CLIENT_CACHE_SIZE = 32
+# an evicted client is closed only after every request that may still use it has timed out
+SDK_CLIENT_RETIRE_SECONDS = DEFAULT_TIMEOUT_SECONDS
+
+LOCAL_ENGINE_OLLAMA = "ollama"
+LOCAL_ENGINE_LMDEPLOY = "lmdeploy"
+LOCAL_DEFAULT_KEEP_ALIVE = "5m"
+# how often the list of loaded models is re-read from the inference server
+LOCAL_RESIDENCY_REFRESH_SECONDS = 10
+# a model that still has queued requests is not swapped out before it stayed loaded this long
+LOCAL_MIN_RESIDENCY_SECONDS = 15
@@ -0,0 +1,23 @@
+from typing import Optional, List
+
+from pydantic import BaseModel
+
+from openaoe.backend.model.openai import Context
+
+
+class CompareTarget(BaseModel):
+    # provider: openai, claude, internlm, google (gemini), gemma, minimax, spark, local
+    provider: str
+    model: str
+    temperature: Optional[float] = 1.0
+    max_tokens: Optional[int] = 1024
+
+
+class CompareChatBody(BaseModel):
+    """
+    one prompt, many (provider, model) targets, results streamed side by side
+    """
+    prompt: str
+    messages: Optional[List[Context]] = None
+    targets: List[CompareTarget]
+    timeout: Optional[int] = 600
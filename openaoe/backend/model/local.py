@@ -0,0 +1,20 @@
+from typing import Dict, Optional
+
+from pydantic import BaseModel
+
+from openaoe.backend.model.openaoe import AoeChatBody
+
+
+class LocalChatBody(AoeChatBody):
+    """
+    chat with a model served by a local inference server (Ollama or LMDeploy api_server)
+    """
+    # how long Ollama keeps the model loaded after this request, e.g. "5m", "-1" (forever); ignored by LMDeploy
+    keep_alive: Optional[str] = None
+    # sampling options passed through to the server, e.g. {"temperature": 0.8}
+    options: Optional[Dict] = None
+
+
+class LocalPreloadBody(BaseModel):
+    model: str
+    keep_alive: Optional[str] = None
@@ -0,0 +1,121 @@
+import asyncio
+from collections import OrderedDict
+
+from anthropic import AsyncAnthropic
+from openai import AsyncOpenAI
+
+from openaoe.backend.config import biz_config
+from openaoe.backend.config.constant import SDK_CLIENT_CACHE_SIZE, SDK_CLIENT_RETIRE_SECONDS
+from openaoe.backend.util.log import log
+
+logger = log(__name__)
+
+# (sdk, base_url, api_key) -> client, least recently used first
+_clients = OrderedDict()
+# the config index the cached clients were checked against
+_index = None
+# delayed close tasks of evicted clients, referenced so they are not garbage collected
+_retiring = set()
+
+
+def _configured_credentials() -> set:
+    index = biz_config.MODEL_INDEX
+    if not index:
+        return set()
+    return {
+        (endpoint.api_base, endpoint.api_key)
+        for models in index.providers().values()
+        for endpoint in models.values()
+    }
+
+
+async def _close_later(client, delay: float):
+    try:
+        await asyncio.sleep(delay)
+    finally:
+        try:
+            await client.close()
+        except Exception as e:
+            logger.warning(f"close sdk client failed: {e}")
+
+
+def _retire(client, delay: float = SDK_CLIENT_RETIRE_SECONDS):
+    try:
+        task = asyncio.get_running_loop().create_task(_close_later(client, delay))
+    except RuntimeError:
+        # no event loop (e.g. shutdown), the connection pool is released by the garbage collector
+        return
+    _retiring.add(task)
+    task.add_done_callback(_retiring.discard)
+
+
+def _drop_stale():
+    """
+    after a config reload, evict clients whose base url / key no longer belongs to any model.
+    clients of unchanged endpoints stay warm.
+    """
+    global _index
+    if biz_config.MODEL_INDEX is _index:
+        return
+    _index = biz_config.MODEL_INDEX
+    credentials = _configured_credentials()
+    for key in list(_clients):
+        if key[1:] not in credentials:
+            logger.info(f"config changed, evict {key[0]} client of {key[1]}")
+            _retire(_clients.pop(key))
+
+
+def _get_client(sdk: str, factory, base_url: str, api_key: str):
+    _drop_stale()
+    key = (sdk, base_url, api_key)
+    client = _clients.get(key)
+    if client is not None:
+        _clients.move_to_end(key)
+        return client
+
+    client = factory(base_url, api_key)
+    _clients[key] = client
+    while len(_clients) > SDK_CLIENT_CACHE_SIZE:
+        _, evicted = _clients.popitem(last=False)
+        _retire(evicted)
+    return client
+
+
+def get_openai_client(base_url: str, api_key: str) -> AsyncOpenAI:
+    """
+    shared AsyncOpenAI client of an endpoint, per request timeouts go to create()
+    """
+    return _get_client(
+        "openai",
+        lambda url, key: AsyncOpenAI(api_key=key or "EMPTY", base_url=url or None),
+        base_url,
+        api_key,
+    )
+
+
+def get_anthropic_client(base_url: str, api_key: str) -> AsyncAnthropic:
+    """
+    shared AsyncAnthropic client of an endpoint, per request timeouts go to create()
+    """
+    return _get_client(
+        "anthropic",
+        lambda url, key: AsyncAnthropic(api_key=key, base_url=url or None),
+        base_url,
+        api_key,
+    )
+
+
+async def close_clients():
+    """
+    close every cached and retiring client, called on application shutdown
+    """
+    clients = list(_clients.values())
+    _clients.clear()
+    for task in list(_retiring):
+        task.cancel()
+    await asyncio.gather(*_retiring, return_exceptions=True)
+    for client in clients:
+        try:
+            await client.close()
+        except Exception as e:
+            logger.warning(f"close sdk client failed: {e}")
@@ -1,14 +1,15 @@
 import json
 from typing import List
 
-from anthropic import Anthropic, HUMAN_PROMPT, AI_PROMPT
+from anthropic import HUMAN_PROMPT, AI_PROMPT
 from sse_starlette.sse import EventSourceResponse
 
-from openaoe.backend.config.biz_config import get_api_key, get_base_url
+from openaoe.backend.config.biz_config import get_endpoint
 from openaoe.backend.config.constant import TYPE_BOT, TYPE_USER, TYPE_SYSTEM
 from openaoe.backend.config.constant import PROVIDER_CLAUDE
 from openaoe.backend.model.aoe_response import AOEResponse
 from openaoe.backend.model.claude import ClaudeChatBody, ClaudeMessage
+from openaoe.backend.service.sdk_clients import get_anthropic_client
 
 
 def claude_chat_stream_svc(request, body: ClaudeChatBody):
@@ -16,8 +17,9 @@ def claude_chat_stream_svc(request, body: ClaudeChatBody):
     stream api logic for Claude model
     use anthropic SDK: https://github.com/anthropics/anthropic-sdk-python
     """
-    api_key = get_api_key(PROVIDER_CLAUDE, body.model)
-    api_base = get_base_url(PROVIDER_CLAUDE, body.model)
+    endpoint = get_endpoint(PROVIDER_CLAUDE, body.model)
+    api_key = endpoint.api_key
+    api_base = endpoint.api_base
     prompt = _gen_prompt(body.messages)
     if not prompt or len(prompt) == 0:
         return AOEResponse(
@@ -26,40 +28,34 @@ def claude_chat_stream_svc(request, body: ClaudeChatBody):
             data="prompt or messages must be set"
         )
 
-    anthropic = Anthropic(api_key=api_key, base_url=api_base)
+    anthropic = get_anthropic_client(api_base, api_key)
 
     async def stream():
+        conn = None
         try:
-            conn = anthropic.completions.create(
+            conn = await anthropic.completions.create(
                 prompt=prompt,
                 max_tokens_to_sample=body.max_tokens,
                 model=body.model,
                 stream=True,
             )
-            stop_flag = False
-            while True:
+            async for msg in conn:
                 if await request.is_disconnected():
                     break
+                dict_item = {
+                    "msg": "",
+                    "success": "true"
+                }
 
-                for msg in conn:
-                    dict_item = {
-                        "msg": "",
-                        "success": "true"
-                    }
+                if msg.stop_reason:
+                    dict_item["stop_reason"] = msg.stop_reason
 
-                    if msg.stop_reason:
-                        dict_item["stop_reason"] = msg.stop_reason
-                        stop_flag = True
+                if msg.completion:
+                    dict_item["msg"] = msg.completion
 
-                    if msg.completion:
-                        dict_item["success"] = "true"
-                        dict_item["msg"] = msg.completion
-
-                    if dict_item:
-                        yield json.dumps(dict_item, ensure_ascii=False)
-                if stop_flag:
+                yield json.dumps(dict_item, ensure_ascii=False)
+                if msg.stop_reason:
                     break
-            return
 
         except Exception as e:
             dict_item = {
@@ -67,7 +63,10 @@ def claude_chat_stream_svc(request, body: ClaudeChatBody):
                 "msg": str(e)
             }
             yield json.dumps(dict_item)
-            return
+        finally:
+            if conn is not None:
+                # return the connection to the shared pool
+                await conn.response.aclose()
 
     return EventSourceResponse(stream())
 
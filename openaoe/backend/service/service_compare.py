@@ -0,0 +1,318 @@
+import asyncio
+import json
+import time
+from typing import AsyncIterator
+
+import httpx
+from sse_starlette.sse import EventSourceResponse
+
+from openaoe.backend.config.biz_config import get_endpoint
+from openaoe.backend.config.constant import (
+    PROVIDER_CLAUDE,
+    PROVIDER_GEMMA,
+    PROVIDER_GOOGLE,
+    PROVIDER_INTERNLM,
+    PROVIDER_LOCAL,
+    PROVIDER_MINIMAX,
+    PROVIDER_OPENAI,
+    PROVIDER_XUNFEI,
+    TYPE_BOT,
+    TYPE_USER,
+)
+from openaoe.backend.model.aoe_response import AOEResponse
+from openaoe.backend.model.claude import ClaudeMessage
+from openaoe.backend.model.compare import CompareChatBody, CompareTarget
+from openaoe.backend.model.local import LocalChatBody
+from openaoe.backend.model.minimax import MinimaxChatCompletionBody, RoleMeta
+from openaoe.backend.model.xunfei import XunfeiSparkChatBody
+from openaoe.backend.service import service_xunfei
+from openaoe.backend.service.sdk_clients import get_anthropic_client, get_openai_client
+from openaoe.backend.service.service_claude import _gen_prompt
+from openaoe.backend.service.service_local import local_chat_events
+from openaoe.backend.service.service_minimax import _stream_deltas
+from openaoe.backend.util.log import log
+from openaoe.backend.util.stream_framer import SSEDecoder, aiter_ndjson
+
+logger = log(__name__)
+
+MAX_COMPARE_TARGETS = 8
+
+
+class TargetMetrics:
+    """
+    single target timing: TTFT (time to first token), total latency and output speed.
+    speed is measured in streamed chunks and characters; a chunk may carry several tokens
+    (e.g. Claude completions), so it is not reported as tokens
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+        self.chunks = 0
+        self.chars = 0
+
+    def on_delta(self, text: str):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.chunks += 1
+        self.chars += len(text)
+
+    def finish(self):
+        self.finished_at = time.perf_counter()
+
+    def to_dict(self) -> dict:
+        end = self.finished_at or time.perf_counter()
+        ttft = (self.first_token_at - self.started) if self.first_token_at else None
+        generation = (end - self.first_token_at) if self.first_token_at else 0
+        return {
+            "ttft_ms": round(ttft * 1000) if ttft is not None else None,
+            "latency_ms": round((end - self.started) * 1000),
+            "chunks": self.chunks,
+            "chars": self.chars,
+            "chunks_per_sec": round(self.chunks / generation, 2) if generation > 0 else None,
+            "chars_per_sec": round(self.chars / generation, 2) if generation > 0 else None,
+        }
+
+
+def _openai_messages(body: CompareChatBody) -> list:
+    return [
+        {"role": "user" if context.sender_type == "user" else "assistant", "content": context.text}
+        for context in body.messages or []
+    ] + [{"role": "user", "content": body.prompt}]
+
+
+async def _stream_openai_compatible(base_url: str, api_key: str, target: CompareTarget,
+                                    body: CompareChatBody) -> AsyncIterator[str]:
+    client = get_openai_client(base_url, api_key)
+    stream = await client.chat.completions.create(
+        model=target.model,
+        messages=_openai_messages(body),
+        temperature=target.temperature,
+        max_tokens=target.max_tokens,
+        stream=True,
+        timeout=body.timeout,
+    )
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if text:
+                yield text
+    finally:
+        await stream.response.aclose()
+
+
+async def stream_openai(target: CompareTarget, body: CompareChatBody) -> AsyncIterator[str]:
+    endpoint = get_endpoint(PROVIDER_OPENAI, target.model)
+    async for text in _stream_openai_compatible(endpoint.api_base, endpoint.api_key, target, body):
+        yield text
+
+
+async def stream_internlm(target: CompareTarget, body: CompareChatBody) -> AsyncIterator[str]:
+    # LMDeploy api_server is OpenAI compatible
+    base_url = get_endpoint(PROVIDER_INTERNLM, target.model).api_base + "/v1"
+    async for text in _stream_openai_compatible(base_url, "", target, body):
+        yield text
+
+
+async def stream_claude(target: CompareTarget, body: CompareChatBody) -> AsyncIterator[str]:
+    messages = [
+        ClaudeMessage(role=TYPE_USER if context.sender_type == "user" else TYPE_BOT, content=context.text)
+        for context in body.messages or []
+    ] + [ClaudeMessage(role=TYPE_USER, content=body.prompt)]
+    endpoint = get_endpoint(PROVIDER_CLAUDE, target.model)
+    client = get_anthropic_client(endpoint.api_base, endpoint.api_key)
+    stream = await client.completions.create(
+        prompt=_gen_prompt(messages),
+        max_tokens_to_sample=target.max_tokens,
+        temperature=target.temperature,
+        model=target.model,
+        stream=True,
+        timeout=body.timeout,
+    )
+    try:
+        async for msg in stream:
+            if msg.completion:
+                yield msg.completion
+    finally:
+        await stream.response.aclose()
+
+
+async def stream_google(target: CompareTarget, body: CompareChatBody) -> AsyncIterator[str]:
+    # gemini only, PaLM generateMessage has no streaming
+    if "gemini" not in target.model:
+        raise ValueError(f"google model {target.model} does not stream, only gemini models are supported")
+    endpoint = get_endpoint(PROVIDER_GOOGLE, target.model)
+    url = f"{endpoint.api_base}/v1beta/models/{target.model}:streamGenerateContent"
+    contents = [
+        {"role": "user" if message["role"] == "user" else "model", "parts": [{"text": message["content"]}]}
+        for message in _openai_messages(body)
+    ]
+    payload = {
+        "contents": contents,
+        "generationConfig": {
+            "temperature": target.temperature,
+            "maxOutputTokens": target.max_tokens,
+            "candidateCount": 1,
+        },
+    }
+    decoder = SSEDecoder()
+    async with httpx.AsyncClient(timeout=body.timeout) as client:
+        # alt=sse: one event per candidate chunk instead of a single streamed JSON array
+        params = {"key": endpoint.api_key, "alt": "sse"}
+        async with client.stream("POST", url, params=params, json=payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise RuntimeError(f"google responded {response.status_code}: {response.text[:200]}")
+            async for chunk in response.aiter_bytes():
+                for data in decoder.feed(chunk):
+                    candidates = json.loads(data).get("candidates") or [{}]
+                    for part in (candidates[0].get("content") or {}).get("parts") or []:
+                        if part.get("text"):
+                            yield part["text"]
+
+
+async def stream_gemma(target: CompareTarget, body: CompareChatBody) -> AsyncIterator[str]:
+    # gemma is served by Ollama, newline delimited JSON
+    payload = {
+        "model": target.model,
+        "messages": _openai_messages(body),
+        "stream": True,
+        "options": {"temperature": target.temperature, "num_predict": target.max_tokens},
+    }
+    async with httpx.AsyncClient(timeout=body.timeout) as client:
+        async with client.stream("POST", get_endpoint(PROVIDER_GEMMA, target.model).url, json=payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise RuntimeError(f"gemma responded {response.status_code}: {response.text[:200]}")
+            async for item in aiter_ndjson(response.aiter_bytes()):
+                text = (item.get("message") or {}).get("content")
+                if text:
+                    yield text
+                if item.get("done"):
+                    return
+
+
+async def stream_minimax(target: CompareTarget, body: CompareChatBody) -> AsyncIterator[str]:
+    minimax_body = MinimaxChatCompletionBody(
+        model=target.model,
+        prompt=body.prompt,
+        role_meta=RoleMeta(user_name="user", bot_name="assistant"),
+        messages=[
+            {"sender_type": "USER" if context.sender_type == "user" else "BOT", "text": context.text}
+            for context in body.messages or []
+        ],
+        stream=True,
+    )
+    async for delta in _stream_deltas(None, minimax_body):
+        if delta.error:
+            raise RuntimeError(delta.text)
+        if delta.text:
+            yield delta.text
+
+
+async def stream_spark(target: CompareTarget, body: CompareChatBody) -> AsyncIterator[str]:
+    spark_body = XunfeiSparkChatBody(
+        parameter={"chat": {"temperature": target.temperature, "max_tokens": target.max_tokens, "chat_id": None}},
+        payload={"message": {"text": _openai_messages(body)}},
+    )
+    url, payload = service_xunfei._get_req_param(spark_body)
+    async for text in service_xunfei._websocket_process(url, payload):
+        yield text
+
+
+async def stream_local(target: CompareTarget, body: CompareChatBody) -> AsyncIterator[str]:
+    local_body = LocalChatBody(
+        model=target.model,
+        prompt=body.prompt,
+        messages=[context.model_dump() for context in body.messages or []],
+        options={"temperature": target.temperature},
+    )
+    async for text in local_chat_events(None, local_body):
+        yield text
+
+
+# provider -> async text stream
+STREAMERS = {
+    PROVIDER_OPENAI: stream_openai,
+    PROVIDER_CLAUDE: stream_claude,
+    PROVIDER_INTERNLM: stream_internlm,
+    PROVIDER_GOOGLE: stream_google,
+    PROVIDER_GEMMA: stream_gemma,
+    PROVIDER_MINIMAX: stream_minimax,
+    PROVIDER_XUNFEI: stream_spark,
+    PROVIDER_LOCAL: stream_local,
+}
+
+
+async def _run_target(index: int, target: CompareTarget, body: CompareChatBody, events: asyncio.Queue):
+    metrics = TargetMetrics()
+    meta = {"target": index, "provider": target.provider, "model": target.model}
+    streamer = STREAMERS.get(target.provider)
+    success = True
+    msg = ""
+    try:
+        if streamer is None:
+            raise ValueError(f"provider {target.provider} is not supported in compare mode")
+        async for text in streamer(target, body):
+            metrics.on_delta(text)
+            await events.put({**meta, "type": "delta", "msg": text})
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"compare target failed, provider: {target.provider}, model: {target.model}, error: {e}")
+        success = False
+        msg = str(e)
+    metrics.finish()
+    result = {**meta, "type": "done", "success": success, "msg": msg, "metrics": metrics.to_dict()}
+    await events.put(result)
+    return result
+
+
+async def compare_events(request, body: CompareChatBody):
+    """
+    run all targets concurrently and multiplex their deltas into one stream;
+    every event carries the target index, a final summary lists the metrics of all targets
+    """
+    events = asyncio.Queue()
+    tasks = [
+        asyncio.ensure_future(_run_target(index, target, body, events))
+        for index, target in enumerate(body.targets)
+    ]
+    pending = len(tasks)
+    results = []
+    try:
+        while pending:
+            if request is not None and await request.is_disconnected():
+                return
+            try:
+                event = await asyncio.wait_for(events.get(), timeout=1)
+            except asyncio.TimeoutError:
+                continue
+            if event["type"] == "done":
+                pending -= 1
+                results.append(event)
+            yield json.dumps(event, ensure_ascii=False)
+        results.sort(key=lambda item: item["target"])
+        yield json.dumps({
+            "type": "summary",
+            "results": [
+                {k: item[k] for k in ("target", "provider", "model", "success", "metrics")} for item in results
+            ],
+        }, ensure_ascii=False)
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def compare_chat_stream_svc(request, body: CompareChatBody):
+    if not body.targets or len(body.targets) > MAX_COMPARE_TARGETS:
+        return AOEResponse(
+            msg=f"targets size must be between 1 and {MAX_COMPARE_TARGETS}",
+            msgCode="-1"
+        )
+    return EventSourceResponse(compare_events(request, body))
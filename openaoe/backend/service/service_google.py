@@ -5,7 +5,7 @@ from jsonstreamer import ObjectStreamer
 from sse_starlette import EventSourceResponse
 from fastapi import Request, Response
 
-from openaoe.backend.config.biz_config import get_api_key, get_base_url, get_api_path
+from openaoe.backend.config.biz_config import get_endpoint
 from openaoe.backend.config.constant import *
 from openaoe.backend.model.aoe_response import AOEResponse
 from openaoe.backend.model.google import GooglePalmChatBody, GemmaChatBody
@@ -13,6 +13,7 @@ from openaoe.backend.model.openaoe import AoeChatBody
 from openaoe.backend.service.base import base_request, base_stream
 from openaoe.backend.util.log import log
 from openaoe.backend.util.convert import body_convert
+from openaoe.backend.util.stream_framer import iter_ndjson
 
 
 logger = log(__name__)
@@ -57,8 +58,9 @@ async def palm_chat_svc(body: GooglePalmChatBody):
 
 def _construct_request_data(body: GooglePalmChatBody):
     model = body.model
-    api_base = get_base_url(PROVIDER_GOOGLE, body.model)
-    api_key = get_api_key(PROVIDER_GOOGLE, body.model)
+    endpoint = get_endpoint(PROVIDER_GOOGLE, body.model)
+    api_base = endpoint.api_base
+    api_key = endpoint.api_key
 
     if "gemini" in model:
         # specially process gemini request
@@ -133,7 +135,7 @@ class Gemma:
 
     async def chat(self, body: AoeChatBody):
         chat_body = body_convert(body)
-        chat_url = get_base_url(PROVIDER_GEMMA, body.model) + get_api_path(PROVIDER_GEMMA, body.model)
+        chat_url = get_endpoint(PROVIDER_GEMMA, body.model).url
         return self.chat_response_streaming(chat_url, chat_body)
 
     def chat_response_streaming(self, chat_url: str, chat_body: GemmaChatBody):
@@ -141,14 +143,16 @@ class Gemma:
             try:
                 res = requests.post(chat_url, json=json.loads(chat_body.model_dump_json()), stream=True)
                 if res:
-                    for chunk in res.iter_content(chunk_size=512, decode_unicode=True):
-                        chunk = bytes.decode(chunk)
-                        logger.info(f"chunk: {chunk}")
-                        chunk_json = json.loads(chunk)
-                        yield json.dumps({
-                            "success": True,
-                            "msg": chunk_json.get("message").get("content")
-                        }, ensure_ascii=False)
+                    # chunk_size=None: hand over bytes as they arrive, the framer re-assembles lines
+                    for chunk_json in iter_ndjson(res.iter_content(chunk_size=None)):
+                        message = chunk_json.get("message") or {}
+                        if message.get("content"):
+                            yield json.dumps({
+                                "success": True,
+                                "msg": message["content"]
+                            }, ensure_ascii=False)
+                        if chunk_json.get("done"):
+                            break
             except Exception as e:
                 logger.error(f"{e}")
                 yield json.dumps(
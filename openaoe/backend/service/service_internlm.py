@@ -4,11 +4,12 @@ import requests
 from fastapi.encoders import jsonable_encoder
 from sse_starlette.sse import EventSourceResponse
 
-from openaoe.backend.config.biz_config import get_base_url
+from openaoe.backend.config.biz_config import get_endpoint
 from openaoe.backend.config.constant import *
 from openaoe.backend.model.aoe_response import AOEResponse
 from openaoe.backend.model.internlm import InternlmChatCompletionBody
 from openaoe.backend.util.log import log
+from openaoe.backend.util.stream_framer import iter_sse_data
 
 logger = log(__name__)
 
@@ -30,7 +31,7 @@ def chat_completion_v1(request, body: InternlmChatCompletionBody):
     }
     msgs.append(msg_item)
     # restful api
-    url = get_base_url(PROVIDER_INTERNLM, body.model) + "/v1/chat/completions"
+    url = get_endpoint(PROVIDER_INTERNLM, body.model).api_base + "/v1/chat/completions"
     headers = {
         'accept': 'application/json',
         'Content-Type': 'application/json'
@@ -78,12 +79,12 @@ def chat_completion_stream_v1(request, url, headers, data):
                 res = requests.post(url, headers=headers, json=data, stream=True)
                 logger.debug(f"url={url}, headers={headers}, body={data}")
                 if res:
-                    for chunk in res.iter_content(chunk_size=512, decode_unicode=True):
-                        logger.debug(f"chunk: {chunk}")
-                        res_data = chunk.replace("data: ", "")
+                    for res_data in iter_sse_data(res.iter_content(chunk_size=None)):
+                        if res_data == "[DONE]":
+                            stop_flag = True
+                            break
                         try:
                             json_data = json.loads(res_data)
-                            logger.debug(f"json_data: {json_data}")
                             if json_data.get("object") == "error":
                                 error_msg = json_data.get("message")
                                 dict_item = {
@@ -101,7 +102,6 @@ def chat_completion_stream_v1(request, url, headers, data):
                             if 'content' not in choice['delta']:
                                 continue
                             s = choice["delta"]["content"]
-                            logger.debug(f"content={s}")
                             if s:
                                 dict_item = {
                                     "success": "true",
@@ -0,0 +1,425 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import httpx
+from sse_starlette.sse import EventSourceResponse
+
+from openaoe.backend.config.biz_config import get_endpoint
+from openaoe.backend.config.constant import (
+    DEFAULT_TIMEOUT_SECONDS,
+    LOCAL_DEFAULT_KEEP_ALIVE,
+    LOCAL_ENGINE_LMDEPLOY,
+    LOCAL_ENGINE_OLLAMA,
+    LOCAL_MIN_RESIDENCY_SECONDS,
+    LOCAL_RESIDENCY_REFRESH_SECONDS,
+    PROVIDER_LOCAL,
+)
+from openaoe.backend.model.aoe_response import AOEResponse
+from openaoe.backend.model.local import LocalChatBody, LocalPreloadBody
+from openaoe.backend.util.log import log
+from openaoe.backend.util.stream_framer import LineBuffer, SSEDecoder
+
+logger = log(__name__)
+
+# (engine, api_base) -> LocalBackend
+BACKENDS = {}
+
+
+class ModelQueue:
+    """
+    requests of one model: at most `concurrency` run at the same time, the others wait
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.active = 0
+        self.waiting = 0
+        self.loads = 0
+        self.served = 0
+
+
+class LocalBackend:
+    """
+    one local inference server.
+    tracks which models are resident, loads a model before its first request and queues requests
+    per model. when loading a model would exceed max_loaded_models, an idle resident model is
+    swapped out; a model that still has queued requests keeps its place for at least
+    LOCAL_MIN_RESIDENCY_SECONDS so alternating requests do not load and unload models in turn.
+    """
+
+    def __init__(self, engine: str, api_base: str, max_loaded: Optional[int] = 1):
+        self.engine = engine
+        self.api_base = api_base.rstrip("/")
+        # None: no limit, e.g. LMDeploy serves a fixed set of models
+        self.max_loaded = max_loaded
+        # model -> time it was loaded, least recently used first
+        self.loaded = OrderedDict()
+        self.loading = set()
+        self.queues = {}
+        self.refreshed_at = 0.0
+        self._cond = asyncio.Condition()
+        self._refresh_lock = asyncio.Lock()
+
+    def queue(self, model: str, concurrency: int = 1) -> ModelQueue:
+        q = self.queues.get(model)
+        if q is None:
+            q = self.queues[model] = ModelQueue(concurrency)
+        q.concurrency = max(1, concurrency)
+        return q
+
+    # ---- residency
+
+    def _victim(self, now: float) -> Optional[str]:
+        """
+        resident model to swap out: idle models first, then models nobody waits for, then the least
+        recently used. a model that still runs requests is only picked when every resident model is busy
+        """
+        candidates = [model for model in self.loaded if model not in self.loading]
+        if not candidates:
+            return None
+
+        def rank(model):
+            q = self.queues.get(model)
+            if q is None:
+                return False, False
+            return q.active > 0, q.waiting > 0
+
+        # sort is stable, so models of the same rank stay least recently used first
+        candidates.sort(key=rank)
+        victim = candidates[0]
+        q = self.queues.get(victim)
+        if q is not None and q.waiting and now - self.loaded[victim] < LOCAL_MIN_RESIDENCY_SECONDS:
+            return None
+        return victim
+
+    def _full(self) -> bool:
+        return self.max_loaded is not None and len(self.loaded) >= self.max_loaded
+
+    def _draining(self, now: float) -> Optional[str]:
+        """
+        resident model that takes no new requests because a queued model is waiting for its place
+        """
+        if not self._full():
+            return None
+        for model, q in self.queues.items():
+            if q.waiting and model not in self.loaded and model not in self.loading:
+                return self._victim(now)
+        return None
+
+    def _can_run(self, model: str, now: float):
+        """
+        (runnable, model to swap out first)
+        """
+        q = self.queues[model]
+        if model in self.loading or q.active >= q.concurrency:
+            return False, None
+        if model in self.loaded:
+            return model != self._draining(now), None
+        if not self._full():
+            return True, None
+        victim = self._victim(now)
+        if victim is None:
+            return False, None
+        victim_q = self.queues.get(victim)
+        if victim_q is not None and victim_q.active:
+            return False, None
+        return True, victim
+
+    async def acquire(self, model: str, concurrency: int = 1, keep_alive: str = None) -> ModelQueue:
+        """
+        wait for a slot of the model, loading it (and swapping another one out) when needed
+        """
+        await self.refresh()
+        q = self.queue(model, concurrency)
+        async with self._cond:
+            q.waiting += 1
+            try:
+                while True:
+                    runnable, victim = self._can_run(model, time.monotonic())
+                    if runnable:
+                        break
+                    try:
+                        # a timeout re-checks the minimum residency of the other models
+                        await asyncio.wait_for(self._cond.wait(), LOCAL_MIN_RESIDENCY_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                q.waiting -= 1
+            q.active += 1
+            need_load = model not in self.loaded
+            if victim is not None:
+                self.loaded.pop(victim, None)
+            if need_load:
+                self.loading.add(model)
+            self.loaded[model] = self.loaded.get(model, time.monotonic())
+            self.loaded.move_to_end(model)
+
+        if not need_load:
+            return q
+        try:
+            if victim is not None:
+                await self._unload(victim)
+            await self._load(model, keep_alive)
+            q.loads += 1
+        except BaseException:
+            async with self._cond:
+                self.loaded.pop(model, None)
+                q.active -= 1
+                self._cond.notify_all()
+            raise
+        finally:
+            async with self._cond:
+                self.loading.discard(model)
+                if model in self.loaded:
+                    self.loaded[model] = time.monotonic()
+                self._cond.notify_all()
+        return q
+
+    async def release(self, model: str):
+        async with self._cond:
+            q = self.queues[model]
+            q.active -= 1
+            q.served += 1
+            self._cond.notify_all()
+
+    async def _load(self, model: str, keep_alive: str = None):
+        if self.engine != LOCAL_ENGINE_OLLAMA:
+            return
+        logger.info(f"load model {model} on {self.api_base}")
+        # a generate request without prompt only loads the model
+        async with httpx.AsyncClient(timeout=DEFAULT_TIMEOUT_SECONDS) as client:
+            response = await client.post(f"{self.api_base}/api/generate", json={
+                "model": model, "keep_alive": keep_alive or LOCAL_DEFAULT_KEEP_ALIVE
+            })
+            response.raise_for_status()
+
+    async def _unload(self, model: str):
+        if self.engine != LOCAL_ENGINE_OLLAMA:
+            return
+        logger.info(f"unload model {model} on {self.api_base}")
+        try:
+            async with httpx.AsyncClient(timeout=DEFAULT_TIMEOUT_SECONDS) as client:
+                await client.post(f"{self.api_base}/api/generate", json={"model": model, "keep_alive": 0})
+        except httpx.HTTPError as e:
+            logger.warning(f"unload model {model} failed: {e}")
+
+    async def refresh(self, force: bool = False):
+        """
+        sync the resident models with the server, Ollama unloads idle models on its own after keep_alive
+        """
+        if not force and time.monotonic() - self.refreshed_at < LOCAL_RESIDENCY_REFRESH_SECONDS:
+            return
+        # callers arriving during a refresh wait for it, so they keep their arrival order
+        async with self._refresh_lock:
+            if not force and time.monotonic() - self.refreshed_at < LOCAL_RESIDENCY_REFRESH_SECONDS:
+                return
+            await self._refresh()
+
+    async def _refresh(self):
+        now = time.monotonic()
+        try:
+            async with httpx.AsyncClient(timeout=10) as client:
+                if self.engine == LOCAL_ENGINE_OLLAMA:
+                    response = await client.get(f"{self.api_base}/api/ps")
+                    names = [self._local_name(item["name"]) for item in response.json().get("models") or []]
+                else:
+                    response = await client.get(f"{self.api_base}/v1/models")
+                    names = [item["id"] for item in response.json().get("data") or []]
+        except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+            # older Ollama has no /api/ps, keep the local bookkeeping
+            logger.warning(f"refresh loaded models of {self.api_base} failed: {e}")
+            return
+        finally:
+            self.refreshed_at = time.monotonic()
+
+        async with self._cond:
+            for model in list(self.loaded):
+                q = self.queues.get(model)
+                # in use, or loaded after the server listed its models
+                if model in names or model in self.loading or (q and q.active) or self.loaded[model] > now:
+                    continue
+                self.loaded.pop(model)
+            for model in names:
+                if model not in self.loaded:
+                    # loaded by someone else, it takes memory all the same
+                    self.loaded[model] = now
+            self._cond.notify_all()
+
+    def _local_name(self, name: str) -> str:
+        """
+        Ollama reports "qwen:latest" for a model requested as "qwen"
+        """
+        if name.endswith(":latest") and (name[:-7] in self.queues or name[:-7] in self.loaded):
+            return name[:-7]
+        return name
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        draining = self._draining(now)
+        return {
+            "engine": self.engine,
+            "api_base": self.api_base,
+            "max_loaded_models": self.max_loaded,
+            "loaded": [
+                {"model": model, "resident_seconds": round(now - loaded_at, 1), "draining": model == draining}
+                for model, loaded_at in self.loaded.items()
+            ],
+            "loading": sorted(self.loading),
+            "queues": {
+                model: {"active": q.active, "waiting": q.waiting, "concurrency": q.concurrency,
+                        "loads": q.loads, "served": q.served}
+                for model, q in self.queues.items()
+            },
+        }
+
+
+def _resolve(model_name: str):
+    """
+    (backend, model name on the server, per model concurrency, default keep_alive) of a configured local model
+    """
+    endpoint = get_endpoint(PROVIDER_LOCAL, model_name)
+    if not endpoint.api_base:
+        raise ValueError(f"local model {model_name} is not configured")
+    engine = endpoint.get("engine") or LOCAL_ENGINE_OLLAMA
+    if engine not in (LOCAL_ENGINE_OLLAMA, LOCAL_ENGINE_LMDEPLOY):
+        raise ValueError(f"unsupported local engine: {engine}")
+    key = (engine, endpoint.api_base.rstrip("/"))
+    backend = BACKENDS.get(key)
+    if backend is None:
+        backend = BACKENDS[key] = LocalBackend(engine, endpoint.api_base)
+    if engine == LOCAL_ENGINE_OLLAMA:
+        backend.max_loaded = int(endpoint.get("max_loaded_models", 1) or 1)
+    else:
+        backend.max_loaded = None
+    server_model = endpoint.get("model") or endpoint.model
+    concurrency = int(endpoint.get("max_concurrency", 1) or 1)
+    return backend, server_model, concurrency, endpoint.get("keep_alive") or None
+
+
+def _messages(body: LocalChatBody) -> list:
+    roles = {"user": "user", "system": "system"}
+    return [
+        {"role": roles.get(context.sender_type, "assistant"), "content": context.text}
+        for context in body.messages or []
+    ] + [{"role": "user", "content": body.prompt}]
+
+
+async def _stream_ollama(backend: LocalBackend, model: str, body: LocalChatBody, keep_alive: str):
+    payload = {
+        "model": model,
+        "messages": _messages(body),
+        "stream": True,
+        "keep_alive": keep_alive or LOCAL_DEFAULT_KEEP_ALIVE,
+    }
+    if body.options:
+        payload["options"] = body.options
+    lines = LineBuffer()
+    async with httpx.AsyncClient(timeout=DEFAULT_TIMEOUT_SECONDS) as client:
+        async with client.stream("POST", f"{backend.api_base}/api/chat", json=payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise RuntimeError(f"ollama responded {response.status_code}: {response.text[:200]}")
+            async for chunk in response.aiter_bytes():
+                for line in lines.feed(chunk):
+                    if not line.strip():
+                        continue
+                    item = json.loads(line)
+                    if item.get("error"):
+                        raise RuntimeError(item["error"])
+                    text = (item.get("message") or {}).get("content")
+                    if text:
+                        yield text
+                    if item.get("done"):
+                        return
+
+
+async def _stream_lmdeploy(backend: LocalBackend, model: str, body: LocalChatBody):
+    payload = {"model": model, "messages": _messages(body), "stream": True, **(body.options or {})}
+    decoder = SSEDecoder()
+    async with httpx.AsyncClient(timeout=DEFAULT_TIMEOUT_SECONDS) as client:
+        async with client.stream("POST", f"{backend.api_base}/v1/chat/completions", json=payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise RuntimeError(f"lmdeploy responded {response.status_code}: {response.text[:200]}")
+            async for chunk in response.aiter_bytes():
+                for data in decoder.feed(chunk):
+                    if data == "[DONE]":
+                        return
+                    item = json.loads(data)
+                    choices = item.get("choices") or []
+                    text = choices[0].get("delta", {}).get("content") if choices else None
+                    if text:
+                        yield text
+
+
+async def local_chat_events(request, body: LocalChatBody):
+    backend, model, concurrency, keep_alive = _resolve(body.model)
+    keep_alive = body.keep_alive or keep_alive
+    await backend.acquire(model, concurrency, keep_alive)
+    try:
+        if backend.engine == LOCAL_ENGINE_OLLAMA:
+            stream = _stream_ollama(backend, model, body, keep_alive)
+        else:
+            stream = _stream_lmdeploy(backend, model, body)
+        try:
+            async for text in stream:
+                if request is not None and await request.is_disconnected():
+                    break
+                yield text
+        finally:
+            # close the response to the server before the slot is handed to the next request
+            await stream.aclose()
+    finally:
+        await backend.release(model)
+
+
+def local_chat_svc(request, body: LocalChatBody):
+    """
+    chat stream for local models, the slot of the model is held until the reply is finished
+    """
+
+    async def event_generator_json():
+        try:
+            async for text in local_chat_events(request, body):
+                yield json.dumps({"success": "true", "msg": text}, ensure_ascii=False)
+        except Exception as e:
+            logger.error(f"local chat failed, model: {body.model}, error: {e}")
+            yield json.dumps({"success": "false", "msg": str(e)})
+
+    async def event_generator():
+        try:
+            async for text in local_chat_events(request, body):
+                yield text
+        except Exception as e:
+            logger.error(f"local chat failed, model: {body.model}, error: {e}")
+            yield str(e)
+
+    if body.type == "text":
+        return EventSourceResponse(event_generator())
+    return EventSourceResponse(event_generator_json())
+
+
+async def local_preload_svc(body: LocalPreloadBody):
+    """
+    make a model resident before the first chat, goes through the same queue as chats
+    """
+    try:
+        backend, model, concurrency, keep_alive = _resolve(body.model)
+        await backend.acquire(model, concurrency, body.keep_alive or keep_alive)
+        await backend.release(model)
+        return AOEResponse(data=backend.status())
+    except Exception as e:
+        logger.error(f"preload {body.model} failed: {e}")
+        return AOEResponse(msg="error", msgCode="-1", data=str(e))
+
+
+async def local_status_svc():
+    """
+    resident models and queue depth of every local inference server in use
+    """
+    for backend in list(BACKENDS.values()):
+        await backend.refresh()
+    return AOEResponse(data=[backend.status() for backend in BACKENDS.values()])
@@ -1,20 +1,25 @@
 import json
+from typing import NamedTuple
 
-import requests
+import httpx
 from sse_starlette.sse import EventSourceResponse
 
-from openaoe.backend.config.biz_config import get_model_configuration, get_base_url
+from openaoe.backend.config.biz_config import get_endpoint
 from openaoe.backend.config.constant import *
 from openaoe.backend.model.minimax import MinimaxChatCompletionBody
 from openaoe.backend.util.log import log
+from openaoe.backend.util.stream_framer import LineBuffer
 
 logger = log(__name__)
 
+MINIMAX_MAX_ATTEMPTS = 3
+
 
 def _get_req_param(body):
-    group_id = get_model_configuration(PROVIDER_MINIMAX, "group_id", body.model)
-    jwt = get_model_configuration(PROVIDER_MINIMAX, "jwt", body.model)
-    api_base = get_base_url(PROVIDER_MINIMAX, body.model)
+    endpoint = get_endpoint(PROVIDER_MINIMAX, body.model)
+    group_id = endpoint.get("group_id")
+    jwt = endpoint.get("jwt")
+    api_base = endpoint.api_base
     headers = {
         "Authorization": jwt,
         "Content-Type": "application/json"
@@ -40,35 +45,70 @@ def _get_req_param(body):
     return url, headers, payload
 
 
-def _parse_chunk_delta(chunk):
-    if not chunk:
-        return "empty received"
-    decoded_data = chunk.decode('utf-8')
-    parsed_data = json.loads(decoded_data.replace("data:", ""))
-    choices = parsed_data['choices']
-    if choices is None:
-        base_resp = parsed_data['base_resp']
-        if base_resp is None:
-            return parsed_data
-        # sts_code = base_resp.get('status_code')
-        sts_msg = base_resp.get('status_msg')
-        return f"{sts_msg}"
-    delta_content = choices[0]['delta']
-    return delta_content
-
-
-def _should_stop(chunk) -> bool:
-    if not chunk:
-        return True
-    decoded_data = chunk.decode('utf-8')
-    parsed_data = json.loads(decoded_data.replace("data:", ""))
-    choices = parsed_data['choices']
-    if choices is None:
-        return True
-    finish_reason = choices[0].get("finish_reason")
-    if finish_reason is None or finish_reason == "":
-        return False
-    return True
+class MinimaxDelta(NamedTuple):
+    """
+    one decoded stream event: text to forward, whether the reply is finished, whether it is an error
+    """
+    text: str
+    stop: bool = False
+    error: bool = False
+
+
+def _parse_event(line: str) -> MinimaxDelta:
+    """
+    decode one stream line exactly once, e.g.
+    data: {"choices": [{"delta": "你好", "finish_reason": ""}], ...}
+    """
+    if line.startswith("data:"):
+        line = line[5:]
+    parsed_data = json.loads(line)
+    choices = parsed_data.get("choices")
+    if not choices:
+        base_resp = parsed_data.get("base_resp") or {}
+        return MinimaxDelta(text=f"{base_resp.get('status_msg') or parsed_data}", stop=True, error=True)
+    choice = choices[0]
+    delta = choice.get("delta")
+    return MinimaxDelta(
+        text=delta if isinstance(delta, str) else "",
+        stop=bool(choice.get("finish_reason")),
+    )
+
+
+async def _stream_deltas(request, body: MinimaxChatCompletionBody):
+    """
+    post the chat request with a streamed response and yield a MinimaxDelta per event as it arrives.
+    a stream that ends without a finish_reason before any text is retried, at most MINIMAX_MAX_ATTEMPTS times
+    """
+    url, headers, payload = _get_req_param(body)
+    forwarded = False
+    for _ in range(MINIMAX_MAX_ATTEMPTS):
+        if request is not None and await request.is_disconnected():
+            return
+        lines = LineBuffer()
+        async with httpx.AsyncClient(timeout=DEFAULT_TIMEOUT_SECONDS) as client:
+            async with client.stream("POST", url, headers=headers, json=payload) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise RuntimeError(f"minimax responded {response.status_code}: {response.text[:200]}")
+                async for chunk in response.aiter_bytes():
+                    for line in lines.feed(chunk):
+                        if not line.strip():
+                            continue
+                        delta = _parse_event(line)
+                        forwarded = forwarded or bool(delta.text)
+                        yield delta
+                        if delta.stop:
+                            return
+                last = lines.flush()
+                if last and last.strip():
+                    delta = _parse_event(last)
+                    yield delta
+                    if delta.stop:
+                        return
+        if forwarded:
+            # never replay a half delivered reply
+            return
+        logger.warning(f"minimax stream ended without finish_reason, retry")
 
 
 def minimax_chat_stream_svc(request, body: MinimaxChatCompletionBody):
@@ -78,55 +118,30 @@ def minimax_chat_stream_svc(request, body: MinimaxChatCompletionBody):
     """
 
     async def event_generator():
-        url, headers, payload = _get_req_param(body)
-
-        while True:
-            stop_flag = False
-            if await request.is_disconnected():
-                break
-            try:
-                response = requests.post(url=url, headers=headers, json=payload)
-                for chunk in response.iter_lines():
-                    if _should_stop(chunk):
-                        stop_flag = True
-                        yield _parse_chunk_delta(chunk)
-                        break
-                    if chunk:
-                        yield _parse_chunk_delta(chunk)
-            except Exception as e:
-                logger.error(f"{e}")
-                stop_flag = True
-                yield str(e)
-            if stop_flag:
-                break
+        try:
+            async for delta in _stream_deltas(request, body):
+                if delta.text:
+                    yield delta.text
+        except Exception as e:
+            logger.error(f"{e}")
+            yield str(e)
 
     async def event_generator_json():
-        url, headers, payload = _get_req_param(body)
-        while True:
-            stop_flag = False
-            if await request.is_disconnected():
-                break
-            try:
-                response = requests.post(url=url, headers=headers, json=payload)
-                for chunk in response.iter_lines():
+        try:
+            async for delta in _stream_deltas(request, body):
+                if delta.text:
                     dict_item = {
-                        "success": "true",
-                        "msg": _parse_chunk_delta(chunk)
+                        "success": "false" if delta.error else "true",
+                        "msg": delta.text
                     }
                     yield json.dumps(dict_item, ensure_ascii=False)
-                    if _should_stop(chunk):
-                        stop_flag = True
-                        break
-                if stop_flag:
-                    break
-            except Exception as e:
-                logger.error(f"{e}")
-                dict_item = {
-                    "success": "false",
-                    "msg": str(e)
-                }
-                yield json.dumps(dict_item)
-                break
+        except Exception as e:
+            logger.error(f"{e}")
+            dict_item = {
+                "success": "false",
+                "msg": str(e)
+            }
+            yield json.dumps(dict_item)
 
     if body.type == "text":
         return EventSourceResponse(event_generator())
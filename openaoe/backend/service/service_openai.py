@@ -1,11 +1,11 @@
 import json
 
-from openai import OpenAI
 from sse_starlette.sse import EventSourceResponse
 
-from openaoe.backend.config.biz_config import get_api_key, get_base_url
+from openaoe.backend.config.biz_config import get_endpoint
 from openaoe.backend.config.constant import *
 from openaoe.backend.model.aoe_response import AOEResponse
+from openaoe.backend.service.sdk_clients import get_openai_client
 from openaoe.backend.util.log import log
 
 logger = log(__name__)
@@ -35,85 +35,64 @@ def _messages_process(body):
     return messages
 
 
+async def _stream_deltas(body, stop: list):
+    """
+    one streamed completion over the cached async client of the model endpoint.
+    stop[0] is set once the model reports a finish_reason
+    """
+    endpoint = get_endpoint(PROVIDER_OPENAI, body.model)
+    client = get_openai_client(endpoint.api_base, endpoint.api_key)
+    stream = await client.chat.completions.create(
+        model=body.model,
+        messages=_messages_process(body),
+        temperature=body.temperature,
+        stream=True,
+        timeout=body.timeout
+    )
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.delta.content:
+                yield choice.delta.content
+            if choice.finish_reason:
+                stop[0] = True
+                break
+    finally:
+        # give the connection back to the shared pool even when the client went away mid stream
+        await stream.response.aclose()
+
+
 def chat_completion_stream(request, body):
     """
     stream logic for OpenAI model
     return format determines by body.type
     """
     async def event_generator():
-        while True:
-            client = OpenAI(
-                api_key=get_api_key(PROVIDER_OPENAI, body.model),
-                timeout=body.timeout,
-                base_url=get_base_url(PROVIDER_OPENAI, body.model)
-            )
-
-            stop_flag = False
-            response = ""
+        stop = [False]
+        while not stop[0]:
             if await request.is_disconnected():
                 break
             try:
-                res = client.chat.completions.with_raw_response.create(
-                    model=body.model,
-                    messages=_messages_process(body),
-                    temperature=body.temperature,
-                    stream=True,
-                    timeout=body.timeout
-                )
-
-                for chunk in res.parse():
-                    choice = chunk.choices[0]
-                    s = choice.delta.content
-                    if choice.finish_reason:
-                        stop_flag = True
-                    if s:
-                        response += s
-                        yield s
-                    if stop_flag:
-                        break
-                if stop_flag:
-                    break
+                async for s in _stream_deltas(body, stop):
+                    yield s
             except Exception as e:
                 yield str(e)
                 break
 
     async def event_generator_json():
-        while True:
-            client = OpenAI(
-                api_key=get_api_key(PROVIDER_OPENAI, body.model),
-                timeout=body.timeout,
-                base_url=get_base_url(PROVIDER_OPENAI, body.model)
-            )
-            stop_flag = False
-            response = ""
+        stop = [False]
+        while not stop[0]:
             if await request.is_disconnected():
                 break
-            res = None
             try:
-                res = client.chat.completions.with_raw_response.create(
-                    model=body.model,
-                    messages=_messages_process(body),
-                    temperature=body.temperature,
-                    stream=True,
-                    timeout=body.timeout
-                )
-
-                for chunk in res.parse():
-                    choice = chunk.choices[0]
-                    s = choice.delta.content
-                    if choice.finish_reason:
-                        stop_flag = True
-                    if s:
-                        response += s
-                        dict_item = {
-                            "success": "true",
-                            "msg": s
-                        }
-                        yield json.dumps(dict_item, ensure_ascii=False)
-                    if stop_flag:
-                        break
-                if stop_flag:
-                    break
+                async for s in _stream_deltas(body, stop):
+                    dict_item = {
+                        "success": "true",
+                        "msg": s
+                    }
+                    yield json.dumps(dict_item, ensure_ascii=False)
             except Exception as e:
                 yield json.dumps({
                     "success": "false",
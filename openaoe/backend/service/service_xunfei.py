@@ -2,12 +2,17 @@ import base64
 import hashlib
 import hmac
 import json
+import socket
+import threading
+import time
 import urllib
 from urllib.parse import urlencode
 
-from websocket import create_connection
+from anyio import CapacityLimiter, to_thread
+from sse_starlette.sse import EventSourceResponse
+from websocket import WebSocketBadStatusException, WebSocketTimeoutException, create_connection
 
-from openaoe.backend.config.biz_config import get_model_configuration, get_base_url
+from openaoe.backend.config.biz_config import get_endpoint
 from openaoe.backend.config.constant import PROVIDER_XUNFEI
 from openaoe.backend.model.aoe_response import AOEResponse
 from openaoe.backend.model.xunfei import XunfeiSparkChatBody
@@ -16,11 +21,29 @@ from openaoe.backend.util.time_util import get_current_date
 
 logger = log(__name__)
 
+SPARK_CHAT_PATH = "/v2.1/chat"
+# spark rejects signatures whose date is more than 5 minutes off, reuse a signed url well inside that window
+SPARK_URL_TTL_SECONDS = 240
+SPARK_CONNECT_TIMEOUT_SECONDS = 10
+# max wait for the next frame, a stalled upstream fails the request instead of holding it forever
+SPARK_RECV_TIMEOUT_SECONDS = 30
+# live spark streams each hold a thread for their whole life, they get their own limiter instead of
+# taking slots of the default anyio thread pool shared by the sync-generator SSE routes
+SPARK_MAX_STREAMS = 32
+_spark_limiter = None
+
+# (api_base, ak, sk) -> (signed url, expire time)
+_signed_urls = {}
+
+
+class SparkError(Exception):
+    """spark returned a non-zero header code or the websocket failed"""
+
 
 def _calc_authorization(ak: str, sk: str, date: str, host: str) -> str:
     msg = "host: " + host + "\n"
     msg += "date: " + date + "\n"
-    msg += "GET " + "/v2.1/chat" + " HTTP/1.1"
+    msg += "GET " + SPARK_CHAT_PATH + " HTTP/1.1"
     msg_sha = hmac.new(sk.encode('utf-8'), msg.encode('utf-8'), digestmod=hashlib.sha256).digest()
     signature = base64.b64encode(msg_sha).decode(encoding='utf-8')
     authorization_origin = f'api_key="{ak}", algorithm="hmac-sha256", headers="host date request-line", signature="{signature}"'
@@ -28,54 +51,42 @@ def _calc_authorization(ak: str, sk: str, date: str, host: str) -> str:
     return authorization
 
 
-def _websocket_process(url: str, body: dict):
-    ws = create_connection(url)
-    try:
-        ws.send(json.dumps(body))
-    except Exception as e:
-        logger.error(e)
-
-    res = ""
-    while True:
-        rcv_text = ws.recv()
-        content = json.loads(rcv_text)
-        header = content.get("header")
-        if header.get("code") != 0:
-            res = "error"
-            # spark failed
-            logger.error(f"spark failed: {content}")
-            break
-        payload = content.get("payload")
-        text = payload.get("choices").get("text")
-        for item in text:
-            res += item.get("content")
-        if header.get("status") == 2:
-            break
-    ws.close()
-    return res
-
-
-def spark_chat_svc(body: XunfeiSparkChatBody):
+def _get_signed_url(api_base: str, ak: str, sk: str) -> str:
     """
-    chat logic for spark model
+    signed websocket url, recomputed only after SPARK_URL_TTL_SECONDS
     """
-    api_base = get_base_url(PROVIDER_XUNFEI)
-    app_id = get_model_configuration(PROVIDER_XUNFEI, "app_id")
-    ak = get_model_configuration(PROVIDER_XUNFEI, "ak")
-    sk = get_model_configuration(PROVIDER_XUNFEI, "sk")
-
-    url_parse = urllib.parse.urlparse(api_base)
-    host = url_parse.hostname
+    key = (api_base, ak, sk)
+    now = time.monotonic()
+    cached = _signed_urls.get(key)
+    if cached is not None and cached[1] > now:
+        return cached[0]
 
+    host = urllib.parse.urlparse(api_base).hostname
     date = get_current_date()
-    authorization = _calc_authorization(ak=ak, sk=sk, date=date, host=host)
     v = {
-        "authorization": authorization,
+        "authorization": _calc_authorization(ak=ak, sk=sk, date=date, host=host),
         "date": date,
         "host": host
     }
-    v_urlencode = urlencode(v)
-    url = f"{api_base}/v2.1/chat?{v_urlencode}"
+    url = f"{api_base}{SPARK_CHAT_PATH}?{urlencode(v)}"
+    _signed_urls[key] = (url, now + SPARK_URL_TTL_SECONDS)
+    return url
+
+
+def _invalidate_signed_url(url: str):
+    for key, (cached_url, _) in list(_signed_urls.items()):
+        if cached_url == url:
+            _signed_urls.pop(key, None)
+
+
+def _get_req_param(body: XunfeiSparkChatBody):
+    endpoint = get_endpoint(PROVIDER_XUNFEI)
+    api_base = endpoint.api_base
+    app_id = endpoint.get("app_id")
+    ak = endpoint.get("ak")
+    sk = endpoint.get("sk")
+    url = _get_signed_url(api_base, ak, sk)
+
     texts = [
         {"role": item.role, "content": item.content}
         for item in body.payload.message.text or []
@@ -83,7 +94,7 @@ def spark_chat_svc(body: XunfeiSparkChatBody):
     uid = None
     if body.header is not None:
         uid = None if body.header.uid is None else body.header.uid
-    body = {
+    payload = {
         "header": {
             "app_id": app_id,
             "uid": uid
@@ -101,8 +112,110 @@ def spark_chat_svc(body: XunfeiSparkChatBody):
             }
         }
     }
+    return url, payload
+
+
+def _get_limiter() -> CapacityLimiter:
+    global _spark_limiter
+    if _spark_limiter is None:
+        _spark_limiter = CapacityLimiter(SPARK_MAX_STREAMS)
+    return _spark_limiter
+
+
+class SparkConnection:
+    """
+    websocket-client connection driven from the event loop, blocking calls run in spark's own threads.
+    a recv abandoned by a cancelled request is woken by shutting the socket down, and the thread that
+    was reading releases the socket, so recv and close never run on the same socket at the same time
+    """
+
+    def __init__(self, ws):
+        self.ws = ws
+        self._lock = threading.Lock()
+        self._reading = False
+        self._closing = False
+
+    def _recv(self):
+        with self._lock:
+            if self._closing:
+                raise SparkError("spark connection closed")
+            self._reading = True
+        try:
+            return self.ws.recv()
+        finally:
+            with self._lock:
+                self._reading = False
+                closing = self._closing
+            if closing:
+                self.ws.shutdown()
+
+    async def send(self, text: str):
+        await to_thread.run_sync(self.ws.send, text, limiter=_get_limiter())
+
+    async def recv(self) -> str:
+        return await to_thread.run_sync(self._recv, cancellable=True, limiter=_get_limiter())
+
+    def close(self):
+        with self._lock:
+            self._closing = True
+            reading = self._reading
+        if not reading:
+            # timeout=0: do not wait for the close handshake, just release the socket
+            self.ws.close(timeout=0)
+            return
+        try:
+            # the blocked recv returns at once, its thread then releases the socket
+            self.ws.sock.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            pass
+
+
+async def _websocket_process(url: str, body: dict, recv_timeout: float = SPARK_RECV_TIMEOUT_SECONDS):
+    """
+    one spark round over websocket, yields text deltas as they arrive.
+    blocking websocket-client calls run in threads limited by SPARK_MAX_STREAMS so the event loop is never blocked.
+    """
+    try:
+        ws = await to_thread.run_sync(
+            lambda: create_connection(url, timeout=SPARK_CONNECT_TIMEOUT_SECONDS), limiter=_get_limiter()
+        )
+    except WebSocketBadStatusException as e:
+        if e.status_code in (401, 403):
+            # signature rejected (e.g. clock skew), sign again on the next request
+            _invalidate_signed_url(url)
+        raise SparkError(f"spark handshake failed: {e}")
+
+    conn = SparkConnection(ws)
+    try:
+        ws.settimeout(recv_timeout)
+        await conn.send(json.dumps(body))
+        while True:
+            try:
+                rcv_text = await conn.recv()
+            except WebSocketTimeoutException:
+                raise SparkError(f"spark receive timeout after {recv_timeout}s")
+            content = json.loads(rcv_text)
+            header = content.get("header") or {}
+            if header.get("code") != 0:
+                logger.error(f"spark failed: {content}")
+                raise SparkError(f"spark failed, code: {header.get('code')}, message: {header.get('message')}")
+            choices = (content.get("payload") or {}).get("choices") or {}
+            for item in choices.get("text") or []:
+                if item.get("content"):
+                    yield item["content"]
+            if header.get("status") == 2:
+                break
+    finally:
+        conn.close()
+
+
+async def spark_chat_svc(body: XunfeiSparkChatBody):
+    """
+    chat logic for spark model
+    """
     try:
-        r = _websocket_process(url, body)
+        url, payload = _get_req_param(body)
+        r = "".join([delta async for delta in _websocket_process(url, payload)])
         return AOEResponse(data=r)
     except Exception as e:
         logger.error(e)
@@ -111,3 +224,22 @@ def spark_chat_svc(body: XunfeiSparkChatBody):
             msgCode="-1",
             data=str(e)
         )
+
+
+def spark_chat_stream_svc(request, body: XunfeiSparkChatBody):
+    """
+    chat stream logic for spark model, deltas are pushed as soon as spark sends them
+    """
+
+    async def event_generator_json():
+        try:
+            url, payload = _get_req_param(body)
+            async for delta in _websocket_process(url, payload):
+                if await request.is_disconnected():
+                    break
+                yield json.dumps({"success": "true", "msg": delta}, ensure_ascii=False)
+        except Exception as e:
+            logger.error(f"{e}")
+            yield json.dumps({"success": "false", "msg": str(e)})
+
+    return EventSourceResponse(event_generator_json())
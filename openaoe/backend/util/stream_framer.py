@@ -0,0 +1,137 @@
+import json
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, List, Optional, Union
+
+from openaoe.backend.util.log import log
+
+logger = log(__name__)
+
+
+class LineBuffer:
+    """
+    incremental line splitter for streamed http bodies.
+    chunks may end anywhere (inside a line, inside a multi-byte utf-8 character);
+    everything up to the last line break is decoded once straight from a memoryview
+    of the buffer and only the unfinished tail is kept. \\n and \\r\\n line endings are supported.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def feed(self, chunk: Union[bytes, str]) -> List[str]:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        buf = self._buf
+        # only the new bytes can contain the last line break
+        last = chunk.rfind(b"\n")
+        if last == -1:
+            buf += chunk
+            return []
+        last += len(buf)
+        buf += chunk
+        with memoryview(buf) as view:
+            text = str(view[:last], "utf-8")
+        del buf[:last + 1]
+        lines = text.split("\n")
+        if "\r" in text:
+            lines = [line[:-1] if line.endswith("\r") else line for line in lines]
+        return lines
+
+    def flush(self) -> Optional[str]:
+        """
+        the last line when the body does not end with a line break
+        """
+        if not self._buf:
+            return None
+        line = self._buf.rstrip(b"\r").decode("utf-8")
+        self._buf.clear()
+        return line
+
+
+class SSEDecoder:
+    """
+    incremental server-sent events decoder, feed() returns the data of every completed event.
+    multi-line data fields are joined with \\n, comments and other fields are skipped.
+    """
+
+    def __init__(self):
+        self._lines = LineBuffer()
+        self._data = []
+
+    def _decode(self, lines: List[str]) -> List[str]:
+        events = []
+        data = self._data
+        for line in lines:
+            if not line:
+                if data:
+                    events.append(data[0] if len(data) == 1 else "\n".join(data))
+                    data = []
+            elif line.startswith("data:"):
+                data.append(line[6:] if line.startswith("data: ") else line[5:])
+        self._data = data
+        return events
+
+    def feed(self, chunk: Union[bytes, str]) -> List[str]:
+        return self._decode(self._lines.feed(chunk))
+
+    def flush(self) -> List[str]:
+        """
+        dispatch an event the upstream did not terminate with a blank line
+        """
+        line = self._lines.flush()
+        return self._decode([line, ""] if line else [""])
+
+
+def iter_sse_data(chunks: Iterable[Union[bytes, str]]) -> Iterator[str]:
+    """
+    data of every event of an SSE body, e.g. '{"choices": ...}' or '[DONE]'
+    """
+    decoder = SSEDecoder()
+    for chunk in chunks:
+        if chunk:
+            yield from decoder.feed(chunk)
+    yield from decoder.flush()
+
+
+def _decode_json_line(line: str) -> Optional[dict]:
+    if not line.strip():
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        logger.warning(f"invalid json line, raw: {line[:200]}")
+        return None
+
+
+def iter_ndjson(chunks: Iterable[Union[bytes, str]]) -> Iterator[dict]:
+    """
+    one decoded object per line of a newline delimited JSON body (Ollama style),
+    a malformed line is logged and skipped
+    """
+    lines = LineBuffer()
+    for chunk in chunks:
+        if not chunk:
+            continue
+        for line in lines.feed(chunk):
+            item = _decode_json_line(line)
+            if item is not None:
+                yield item
+    item = _decode_json_line(lines.flush() or "")
+    if item is not None:
+        yield item
+
+
+async def aiter_ndjson(chunks: AsyncIterable[Union[bytes, str]]) -> AsyncIterator[dict]:
+    """
+    async counterpart of iter_ndjson, e.g. over httpx Response.aiter_bytes()
+    """
+    lines = LineBuffer()
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        for line in lines.feed(chunk):
+            item = _decode_json_line(line)
+            if item is not None:
+                yield item
+    item = _decode_json_line(lines.flush() or "")
+    if item is not None:
+        yield item
@@ -1,22 +1,24 @@
 import os
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
 from starlette.responses import HTMLResponse
 
 from openaoe.backend.api.route_claude import router as claude
+from openaoe.backend.api.route_compare import router as compare
 from openaoe.backend.api.route_google import router as google
 from openaoe.backend.api.route_internlm import router as internlm
+from openaoe.backend.api.route_local import router as local
 from openaoe.backend.api.route_minimax import router as minimax
 from openaoe.backend.api.route_openai import router as openai
 from openaoe.backend.api.route_xunfei import router as xunfei
 from openaoe.backend.api.route_mistral import router as mistral
 from openaoe.backend.api.route_ali import router as ali
-from openaoe.backend.config.biz_config import img_out_path, init_config
+from openaoe.backend.config.biz_config import get_biz_config, img_out_path, init_config
+from openaoe.backend.service.sdk_clients import close_clients
 from openaoe.backend.util.log import log
-from openaoe.backend.util.str_util import safe_join
+from openaoe.backend.util.static_files import StaticIndex
 
 
 logger = log(__name__)
@@ -25,6 +27,7 @@ API_VER = 'v1'
 base_dir = os.path.dirname(os.path.abspath(__file__))
 STATIC_RESOURCE_DIR = os.path.join(base_dir, "frontend", "dist")
 ASSETS_RESOURCE_DIR = os.path.join(STATIC_RESOURCE_DIR, "assets")
+STATIC_INDEX = StaticIndex(STATIC_RESOURCE_DIR)
 
 path = img_out_path()
 
@@ -34,27 +37,37 @@ BIZ_CONFIG = init_config()
 app = FastAPI()
 
 
+@app.on_event("startup")
+async def index_static_resources():
+    # 前端构建产物启动时建立索引，请求时不再逐个 stat
+    STATIC_INDEX.scan()
+
+
+@app.on_event("shutdown")
+async def close_sdk_clients():
+    await close_clients()
+
+
 @app.get("/config/json")
 async def get_config_json():
-    return BIZ_CONFIG.json
+    # picks up edits of the YAML without a restart
+    return get_biz_config().json
 
 
 @app.get("/", response_class=HTMLResponse)
 @app.get("/home", response_class=HTMLResponse)
-async def server():
-    return FileResponse(f"{STATIC_RESOURCE_DIR}/index.html")
+async def server(request: Request):
+    return STATIC_INDEX.response(request, "index.html")
 
 
 @app.get("/assets/{path:path}")
-async def build_resource(path: str):
-    static_file = safe_join(ASSETS_RESOURCE_DIR, path)
-    return FileResponse(static_file)
+async def build_resource(path: str, request: Request):
+    return STATIC_INDEX.response(request, f"assets/{path}")
 
 
 @app.get("/{path:path}")
-async def build_resource(path: str):
-    static_file = safe_join(STATIC_RESOURCE_DIR, path)
-    return FileResponse(static_file)
+async def build_resource(path: str, request: Request):
+    return STATIC_INDEX.response(request, path)
 
 
 # add middlewares here if you need
@@ -75,6 +88,8 @@ app.include_router(xunfei, prefix=f"/{API_VER}/xunfei")
 app.include_router(internlm, prefix=f"/{API_VER}/internlm")
 app.include_router(mistral, prefix=f"/{API_VER}/mistral")
 app.include_router(ali, prefix=f"/{API_VER}/ali")
+app.include_router(compare, prefix=f"/{API_VER}/compare")
+app.include_router(local, prefix=f"/{API_VER}/local")
 
 
 def main():
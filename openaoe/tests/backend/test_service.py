@@ -25,3 +25,714 @@ class TestService(unittest.TestCase):
         sign = _calc_authorization(ak, sk, date, host)
         self.assertTrue(sign, "YXBpX2tleT0iYWsiLCBhbGdvcml0aG09ImhtYWMtc2hhMjU2IiwgaGVhZGVycz0iaG9zdCBkYXRlIHJl"
                               "cXVlc3QtbGluZSIsIHNpZ25hdHVyZT0iS2ZMdHdFMk9sWFhDRTdCejJtTjZuRFhkTS8xVnRid24weTIvcTA3V2FLQT0i")
+
+
+class TestCompareService(unittest.TestCase):
+
+    def test_compare_events_multiplex_and_metrics(self):
+        import asyncio
+        import json
+
+        from openaoe.backend.model.compare import CompareChatBody
+        from openaoe.backend.service import service_compare
+
+        async def fast(target, body):
+            for text in ["a", "b", "c"]:
+                yield text
+
+        async def slow(target, body):
+            await asyncio.sleep(0.05)
+            yield "x"
+            raise RuntimeError("upstream closed")
+
+        body = CompareChatBody(prompt="hi", targets=[
+            {"provider": "fast", "model": "m1"},
+            {"provider": "slow", "model": "m2"},
+            {"provider": "unknown", "model": "m3"},
+        ])
+        original = dict(service_compare.STREAMERS)
+        service_compare.STREAMERS.update({"fast": fast, "slow": slow})
+
+        async def collect():
+            return [json.loads(e) async for e in service_compare.compare_events(None, body)]
+
+        try:
+            events = asyncio.run(collect())
+        finally:
+            service_compare.STREAMERS.clear()
+            service_compare.STREAMERS.update(original)
+
+        deltas = "".join(e["msg"] for e in events if e["type"] == "delta" and e["target"] == 0)
+        self.assertEqual(deltas, "abc")
+        summary = events[-1]
+        self.assertEqual(summary["type"], "summary")
+        self.assertEqual([r["success"] for r in summary["results"]], [True, False, False])
+        self.assertEqual(summary["results"][0]["metrics"]["chunks"], 3)
+        self.assertEqual(summary["results"][0]["metrics"]["chars"], 3)
+        self.assertIsNotNone(summary["results"][1]["metrics"]["ttft_ms"])
+        self.assertIsNone(summary["results"][2]["metrics"]["ttft_ms"])
+
+
+class TestModelIndex(unittest.TestCase):
+    MODELS = {
+        "gpt-4": {"provider": "openai", "webui": {}, "api": {"api_base": "https://a", "api_key": "k4"}},
+        "gpt-3.5-turbo-16k": {"provider": "openai", "webui": {}, "api": {"api_base": "https://b", "api_key": "k16"}},
+        "gpt-3.5-turbo": {"provider": "openai", "webui": {}, "api": {"api_base": "https://c", "api_key": "k35"}},
+        "mistral-7b": {"provider": "mistral", "webui": {}, "api": {"api_base": "http://m", "api_path": "/api/chat"}},
+        "abab5-chat": {"provider": "minimax", "webui": {}, "api": {"api_base": "https://mm", "jwt": "j", "group_id": "g"}},
+    }
+
+    def test_resolve_exact_prefix_and_default(self):
+        from openaoe.backend.config.biz_config import ModelIndex
+
+        index = ModelIndex(self.MODELS)
+        self.assertEqual(index.resolve("openai", "gpt-3.5-turbo").api_key, "k35")
+        # a shortened name picks the first matching model in YAML order, as before
+        self.assertEqual(index.resolve("openai", "gpt-3.5").model, "gpt-3.5-turbo-16k")
+        # a dated snapshot falls back to the longest configured prefix
+        self.assertEqual(index.resolve("openai", "gpt-4-0613").model, "gpt-4")
+        self.assertEqual(index.resolve("openai", "gpt-3.5-turbo-0301").model, "gpt-3.5-turbo")
+        self.assertEqual(index.resolve("openai").model, "gpt-4")
+        self.assertIsNone(index.resolve("openai", "claude-1"))
+        self.assertIsNone(index.resolve("claude", "claude-1"))
+
+        mistral = index.resolve("mistral", "mistral-7b")
+        self.assertEqual(mistral.url, "http://m/api/chat")
+        minimax = index.resolve("minimax", "abab5-chat")
+        self.assertEqual((minimax.get("jwt"), minimax.get("group_id"), minimax.api_key), ("j", "g", ""))
+        with self.assertRaises(TypeError):
+            minimax.api["jwt"] = "changed"
+
+    def test_hot_reload(self):
+        import os
+        import tempfile
+        from unittest import mock
+
+        import yaml
+
+        from openaoe.backend.config import biz_config
+
+        saved = (biz_config.BIZ_CONFIG, biz_config.MODEL_INDEX, biz_config._config_path, biz_config._config_mtime)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "config.yaml")
+            with open(path, "w") as f:
+                yaml.safe_dump({"models": self.MODELS}, f)
+            try:
+                biz_config.load_config(path)
+                self.assertEqual(biz_config.get_api_key("openai", "gpt-4"), "k4")
+                self.assertFalse(biz_config.reload_config())
+
+                models = dict(self.MODELS)
+                models["gpt-4"] = {"provider": "openai", "webui": {}, "api": {"api_base": "https://a", "api_key": "new"}}
+                with open(path, "w") as f:
+                    yaml.safe_dump({"models": models}, f)
+                os.utime(path, (0, biz_config._config_mtime + 10))
+                biz_config._next_reload_check = 0
+                self.assertEqual(biz_config.get_endpoint("openai", "gpt-4").api_key, "new")
+                self.assertNotIn("api", biz_config.get_biz_config().json["models"]["gpt-4"])
+
+                # a broken file keeps the running configuration
+                with open(path, "w") as f:
+                    f.write("models: [")
+                os.utime(path, (0, biz_config._config_mtime + 20))
+                self.assertFalse(biz_config.reload_config())
+                self.assertEqual(biz_config.get_api_key("openai", "gpt-4"), "new")
+                self.assertEqual(biz_config.get_base_url("claude", "claude-1"), "")
+                # the broken file is not read again until it changes
+                with mock.patch.object(biz_config, "_read_config") as read:
+                    self.assertFalse(biz_config.reload_config())
+                    read.assert_not_called()
+            finally:
+                (biz_config.BIZ_CONFIG, biz_config.MODEL_INDEX,
+                 biz_config._config_path, biz_config._config_mtime) = saved
+
+
+class TestSdkClients(unittest.TestCase):
+
+    def test_clients_are_cached_bounded_and_evicted_on_config_change(self):
+        import asyncio
+        from unittest import mock
+
+        from openaoe.backend.config import biz_config
+        from openaoe.backend.config.biz_config import ModelIndex
+        from openaoe.backend.service import sdk_clients
+
+        def index(api_key):
+            return ModelIndex({
+                "gpt-4": {"provider": "openai", "webui": {}, "api": {"api_base": "http://a/v1", "api_key": api_key}},
+                "claude-1": {"provider": "claude", "webui": {}, "api": {"api_base": "http://c", "api_key": "kc"}},
+            })
+
+        async def run():
+            first = sdk_clients.get_openai_client("http://a/v1", "k1")
+            self.assertIs(sdk_clients.get_openai_client("http://a/v1", "k1"), first)
+            claude = sdk_clients.get_anthropic_client("http://c", "kc")
+            self.assertIsNot(sdk_clients.get_openai_client("http://a/v1", "k2"), first)
+
+            # least recently used client goes first once the cache is full
+            with mock.patch.object(sdk_clients, "SDK_CLIENT_CACHE_SIZE", 2):
+                sdk_clients.get_anthropic_client("http://c", "kc")
+                sdk_clients.get_openai_client("http://b/v1", "k3")
+            self.assertEqual(
+                [key[1:] for key in sdk_clients._clients],
+                [("http://c", "kc"), ("http://b/v1", "k3")],
+            )
+            self.assertEqual(len(sdk_clients._retiring), 2)
+
+            # a rotated key evicts clients of credentials no model uses anymore, others stay warm
+            with mock.patch.object(biz_config, "MODEL_INDEX", index("k4")):
+                self.assertIs(sdk_clients.get_anthropic_client("http://c", "kc"), claude)
+                self.assertEqual([key[1:] for key in sdk_clients._clients], [("http://c", "kc")])
+            await sdk_clients.close_clients()
+            self.assertFalse(sdk_clients._clients)
+            self.assertFalse(sdk_clients._retiring)
+
+        saved = sdk_clients._index
+        sdk_clients._clients.clear()
+        with mock.patch.object(biz_config, "MODEL_INDEX", index("k1")):
+            sdk_clients._index = biz_config.MODEL_INDEX
+            try:
+                asyncio.run(run())
+            finally:
+                sdk_clients._clients.clear()
+                sdk_clients._index = saved
+
+
+class TestStreamFramer(unittest.TestCase):
+
+    @staticmethod
+    def random_chunks(data: bytes, rng):
+        chunks = []
+        pos = 0
+        while pos < len(data):
+            size = rng.choice([1, 2, 3, 7, 64, 512, 4096])
+            chunks.append(data[pos:pos + size])
+            pos += size
+        return chunks
+
+    def test_sse_random_chunk_boundaries(self):
+        import json
+        import random
+
+        from openaoe.backend.util.stream_framer import iter_sse_data
+
+        rng = random.Random(20240117)
+        events = [json.dumps({"choices": [{"delta": {"content": f"第{i}段 text {i}"}}]}, ensure_ascii=False)
+                  for i in range(200)]
+        body = ""
+        for i, event in enumerate(events):
+            eol = "\r\n" if i % 3 == 0 else "\n"
+            if i % 10 == 0:
+                body += f": keep-alive{eol}"
+            body += f"event: message{eol}data: {event}{eol}{eol}"
+        body += "data: [DONE]\n\n"
+        data = body.encode("utf-8")
+
+        for _ in range(50):
+            got = list(iter_sse_data(self.random_chunks(data, rng)))
+            self.assertEqual(got, events + ["[DONE]"])
+        # several events in one chunk, multi-line data, no trailing blank line
+        self.assertEqual(list(iter_sse_data([b"data: a\ndata: b\n\ndata:c\n\ndata: d"])), ["a\nb", "c", "d"])
+
+    def test_ndjson_random_chunk_boundaries(self):
+        import json
+        import random
+
+        from openaoe.backend.util.stream_framer import iter_ndjson
+
+        rng = random.Random(7)
+        items = [{"message": {"role": "assistant", "content": f"词{i}"}, "done": False} for i in range(300)]
+        items.append({"message": {"role": "assistant", "content": ""}, "done": True})
+        data = "\n".join(json.dumps(item, ensure_ascii=False) for item in items).encode("utf-8")
+
+        for _ in range(50):
+            self.assertEqual(list(iter_ndjson(self.random_chunks(data, rng))), items)
+        self.assertEqual(list(iter_ndjson([b'{"a": 1}\n{broken\n\n{"b"', b': 2}\n'])), [{"a": 1}, {"b": 2}])
+
+    def test_async_ndjson_matches_sync(self):
+        import asyncio
+
+        from openaoe.backend.util.stream_framer import aiter_ndjson
+
+        async def chunks():
+            for chunk in [b'{"a": 1}\n{broken\n\n{"b"', b': 2}\n{"c": "\xe4\xbd', b'\xa0"}']:
+                yield chunk
+
+        async def collect():
+            return [item async for item in aiter_ndjson(chunks())]
+
+        self.assertEqual(asyncio.run(collect()), [{"a": 1}, {"b": 2}, {"c": "你"}])
+
+
+class TestMinimaxStream(unittest.TestCase):
+
+    def run_stream(self, bodies, body_type="json"):
+        import asyncio
+        import json
+        from unittest import mock
+
+        import httpx
+
+        from openaoe.backend.model.minimax import MinimaxChatCompletionBody
+        from openaoe.backend.service import service_minimax
+
+        calls = []
+        real_client = httpx.AsyncClient
+
+        async def handler(request):
+            body = bodies[min(len(calls), len(bodies) - 1)]
+            calls.append(json.loads(request.content))
+
+            async def chunks():
+                # cut through events and utf-8 characters
+                data = body.encode("utf-8")
+                for i in range(0, len(data), 5):
+                    yield data[i:i + 5]
+
+            return httpx.Response(200, content=chunks())
+
+        class Request:
+            async def is_disconnected(self):
+                return False
+
+        async def collect():
+            response = service_minimax.minimax_chat_stream_svc(
+                Request(), MinimaxChatCompletionBody(prompt="hi", stream=True, type=body_type)
+            )
+            return [item async for item in response.body_iterator]
+
+        with mock.patch.object(service_minimax, "_get_req_param",
+                               return_value=("http://minimax/v1/text/chatcompletion", {}, {"stream": True})), \
+                mock.patch.object(service_minimax.httpx, "AsyncClient",
+                                  lambda **kw: real_client(transport=httpx.MockTransport(handler), **kw)):
+            return asyncio.run(collect()), calls
+
+    @staticmethod
+    def event(delta, finish_reason=""):
+        import json
+
+        return "data: " + json.dumps({"choices": [{"delta": delta, "finish_reason": finish_reason}]},
+                                     ensure_ascii=False) + "\n\n"
+
+    def test_stream_is_parsed_once_per_event(self):
+        import json
+
+        body = self.event("你好") + self.event("，世界") + self.event("！", "stop") + self.event("ignored")
+        items, calls = self.run_stream([body])
+        self.assertEqual([json.loads(item)["msg"] for item in items], ["你好", "，世界", "！"])
+        self.assertEqual(len(calls), 1)
+
+        items, _ = self.run_stream([body], body_type="text")
+        self.assertEqual(items, ["你好", "，世界", "！"])
+
+    def test_error_and_retry(self):
+        import json
+
+        error = 'data: {"choices": null, "base_resp": {"status_code": 1004, "status_msg": "auth failed"}}\n'
+        items, _ = self.run_stream([error])
+        self.assertEqual([json.loads(item) for item in items], [{"success": "false", "msg": "auth failed"}])
+
+        # an empty stream is retried, a finished one is not
+        items, calls = self.run_stream(["", self.event("ok", "stop")])
+        self.assertEqual([json.loads(item)["msg"] for item in items], ["ok"])
+        self.assertEqual(len(calls), 2)
+
+
+class OllamaStandIn:
+    """
+    minimal local http server standing in for Ollama: /api/generate (load / unload), /api/ps, /api/chat
+    """
+
+    def __init__(self, reply=("你好", "，", "世界"), delay=0.1):
+        import json
+        import threading
+        import time
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.loads = []
+        self.unloads = []
+        self.resident = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _json(self, data):
+                body = json.dumps(data).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._json({"models": [{"name": name} for name in stand_in.resident]})
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                model = payload["model"]
+                if self.path == "/api/generate":
+                    if payload.get("keep_alive") == 0:
+                        stand_in.unloads.append(model)
+                        stand_in.resident.remove(model)
+                    else:
+                        stand_in.loads.append(model)
+                        stand_in.resident.append(model)
+                    return self._json({"model": model, "done": True})
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                for text in reply:
+                    line = json.dumps({"model": model, "message": {"role": "assistant", "content": text},
+                                       "done": False}, ensure_ascii=False)
+                    # one line written in two pieces, cut inside a utf-8 character
+                    data = (line + "\n").encode()
+                    self.wfile.write(data[:len(data) // 2])
+                    self.wfile.flush()
+                    self.wfile.write(data[len(data) // 2:])
+                    self.wfile.flush()
+                    time.sleep(delay)
+                self.wfile.write(json.dumps({"model": model, "done": True}).encode() + b"\n")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.api_base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestLocalProvider(unittest.TestCase):
+
+    def setUp(self):
+        from unittest import mock
+
+        from openaoe.backend.config import biz_config
+        from openaoe.backend.config.biz_config import ModelIndex
+        from openaoe.backend.service import service_local
+
+        self.stand_in = OllamaStandIn()
+        self.addCleanup(self.stand_in.close)
+        api = {"api_base": self.stand_in.api_base, "engine": "ollama", "max_concurrency": 2, "max_loaded_models": 1}
+        index = ModelIndex({
+            "model-a": {"provider": "local", "webui": {}, "api": {**api, "model": "a"}},
+            "model-b": {"provider": "local", "webui": {}, "api": {**api, "model": "b"}},
+        })
+        for patch in (mock.patch.object(biz_config, "MODEL_INDEX", index),
+                      mock.patch.object(biz_config, "_next_reload_check", float("inf")),
+                      mock.patch.dict(service_local.BACKENDS, clear=True)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_requests_are_queued_per_model_without_thrashing(self):
+        import asyncio
+        import json
+
+        from openaoe.backend.model.local import LocalChatBody
+        from openaoe.backend.service import service_local
+
+        class Request:
+            async def is_disconnected(self):
+                return False
+
+        async def chat(model, after):
+            await asyncio.sleep(after)
+            response = service_local.local_chat_svc(Request(), LocalChatBody(model=model, prompt="hi"))
+            return "".join([json.loads(item)["msg"] async for item in response.body_iterator])
+
+        async def run():
+            # a, then b (needs a's place), then a again while a is still loaded
+            tasks = [asyncio.ensure_future(chat(model, after))
+                     for model, after in (("model-a", 0), ("model-b", 0.05), ("model-a", 0.1))]
+            await asyncio.sleep(0.2)
+            status = (await service_local.local_status_svc()).data[0]
+            replies = await asyncio.gather(*tasks)
+            return replies, status
+
+        replies, status = asyncio.run(run())
+        self.assertEqual(replies, ["你好，世界"] * 3)
+        self.assertEqual(status["queues"]["a"]["active"], 2)
+        self.assertEqual(status["queues"]["b"]["waiting"], 1)
+        # the second request for a joined the loaded model instead of forcing a -> b -> a
+        self.assertEqual(self.stand_in.loads, ["a", "b"])
+        self.assertEqual(self.stand_in.unloads, ["a"])
+
+    def test_idle_model_is_swapped_out_before_a_busy_one(self):
+        import asyncio
+
+        from openaoe.backend.service.service_local import LocalBackend
+
+        async def run():
+            backend = LocalBackend("ollama", self.stand_in.api_base, max_loaded=2)
+            await backend.acquire("a")
+            await backend.acquire("b")
+            await backend.release("b")
+            # a still runs a request, b is idle: c takes b's place instead of waiting for a
+            await asyncio.wait_for(backend.acquire("c"), 1)
+            return list(backend.loaded)
+
+        loaded = asyncio.run(run())
+        self.assertEqual(loaded, ["a", "c"])
+        self.assertEqual(self.stand_in.unloads, ["b"])
+
+    def test_disconnect_closes_the_server_stream_before_release(self):
+        import asyncio
+        from unittest import mock
+
+        from openaoe.backend.model.local import LocalChatBody
+        from openaoe.backend.service import service_local
+
+        events = []
+
+        class Request:
+            # the client is gone as soon as the first delta arrives
+            async def is_disconnected(self):
+                return True
+
+        async def fake_stream(backend, model, body, keep_alive):
+            try:
+                while True:
+                    yield "token"
+            finally:
+                events.append(("closed", backend.queues[model].active))
+
+        async def run():
+            with mock.patch.object(service_local, "_stream_ollama", fake_stream):
+                async for _ in service_local.local_chat_events(Request(), LocalChatBody(model="model-a", prompt="hi")):
+                    pass
+
+        asyncio.run(run())
+        # the stream was closed while the slot was still held
+        self.assertEqual(events, [("closed", 1)])
+
+    def test_compare_mode_streams_local_models(self):
+        import asyncio
+        import json
+
+        from openaoe.backend.model.compare import CompareChatBody
+        from openaoe.backend.service.service_compare import compare_events
+
+        body = CompareChatBody(prompt="hi", targets=[{"provider": "local", "model": "model-a"}])
+
+        async def collect():
+            return [json.loads(e) async for e in compare_events(None, body)]
+
+        events = asyncio.run(collect())
+        self.assertEqual("".join(e["msg"] for e in events if e["type"] == "delta"), "你好，世界")
+        metrics = events[-1]["results"][0]["metrics"]
+        self.assertEqual((metrics["chunks"], metrics["chars"]), (3, 5))
+
+    def test_preload_and_unknown_model(self):
+        import asyncio
+
+        from openaoe.backend.model.local import LocalPreloadBody
+        from openaoe.backend.service import service_local
+
+        async def run():
+            loaded = await service_local.local_preload_svc(LocalPreloadBody(model="model-b"))
+            again = await service_local.local_preload_svc(LocalPreloadBody(model="model-b"))
+            missing = await service_local.local_preload_svc(LocalPreloadBody(model="gpt-4"))
+            return loaded, again, missing
+
+        loaded, again, missing = asyncio.run(run())
+        self.assertEqual([item["model"] for item in loaded.data["loaded"]], ["b"])
+        self.assertEqual(again.data["queues"]["b"]["loads"], 1)
+        self.assertEqual(self.stand_in.loads, ["b"])
+        self.assertEqual(missing.msgCode, "-1")
+
+
+class SparkStandIn:
+    """
+    minimal local websocket server standing in for spark:
+    accepts one connection, reads the request frame, then sends the given frames
+    """
+
+    def __init__(self, frames, stall=False):
+        import socket
+        import threading
+
+        self.frames = frames
+        self.stall = stall
+        self.received = None
+        self.done = threading.Event()
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(1)
+        self.url = f"ws://127.0.0.1:{self.sock.getsockname()[1]}/v2.1/chat"
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    @staticmethod
+    def _recv_exact(conn, n):
+        data = b""
+        while len(data) < n:
+            chunk = conn.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("closed")
+            data += chunk
+        return data
+
+    def _read_frame(self, conn):
+        import struct
+
+        head = self._recv_exact(conn, 2)
+        length = head[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self._recv_exact(conn, 2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self._recv_exact(conn, 8))[0]
+        mask = self._recv_exact(conn, 4)
+        data = self._recv_exact(conn, length)
+        return bytes(b ^ mask[i % 4] for i, b in enumerate(data)).decode()
+
+    @staticmethod
+    def _frame(payload: bytes) -> bytes:
+        import struct
+
+        if len(payload) < 126:
+            return bytes([0x81, len(payload)]) + payload
+        return bytes([0x81, 126]) + struct.pack("!H", len(payload)) + payload
+
+    def _serve(self):
+        import base64
+        import hashlib
+        import json
+        import re
+
+        conn, _ = self.sock.accept()
+        try:
+            request = b""
+            while b"\r\n\r\n" not in request:
+                request += conn.recv(1024)
+            key = re.search(rb"Sec-WebSocket-Key: (\S+)", request, re.I).group(1)
+            accept = base64.b64encode(hashlib.sha1(key + b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11").digest())
+            conn.sendall(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                         b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+            self.received = json.loads(self._read_frame(conn))
+            for frame in self.frames:
+                conn.sendall(self._frame(json.dumps(frame).encode()))
+            if self.stall:
+                self.done.wait(5)
+        finally:
+            conn.close()
+            self.sock.close()
+
+
+def spark_frame(text, status, code=0):
+    return {
+        "header": {"code": code, "message": "Success" if code == 0 else "error", "status": status},
+        "payload": {"choices": {"status": status, "text": [{"role": "assistant", "content": text}]}},
+    }
+
+
+class TestSparkWebsocket(unittest.TestCase):
+
+    def collect(self, url, recv_timeout=5):
+        import asyncio
+
+        from openaoe.backend.service.service_xunfei import _websocket_process
+
+        async def run():
+            return [delta async for delta in _websocket_process(url, {"payload": "hi"}, recv_timeout)]
+
+        return asyncio.run(asyncio.wait_for(run(), 10))
+
+    def test_spark_streams_deltas(self):
+        server = SparkStandIn([spark_frame("你", 0), spark_frame("好", 1), spark_frame("！", 2)])
+        self.assertEqual(self.collect(server.url), ["你", "好", "！"])
+        self.assertEqual(server.received, {"payload": "hi"})
+
+    def test_spark_error_code_and_receive_timeout(self):
+        from openaoe.backend.service.service_xunfei import SparkError
+
+        server = SparkStandIn([spark_frame("", 2, code=10013)])
+        with self.assertRaises(SparkError):
+            self.collect(server.url)
+
+        server = SparkStandIn([spark_frame("你", 0)], stall=True)
+        with self.assertRaisesRegex(SparkError, "timeout"):
+            self.collect(server.url, recv_timeout=0.2)
+        server.done.set()
+
+    def test_spark_runs_on_its_own_threads_and_releases_the_socket_on_cancel(self):
+        import asyncio
+        import time
+        from unittest import mock
+
+        from anyio import to_thread
+
+        from openaoe.backend.service import service_xunfei
+
+        server = SparkStandIn([spark_frame("你", 0)], stall=True)
+        opened = []
+        create_connection = service_xunfei.create_connection
+
+        def connect(url, timeout):
+            opened.append(create_connection(url, timeout=timeout))
+            return opened[-1]
+
+        async def run():
+            async def consume():
+                async for _ in service_xunfei._websocket_process(server.url, {"payload": "hi"}, 5):
+                    pass
+
+            task = asyncio.ensure_future(consume())
+            await asyncio.sleep(0.3)
+            # the blocked recv does not take a thread of the shared default pool
+            borrowed = to_thread.current_default_thread_limiter().borrowed_tokens
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return borrowed
+
+        with mock.patch.object(service_xunfei, "create_connection", connect):
+            self.assertEqual(asyncio.run(run()), 0)
+        ws = opened[0]
+        deadline = time.monotonic() + 2
+        while ws.sock is not None and time.monotonic() < deadline:
+            time.sleep(0.02)
+        # released well before the 5s receive timeout
+        self.assertIsNone(ws.sock)
+        server.done.set()
+
+    def test_compare_mode_streams_spark(self):
+        import asyncio
+        import json
+        from unittest import mock
+
+        from openaoe.backend.model.compare import CompareChatBody
+        from openaoe.backend.service import service_compare, service_xunfei
+
+        server = SparkStandIn([spark_frame("你", 0), spark_frame("好", 2)])
+        body = CompareChatBody(prompt="hi", messages=[{"sender_type": "user", "text": "在吗"}],
+                               targets=[{"provider": "spark", "model": "generalv2", "temperature": 0.5}])
+        built = []
+
+        def req_param(spark_body):
+            built.append(spark_body)
+            return server.url, {"payload": "hi"}
+
+        async def collect():
+            return [json.loads(e) async for e in service_compare.compare_events(None, body)]
+
+        with mock.patch.object(service_xunfei, "_get_req_param", req_param):
+            events = asyncio.run(collect())
+        self.assertEqual("".join(e["msg"] for e in events if e["type"] == "delta"), "你好")
+        self.assertEqual([t.content for t in built[0].payload.message.text], ["在吗", "hi"])
+        self.assertEqual(built[0].parameter.chat.temperature, 0.5)
+
+    def test_spark_signed_url_is_reused_within_ttl(self):
+        from unittest import mock
+
+        from openaoe.backend.service import service_xunfei
+
+        service_xunfei._signed_urls.clear()
+        with mock.patch.object(service_xunfei, "get_current_date", return_value="Wed, 17 Jan 2024 03:11:11 GMT") as date:
+            url = service_xunfei._get_signed_url("wss://spark.example.com", "ak", "sk")
+            self.assertEqual(service_xunfei._get_signed_url("wss://spark.example.com", "ak", "sk"), url)
+            self.assertEqual(date.call_count, 1)
+            self.assertTrue(url.startswith("wss://spark.example.com/v2.1/chat?authorization="))
+
+            service_xunfei._invalidate_signed_url(url)
+            service_xunfei._get_signed_url("wss://spark.example.com", "ak", "sk")
+            self.assertEqual(date.call_count, 2)
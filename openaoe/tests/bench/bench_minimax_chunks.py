@@ -0,0 +1,81 @@
+"""
+per-event decoding cost of the MiniMax stream: the previous code decoded and json.loads-ed every
+line twice (_should_stop, then _parse_chunk_delta); _parse_event does it once into a MinimaxDelta.
+usage (from the repository root): python openaoe/tests/bench/bench_minimax_chunks.py [--events 100000]
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+
+from openaoe.backend.service.service_minimax import _parse_event  # noqa: E402
+from openaoe.backend.util.stream_framer import LineBuffer  # noqa: E402
+
+
+def previous_parse_chunk_delta(chunk):
+    decoded_data = chunk.decode('utf-8')
+    parsed_data = json.loads(decoded_data.replace("data:", ""))
+    return parsed_data['choices'][0]['delta']
+
+
+def previous_should_stop(chunk) -> bool:
+    decoded_data = chunk.decode('utf-8')
+    parsed_data = json.loads(decoded_data.replace("data:", ""))
+    finish_reason = parsed_data['choices'][0].get("finish_reason")
+    return not (finish_reason is None or finish_reason == "")
+
+
+def previous(lines):
+    out = []
+    for chunk in lines:
+        previous_should_stop(chunk)
+        out.append(previous_parse_chunk_delta(chunk))
+    return out
+
+
+def single_pass(body: bytes, chunk_size: int):
+    out = []
+    buffer = LineBuffer()
+    for i in range(0, len(body), chunk_size):
+        for line in buffer.feed(body[i:i + chunk_size]):
+            if line:
+                out.append(_parse_event(line).text)
+    return out
+
+
+def best_of(fn, repeat: int = 3) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=100000)
+    args = parser.parse_args()
+
+    event = {"created": 1700000000, "model": "abab5.5-chat", "reply": "", "choices": [
+        {"index": 0, "finish_reason": "", "delta": "模型的一小段输出 tokens"}
+    ], "usage": {"total_tokens": 0}, "input_sensitive": False, "output_sensitive": False}
+    line = ("data: " + json.dumps(event, ensure_ascii=False)).encode("utf-8")
+    lines = [line] * args.events
+    body = b"\n\n".join(lines) + b"\n\n"
+
+    expected = previous(lines)
+    previous_s = best_of(lambda: previous(lines))
+    print(f"previous (2x decode, lines pre-split)  {previous_s / args.events * 1e6:6.2f} us/event")
+    for chunk_size in (512, 8192):
+        assert single_pass(body, chunk_size) == expected
+        elapsed = best_of(lambda: single_pass(body, chunk_size))
+        print(f"single pass incl. framing, {chunk_size:>5}B chunks {elapsed / args.events * 1e6:6.2f} us/event"
+              f" ({(elapsed / previous_s - 1) * 100:+6.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
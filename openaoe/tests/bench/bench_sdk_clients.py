@@ -0,0 +1,129 @@
+"""
+TTFB of streamed chat completions with a new SDK client per request (previous behaviour)
+versus the cached async clients of backend/service/sdk_clients.py.
+The upstream is a local mock: each new TCP connection pays a simulated TLS handshake,
+then the first token arrives after --ttft seconds.
+usage (from the repository root): python openaoe/tests/bench/bench_sdk_clients.py [--requests 20] [--handshake 0.05]
+"""
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+import uvicorn
+from anthropic import AsyncAnthropic
+from openai import AsyncOpenAI
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+
+from openaoe.backend.service import sdk_clients  # noqa: E402
+
+
+def mock_upstream(handshake: float, ttft: float, tokens: int):
+    seen = set()
+
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        while (await receive()).get("more_body"):
+            pass
+        # a new client port is a new connection, charge the handshake once per connection
+        if scope["client"] not in seen:
+            seen.add(scope["client"])
+            await asyncio.sleep(handshake)
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream")]})
+        await asyncio.sleep(ttft)
+        for i in range(tokens):
+            if scope["path"].endswith("/chat/completions"):
+                data = {"id": "x", "object": "chat.completion.chunk", "created": 0, "model": "m",
+                        "choices": [{"index": 0, "delta": {"content": f"t{i}"}, "finish_reason": None}]}
+                frame = f"data: {json.dumps(data)}\n\n"
+            else:
+                data = {"completion": f"t{i}", "stop_reason": None, "model": "m"}
+                frame = f"event: completion\ndata: {json.dumps(data)}\n\n"
+            await send({"type": "http.response.body", "body": frame.encode(), "more_body": True})
+        tail = "data: [DONE]\n\n" if scope["path"].endswith("/chat/completions") else ""
+        await send({"type": "http.response.body", "body": tail.encode(), "more_body": False})
+
+    return app
+
+
+def start_server(app) -> int:
+    sock = socket.socket()
+    # accepted sockets inherit it; without it Nagle holds the small SSE frames of a reused
+    # connection back for a delayed ACK, which real upstreams do not do
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, log_level="error"))
+    threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return port
+
+
+async def openai_ttfb(client) -> float:
+    started = time.perf_counter()
+    stream = await client.chat.completions.create(
+        model="m", messages=[{"role": "user", "content": "hi"}], stream=True
+    )
+    ttfb = None
+    async for chunk in stream:
+        ttfb = ttfb or time.perf_counter() - started
+    return ttfb
+
+
+async def anthropic_ttfb(client) -> float:
+    started = time.perf_counter()
+    stream = await client.completions.create(
+        prompt="\n\nHuman: hi\n\nAssistant:", max_tokens_to_sample=16, model="m", stream=True
+    )
+    ttfb = None
+    async for msg in stream:
+        ttfb = ttfb or time.perf_counter() - started
+    return ttfb
+
+
+async def run(args, base_url: str) -> dict:
+    cases = {
+        "openai": (openai_ttfb, lambda: AsyncOpenAI(api_key="sk", base_url=f"{base_url}/v1"),
+                   lambda: sdk_clients.get_openai_client(f"{base_url}/v1", "sk")),
+        "anthropic": (anthropic_ttfb, lambda: AsyncAnthropic(api_key="sk", base_url=base_url),
+                      lambda: sdk_clients.get_anthropic_client(base_url, "sk")),
+    }
+    results = {}
+    for name, (measure, new_client, cached_client) in cases.items():
+        per_request = []
+        for _ in range(args.requests):
+            client = new_client()
+            per_request.append(await measure(client))
+            await client.close()
+        cached = [await measure(cached_client()) for _ in range(args.requests)]
+        results[name] = (statistics.median(per_request), statistics.median(cached))
+    await sdk_clients.close_clients()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--handshake", type=float, default=0.05, help="simulated TCP + TLS setup (seconds)")
+    parser.add_argument("--ttft", type=float, default=0.02)
+    parser.add_argument("--tokens", type=int, default=20)
+    args = parser.parse_args()
+
+    port = start_server(mock_upstream(args.handshake, args.ttft, args.tokens))
+    results = asyncio.run(run(args, f"http://127.0.0.1:{port}"))
+    for name, (per_request, cached) in results.items():
+        print(f"{name:<10} new client {per_request * 1000:7.1f} ms   cached {cached * 1000:7.1f} ms"
+              f"   ({(cached / per_request - 1) * 100:+6.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+throughput of backend/util/stream_framer.py on long generations, against a plain
+str-concatenation framer (decode each chunk, append, split on the delimiter).
+both are fed the same body cut at fixed chunk sizes; a decoded event is checked at the end.
+usage (from the repository root): python openaoe/tests/bench/bench_stream_framer.py [--events 50000]
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+
+from openaoe.backend.util.stream_framer import iter_ndjson, iter_sse_data  # noqa: E402
+
+
+def naive_sse(chunks):
+    buffer = ""
+    for chunk in chunks:
+        # errors="ignore" is what a str framer has to do when a chunk cuts a utf-8 character
+        buffer += chunk.decode("utf-8", errors="ignore")
+        while "\n\n" in buffer:
+            event, buffer = buffer.split("\n\n", 1)
+            yield event[6:]
+
+
+def naive_ndjson(chunks):
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk.decode("utf-8", errors="ignore")
+        while "\n" in buffer:
+            line, buffer = buffer.split("\n", 1)
+            yield json.loads(line)
+
+
+def build_bodies(events: int):
+    sse = "".join(
+        "data: " + json.dumps({"choices": [{"delta": {"content": f"token {i} 令牌"}, "finish_reason": None}]},
+                              ensure_ascii=False) + "\n\n"
+        for i in range(events)
+    ).encode("utf-8")
+    ndjson = "".join(
+        json.dumps({"model": "mistral", "message": {"role": "assistant", "content": f"token {i} 令牌"}, "done": False},
+                   ensure_ascii=False) + "\n"
+        for i in range(events)
+    ).encode("utf-8")
+    return sse, ndjson
+
+
+def measure(fn, chunks) -> tuple:
+    started = time.perf_counter()
+    items = list(fn(chunks))
+    return time.perf_counter() - started, items
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=50000)
+    args = parser.parse_args()
+
+    sse, ndjson = build_bodies(args.events)
+    cases = [
+        ("sse", sse, iter_sse_data, naive_sse, lambda items: json.loads(items[-1])["choices"][0]["delta"]["content"]),
+        ("ndjson", ndjson, iter_ndjson, naive_ndjson, lambda items: items[-1]["message"]["content"]),
+    ]
+    expected = f"token {args.events - 1} 令牌"
+    for name, body, framer, naive, last in cases:
+        for size in (64, 512, 4096, 65536):
+            chunks = [body[i:i + size] for i in range(0, len(body), size)]
+            framer_s, items = measure(framer, chunks)
+            assert len(items) == args.events and last(items) == expected
+            naive_s, naive_items = measure(naive, chunks)
+            intact = sum(1 for item in naive_items if "令牌" in json.dumps(item, ensure_ascii=False))
+            print(f"{name:<6} chunk {size:>5}B  framer {len(body) / framer_s / 2 ** 20:7.1f} MB/s"
+                  f"  naive {len(body) / naive_s / 2 ** 20:7.1f} MB/s"
+                  f"  (naive kept {intact}/{args.events} events intact)")
+
+
+if __name__ == "__main__":
+    main()